@@ -18,7 +18,13 @@ Tests for Violin Memory 7000 Series All-Flash Array Common Driver
 """
 import math
 import mock
+import os
+import shutil
+import tempfile
+import time
 
+from eventlet import greenthread
+from oslo_service import loopingcall
 from oslo_utils import units
 
 from cinder import context
@@ -503,6 +509,10 @@ class V7000CommonTestCase(test.TestCase):
         self.driver.container = 'myContainer'
         self.driver.device_id = 'ata-VIOLIN_MEMORY_ARRAY_23109R00000022'
         self.stats = {}
+        v7000_common.FQDN_CACHE.clear()
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        self.conf.violin_state_path = state_dir
 
     def tearDown(self):
         super(V7000CommonTestCase, self).tearDown()
@@ -523,6 +533,12 @@ class V7000CommonTestCase(test.TestCase):
         config.violin_dedup_only_pools = []
         config.violin_dedup_capable_pools = []
         config.violin_pool_allocation_method = 'random'
+        config.violin_stats_full_refresh_interval = 600
+        config.violin_ledger_refresh_interval = 600
+        config.max_over_subscription_ratio = 20.0
+        config.violin_max_poll_interval = 30
+        config.violin_max_copies_per_pool = 4
+        config.violin_image_cache_size_gb = 0
         return config
 
     def setup_mock_concerto(self, m_conf=None):
@@ -580,6 +596,8 @@ class V7000CommonTestCase(test.TestCase):
             'Create resource successfully.',
             VOLUME['id'], size_in_mb, False, False, False, size_in_mb,
             storage_pool_id=DEFAULT_THICK_POOL['storage_pool_id'])
+        self.assertEqual(('PoolA', size_in_mb, size_in_mb),
+                         self.driver.lun_ledger[VOLUME['id']])
         self.assertIsNone(result)
 
     def test_create_thin_lun(self):
@@ -729,6 +747,7 @@ class V7000CommonTestCase(test.TestCase):
         self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
         self.driver._send_cmd = mock.Mock(return_value=response)
         self.driver._delete_lun_snapshot_bookkeeping = mock.Mock()
+        self.driver.lun_ledger[VOLUME['id']] = ('PoolA', 2048, 2048)
 
         result = self.driver._delete_lun(VOLUME)
 
@@ -737,6 +756,7 @@ class V7000CommonTestCase(test.TestCase):
             success_msgs, VOLUME['id'], True)
         self.driver._delete_lun_snapshot_bookkeeping.assert_called_with(
             VOLUME['id'])
+        self.assertNotIn(VOLUME['id'], self.driver.lun_ledger)
 
         self.assertIsNone(result)
 
@@ -777,6 +797,51 @@ class V7000CommonTestCase(test.TestCase):
             response['message'], VOLUME['id'], change_in_size_mb)
         self.assertIsNone(result)
 
+    def test_ledger_extend_lun(self):
+        self.driver.lun_ledger = {
+            'thick': ('PoolA', 2048, 2048),
+            'thin': ('PoolB', 2048, 204),
+        }
+
+        self.driver._ledger_extend_lun('thick', 1024)
+        self.driver._ledger_extend_lun('thin', 1024)
+        self.driver._ledger_extend_lun('unknown', 1024)
+
+        self.assertEqual({'thick': ('PoolA', 3072, 3072),
+                          'thin': ('PoolB', 3072, 204)},
+                         self.driver.lun_ledger)
+
+    @mock.patch.object(v7000_common.api, 'volume_get_all_by_host')
+    def test_reconcile_lun_ledger(self, m_get_all):
+        self.driver.host = 'myhost@violin'
+        self.driver.lun_ledger = {
+            'known': ('PoolA', 1024, 1024),
+            'gone': ('PoolA', 1024, 1024),
+        }
+        m_get_all.return_value = [
+            {'id': 'known', 'size': 2, 'status': 'available',
+             'host': 'myhost@violin#PoolA', 'volume_type_id': None},
+            {'id': 'new', 'size': 10, 'status': 'in-use',
+             'host': 'myhost@violin#PoolB', 'volume_type_id': '1'},
+            {'id': 'dying', 'size': 10, 'status': 'deleting',
+             'host': 'myhost@violin#PoolB', 'volume_type_id': '1'},
+        ]
+        self.driver._process_extra_specs = mock.Mock(
+            return_value={'pool_type': 'thin'})
+        self.driver.image_cache = {'PoolB': {
+            'image1:a': {'lun': 'image-lun', 'size': 1,
+                         'image_id': 'image1', 'last_used': 0}}}
+
+        with mock.patch('time.time', return_value=1000):
+            self.driver._reconcile_lun_ledger()
+
+        m_get_all.assert_called_once_with(mock.ANY, 'myhost@violin')
+        self.assertEqual({'known': ('PoolA', 2048, 1024),
+                          'new': ('PoolB', 10240, 1024),
+                          'image-lun': ('PoolB', 1024, 1024)},
+                         self.driver.lun_ledger)
+        self.assertEqual(1000, self.driver.lun_ledger_time)
+
     def test_extend_lun_new_size_is_too_small(self):
         """Volume extend fails when new size would shrink the volume."""
         new_volume_size = 0
@@ -810,7 +875,7 @@ class V7000CommonTestCase(test.TestCase):
         self.assertIsNone(result)
 
         self.driver._ensure_snapshot_resource_area.assert_called_with(
-            VOLUME_ID)
+            VOLUME_ID, None)
         self.driver._ensure_snapshot_policy.assert_called_with(VOLUME_ID)
         self.driver._send_cmd.assert_called_once_with(
             self.driver.vmem_mg.snapshot.create_lun_snapshot,
@@ -862,7 +927,8 @@ class V7000CommonTestCase(test.TestCase):
             destination=VOLUME['id'],
             storage_pool_id=DEFAULT_THICK_POOL['storage_pool_id'])
         v._wait_for_lun_or_snap_copy.assert_called_once_with(
-            SNAPSHOT['volume_id'], dest_vdev_id=vdev_id)
+            SNAPSHOT['volume_id'], dest_vdev_id=vdev_id,
+            dest_vol_id=VOLUME['id'], strict=False)
 
         self.assertIsNone(result)
 
@@ -892,18 +958,33 @@ class V7000CommonTestCase(test.TestCase):
         self.assertRaises(failure, self.driver._create_volume_from_snapshot,
                           SNAPSHOT, VOLUME)
 
-    def test_create_volume_from_snapshot_fails_for_non_thick_luns(self):
-        """Cloning a volume from a non-thick LUN is not supported."""
-        lun_info = {'subType': 'THIN'}
+    def test_create_volume_from_snapshot_of_thin_lun(self):
+        """A snapshot of a thin LUN is copied into a thin LUN."""
+        response = {'success': True,
+                    'object_id': '12345',
+                    'msg': 'Copy TimeMark successfully.'}
+        lun_info = {'virtualDeviceID': 11111, 'subType': 'THIN'}
+        spec_dict = {'pool_type': 'thick', 'thick': True}
 
         conf = {
             'lun.get_lun_info.return_value': lun_info,
+            'lun.copy_snapshot_to_new_lun.return_value': response,
         }
         self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._process_extra_specs = mock.Mock(
+            return_value=spec_dict)
+        self.driver._get_storage_pool = mock.Mock(
+            return_value=DEFAULT_THIN_POOL)
+        self.driver._wait_for_lun_or_snap_copy = mock.Mock()
 
-        self.assertRaises(exception.ViolinBackendErr,
-                          self.driver._create_volume_from_snapshot,
-                          SNAPSHOT, VOLUME)
+        self.driver._create_volume_from_snapshot(SNAPSHOT, VOLUME)
+
+        size_in_mb = VOLUME['size'] * units.Ki
+        self.driver._get_storage_pool.assert_called_once_with(
+            VOLUME, size_in_mb, 'thin', 'create_lun')
+        self.assertEqual(
+            (DEFAULT_THIN_POOL['storage_pool'], size_in_mb, size_in_mb // 10),
+            self.driver.lun_ledger[VOLUME['id']])
 
     def test_create_consistencygroup_volume_from_snapshot(self):
         """Create a new cinder volume from a given snapshot of a lun."""
@@ -941,7 +1022,8 @@ class V7000CommonTestCase(test.TestCase):
             destination=VOLUME['id'],
             storage_pool_id=DEFAULT_THICK_POOL['storage_pool_id'])
         v._wait_for_lun_or_snap_copy.assert_called_once_with(
-            SNAPSHOT['volume_id'], dest_vdev_id=vdev_id)
+            SNAPSHOT['volume_id'], dest_vdev_id=vdev_id,
+            dest_vol_id=GROUP_VOLUME['id'], strict=False)
         v._ensure_snapshot_resource_area.assert_called_once_with(
             GROUP_VOLUME['id'])
         v._add_to_consistencygroup.assert_called_once_with(
@@ -973,15 +1055,670 @@ class V7000CommonTestCase(test.TestCase):
         result = self.driver._create_lun_from_lun(SRC_VOL, VOLUME)
 
         self.driver._ensure_snapshot_resource_area.assert_called_with(
-            SRC_VOL['id'])
+            SRC_VOL['id'], SRC_VOL)
         self.driver.vmem_mg.lun.copy_lun_to_new_lun.assert_called_with(
             source=SRC_VOL['id'], destination=VOLUME['id'],
             storage_pool_id=DEFAULT_THICK_POOL['storage_pool_id'])
         self.driver._wait_for_lun_or_snap_copy.assert_called_with(
-            SRC_VOL['id'], dest_obj_id=object_id)
+            SRC_VOL['id'], dest_obj_id=object_id,
+            dest_vol_id=VOLUME['id'], strict=False)
+        size_in_mb = VOLUME['size'] * units.Ki
+        self.assertEqual(
+            (DEFAULT_THICK_POOL['storage_pool'], size_in_mb, size_in_mb),
+            self.driver.lun_ledger[VOLUME['id']])
 
         self.assertIsNone(result)
 
+    def test_create_lun_from_lun_to_thin_type(self):
+        """A copy into a thin type only records 10% as allocated."""
+        response = {'success': True,
+                    'object_id': '12345',
+                    'msg': 'Copy Snapshot resource successfully'}
+        spec_dict = {'pool_type': 'thin'}
+        lun_info = {'subType': 'THICK'}
+
+        conf = {
+            'lun.get_lun_info.return_value': lun_info,
+            'lun.copy_lun_to_new_lun.return_value': response,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._ensure_snapshot_resource_area = mock.Mock()
+        self.driver._process_extra_specs = mock.Mock(
+            return_value=spec_dict)
+        self.driver._get_storage_pool = mock.Mock(
+            return_value=DEFAULT_THIN_POOL)
+        self.driver._wait_for_lun_or_snap_copy = mock.Mock()
+
+        self.driver._create_lun_from_lun(SRC_VOL, VOLUME)
+
+        size_in_mb = VOLUME['size'] * units.Ki
+        self.assertEqual(
+            (DEFAULT_THIN_POOL['storage_pool'], size_in_mb, size_in_mb // 10),
+            self.driver.lun_ledger[VOLUME['id']])
+
+    def test_create_lun_from_lun_waits_for_pool_slot(self):
+        """Lun clone out of a busy pool is queued until a slot frees up."""
+        response = {'success': True,
+                    'object_id': '12345',
+                    'msg': 'Copy Snapshot resource successfully'}
+        src_vol = dict(SRC_VOL, host='cinder@violin#thick-pool')
+
+        conf = {
+            'lun.get_lun_info.return_value': {'subType': 'THICK'},
+            'lun.copy_lun_to_new_lun.return_value': response,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._ensure_snapshot_resource_area = mock.Mock()
+        self.driver._process_extra_specs = mock.Mock(
+            return_value={'pool_type': 'thick'})
+        self.driver._get_storage_pool = mock.Mock(
+            return_value=DEFAULT_THICK_POOL)
+        self.driver._wait_for_lun_or_snap_copy = mock.Mock()
+        self.conf.violin_max_copies_per_pool = 1
+
+        scheduler = self.driver.copy_scheduler
+        with scheduler.job('other-project', 'thick-pool', None):
+            clone = greenthread.spawn(self.driver._create_lun_from_lun,
+                                      src_vol, VOLUME)
+            greenthread.sleep(0)
+            self.assertFalse(
+                self.driver.vmem_mg.lun.copy_lun_to_new_lun.called)
+            self.assertEqual(
+                1, scheduler.get_stats()['violin_copy_queue_depth'])
+
+        clone.wait()
+
+        self.assertTrue(self.driver.vmem_mg.lun.copy_lun_to_new_lun.called)
+        self.assertEqual(0, scheduler.get_stats()['violin_copy_queue_depth'])
+
+    def test_copy_scheduler_takes_turns_by_tenant(self):
+        scheduler = v7000_common.CopyScheduler(lambda: 1)
+        started = []
+
+        def copy(tenant, name):
+            with scheduler.job(tenant, 'golden', 'pool1'):
+                started.append(name)
+                greenthread.sleep(0)
+
+        with scheduler.job('p1', 'golden', None):
+            jobs = [greenthread.spawn(copy, 'p1', 'p1-a'),
+                    greenthread.spawn(copy, 'p1', 'p1-b'),
+                    greenthread.spawn(copy, 'p1', 'p1-c'),
+                    greenthread.spawn(copy, 'p2', 'p2-a')]
+            greenthread.sleep(0)
+            self.assertEqual([], started)
+
+        for job in jobs:
+            job.wait()
+
+        self.assertEqual(['p1-a', 'p2-a', 'p1-b', 'p1-c'], started)
+
+    def test_copy_scheduler_limits_each_pool(self):
+        scheduler = v7000_common.CopyScheduler(lambda: 1)
+        started = []
+
+        def copy(name, src_pool, dest_pool):
+            with scheduler.job('p1', src_pool, dest_pool):
+                started.append(name)
+
+        with scheduler.job('p1', 'pool1', 'pool2'):
+            blocked = greenthread.spawn(copy, 'blocked', 'pool3', 'pool2')
+            free = greenthread.spawn(copy, 'free', 'pool3', 'pool4')
+            free.wait()
+            self.assertEqual(['free'], started)
+
+        blocked.wait()
+        self.assertEqual(['free', 'blocked'], started)
+
+    def test_copy_scheduler_unlimited(self):
+        scheduler = v7000_common.CopyScheduler(lambda: 0)
+
+        with scheduler.job('p1', 'pool1', 'pool1'):
+            with scheduler.job('p1', 'pool1', 'pool1'):
+                self.assertEqual(
+                    0, scheduler.get_stats()['violin_copy_queue_depth'])
+
+    def _setup_image_cache(self, entries):
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        self.conf.violin_state_path = state_dir
+        self.conf.violin_image_cache_size_gb = 4
+        self.driver.image_cache = {'PoolA': entries}
+
+    def test_clone_image_from_cache(self):
+        """A cached image lun is cloned and grown to the volume size."""
+        image_meta = {'id': 'image1', 'checksum': 'abc'}
+        entry = {'lun': 'lun1', 'size': 1, 'image_id': 'image1',
+                 'last_used': 0}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({'image1:abc': entry})
+        self.driver._create_lun_from_lun = mock.Mock(return_value=None)
+        self.driver._extend_lun = mock.Mock()
+
+        result = self.driver._clone_image(volume, image_meta)
+
+        self.assertEqual((None, True), result)
+        clone = dict(volume, size=1)
+        src_vol = self.driver._create_lun_from_lun.call_args[0][0]
+        self.assertEqual('lun1', src_vol['id'])
+        self.driver._create_lun_from_lun.assert_called_once_with(
+            src_vol, clone)
+        self.driver._extend_lun.assert_called_once_with(clone, 2)
+        self.assertNotEqual(0, entry['last_used'])
+        self.assertEqual(
+            {'PoolA': {'image1:abc': entry}},
+            self.driver._load_state(v7000_common.CONCERTO_IMAGE_CACHE_STATE))
+
+    def test_clone_image_from_cache_fails(self):
+        """A failed clone drops the cached lun and fetches the image."""
+        image_meta = {'id': 'image1', 'checksum': 'abc'}
+        entry = {'lun': 'lun1', 'size': 2, 'image_id': 'image1',
+                 'last_used': 0}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({'image1:abc': entry})
+        self.driver._create_lun_from_lun = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='gone'))
+        self.driver._delete_lun = mock.Mock()
+
+        result = self.driver._clone_image(volume, image_meta)
+
+        self.assertEqual((None, False), result)
+        self.assertEqual({'PoolA': {}}, self.driver.image_cache)
+        self.assertEqual(
+            [volume['id'], 'lun1'],
+            [c[0][0]['id'] for c in self.driver._delete_lun.call_args_list])
+
+    def test_clone_image_from_cache_keeps_undeletable_lun(self):
+        """The cache entry is kept while its lun cannot be deleted."""
+        image_meta = {'id': 'image1', 'checksum': 'abc'}
+        entry = {'lun': 'lun1', 'size': 2, 'image_id': 'image1',
+                 'last_used': 0}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({'image1:abc': entry})
+        self.driver._create_lun_from_lun = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='busy'))
+
+        def delete(lun_volume):
+            if lun_volume['id'] == 'lun1':
+                raise exception.VolumeIsBusy(volume_name='lun1')
+        self.driver._delete_lun = mock.Mock(side_effect=delete)
+
+        result = self.driver._clone_image(volume, image_meta)
+
+        self.assertEqual((None, False), result)
+        self.assertEqual({'PoolA': {'image1:abc': entry}},
+                         self.driver.image_cache)
+
+    def test_clone_image_from_cache_extend_fails(self):
+        """A clone that cannot be grown is deleted, the cache is kept."""
+        image_meta = {'id': 'image1', 'checksum': 'abc'}
+        entry = {'lun': 'lun1', 'size': 1, 'image_id': 'image1',
+                 'last_used': 0}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({'image1:abc': entry})
+        self.driver._create_lun_from_lun = mock.Mock()
+        self.driver._extend_lun = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='fail'))
+        self.driver._delete_lun = mock.Mock()
+
+        result = self.driver._clone_image(volume, image_meta)
+
+        self.assertEqual((None, False), result)
+        self.driver._delete_lun.assert_called_once_with(
+            dict(volume, size=1))
+        self.assertEqual({'PoolA': {'image1:abc': entry}},
+                         self.driver.image_cache)
+
+    def test_clone_image_skips_unextendable_clone(self):
+        """A smaller cached lun is not cloned into a dedup volume."""
+        image_meta = {'id': 'image1', 'checksum': 'abc'}
+        entry = {'lun': 'lun1', 'size': 1, 'image_id': 'image1',
+                 'last_used': 0}
+        volume = dict(VOLUME, host='cinder@violin#PoolA',
+                      volume_type_id='1')
+        self._setup_image_cache({'image1:abc': entry})
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        type(self.driver.vmem_mg.utility).is_external_head = mock.PropertyMock(
+            return_value=False)
+        self.driver._get_volume_type_extra_spec = mock.Mock(
+            return_value='True')
+        self.driver._create_lun_from_lun = mock.Mock()
+
+        result = self.driver._clone_image(volume, image_meta)
+
+        self.assertEqual((None, False), result)
+        self.assertFalse(self.driver._create_lun_from_lun.called)
+
+    def test_clone_image_not_cached(self):
+        image_meta = {'id': 'image2', 'checksum': 'abc'}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({})
+        self.driver._create_lun_from_lun = mock.Mock()
+
+        result = self.driver._clone_image(volume, image_meta)
+
+        self.assertEqual((None, False), result)
+        self.assertFalse(self.driver._create_lun_from_lun.called)
+
+    def _setup_image_cache_fill(self):
+        self.driver._create_lun_snapshot = mock.Mock()
+        self.driver._create_volume_from_snapshot = mock.Mock()
+        self.driver._delete_lun_snapshot = mock.Mock()
+
+    def test_cache_image_volume_evicts_lru(self):
+        """Caching an image evicts the least recently used image luns."""
+        image_service = mock.Mock()
+        image_service.show.return_value = {'id': 'image3', 'checksum': 'c'}
+        old = {'lun': 'lun1', 'size': 1, 'image_id': 'image1',
+               'last_used': 10}
+        busy = {'lun': 'lun2', 'size': 1, 'image_id': 'image2',
+                'last_used': 5}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({'image1:a': old, 'image2:b': busy})
+        self.conf.violin_image_cache_size_gb = 3
+        self._setup_image_cache_fill()
+
+        def delete(cache_volume):
+            if cache_volume['id'] == 'lun2':
+                raise exception.VolumeIsBusy(volume_name='lun2')
+        self.driver._delete_lun = mock.Mock(side_effect=delete)
+
+        self.driver._cache_image_volume(context.get_admin_context(),
+                                        volume, image_service, 'image3')
+
+        # the TimeMark is taken before the volume is handed over, and
+        # copied in the background
+        snapshot = self.driver._create_lun_snapshot.call_args[0][0]
+        self.driver._create_lun_snapshot.assert_called_once_with(
+            snapshot, volume)
+        self.assertEqual(volume['id'], snapshot['volume_id'])
+        self.assertFalse(self.driver._create_volume_from_snapshot.called)
+        self.assertIn(volume['id'], self.driver.image_cache_sources)
+        greenthread.sleep(0)
+
+        cache_vol = self.driver._create_volume_from_snapshot.call_args[0][1]
+        self.driver._create_volume_from_snapshot.assert_called_once_with(
+            snapshot, cache_vol, in_db=False)
+        self.driver._delete_lun_snapshot.assert_called_once_with(snapshot)
+        self.assertEqual(2, self.driver._delete_lun.call_count)
+        self.assertEqual(['image2:b', 'image3:c'],
+                         sorted(self.driver.image_cache['PoolA']))
+        self.assertEqual(cache_vol['id'], self.driver.image_cache[
+            'PoolA']['image3:c']['lun'])
+        self.assertEqual(set(), self.driver.image_cache_fills)
+        self.assertEqual({}, self.driver.image_cache_sources)
+
+    def test_cache_image_volume_replaces_bigger_lun(self):
+        """An image written to a smaller volume replaces its lun."""
+        image_service = mock.Mock()
+        image_service.show.return_value = {'id': 'image1', 'checksum': 'a'}
+        big = {'lun': 'lun1', 'size': 3, 'image_id': 'image1',
+               'last_used': 10}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({'image1:a': big})
+        self._setup_image_cache_fill()
+        self.driver._delete_lun = mock.Mock()
+
+        self.driver._cache_image_volume(context.get_admin_context(),
+                                        volume, image_service, 'image1')
+        greenthread.sleep(0)
+
+        cache_vol = self.driver._create_volume_from_snapshot.call_args[0][1]
+        self.assertEqual(
+            ['lun1'],
+            [c[0][0]['id'] for c in self.driver._delete_lun.call_args_list])
+        entry = self.driver.image_cache['PoolA']['image1:a']
+        self.assertEqual(cache_vol['id'], entry['lun'])
+        self.assertEqual(2, entry['size'])
+
+    def test_cache_image_volume_keeps_busy_bigger_lun(self):
+        """The new lun is dropped when the one it replaces is busy."""
+        image_service = mock.Mock()
+        image_service.show.return_value = {'id': 'image1', 'checksum': 'a'}
+        big = {'lun': 'lun1', 'size': 3, 'image_id': 'image1',
+               'last_used': 10}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({'image1:a': big})
+        self._setup_image_cache_fill()
+
+        def delete(cache_volume):
+            if cache_volume['id'] == 'lun1':
+                raise exception.VolumeIsBusy(volume_name='lun1')
+        self.driver._delete_lun = mock.Mock(side_effect=delete)
+
+        self.driver._cache_image_volume(context.get_admin_context(),
+                                        volume, image_service, 'image1')
+        greenthread.sleep(0)
+
+        cache_vol = self.driver._create_volume_from_snapshot.call_args[0][1]
+        self.assertEqual(
+            ['lun1', cache_vol['id']],
+            [c[0][0]['id'] for c in self.driver._delete_lun.call_args_list])
+        self.assertEqual({'PoolA': {'image1:a': big}},
+                         self.driver.image_cache)
+
+    def test_cache_image_volume_being_filled(self):
+        """An image is only copied once while its lun is being filled."""
+        image_service = mock.Mock()
+        image_service.show.return_value = {'id': 'image3', 'checksum': 'c'}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        self._setup_image_cache({})
+        self.driver.image_cache_fills.add(('PoolA', 'image3:c'))
+        self._setup_image_cache_fill()
+
+        self.driver._cache_image_volume(context.get_admin_context(),
+                                        volume, image_service, 'image3')
+        greenthread.sleep(0)
+
+        self.assertFalse(self.driver._create_lun_snapshot.called)
+
+    def test_delete_lun_waits_for_image_cache_fill(self):
+        """A volume is only deleted once the cache copy out of it is done."""
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver._delete_lun_snapshot_bookkeeping = mock.Mock()
+        self.driver._send_cmd = mock.Mock()
+        fill = mock.Mock()
+        self.driver.image_cache_sources[VOLUME_ID] = fill
+
+        self.driver._delete_lun(VOLUME)
+
+        fill.wait.assert_called_once_with()
+        self.assertTrue(self.driver._send_cmd.called)
+
+    @mock.patch.object(v7000_common.api, 'volume_get')
+    def test_ensure_snapshot_resource_area_of_cached_lun(self, m_get):
+        """Luns that are not in the cinder DB are passed in."""
+        response = {'success': True, 'msg': 'success'}
+        cache_vol = self.driver._get_image_cache_volume(
+            {'lun': 'lun1', 'size': 1, 'image_id': 'image1'},
+            'cinder@violin#PoolA')
+
+        conf = {
+            'snapshot.lun_has_a_snapshot_resource.return_value': False,
+            'snapshot.create_snapshot_resource.return_value': response,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._process_extra_specs = mock.Mock(
+            return_value={'pool_type': 'thick'})
+        self.driver._get_storage_pool = mock.Mock(
+            return_value=DEFAULT_THICK_POOL)
+
+        self.driver._ensure_snapshot_resource_area('lun1', cache_vol)
+
+        self.assertFalse(m_get.called)
+        self.driver._get_storage_pool.assert_called_once_with(
+            cache_vol, 512, 'thick', None, use_host_pool=False)
+        self.assertIn('lun1', self.driver.luns_with_sra)
+
+    def _setup_migration(self, san_ip='1.1.1.1', pool='PoolB'):
+        self.driver._get_location_info = mock.Mock(
+            return_value='V7000:1.1.1.1')
+        return {'host': 'cinder@violin2#%s' % pool,
+                'capabilities': {'location_info': 'V7000:%s' % san_ip}}
+
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_delete')
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_update')
+    @mock.patch.object(v7000_common.api, 'snapshot_get_all_for_volume',
+                       return_value=[])
+    def test_migrate_volume(self, m_get_snapshots, m_update, m_delete):
+        """A volume is moved to another pool through a temporary lun."""
+        volume = dict(VOLUME, status='available',
+                      host='cinder@violin#PoolA')
+        host = self._setup_migration()
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver._create_lun_from_lun = mock.Mock()
+        calls = []
+        m_update.side_effect = lambda *args: calls.append('update')
+        self.driver._delete_lun = mock.Mock(
+            side_effect=lambda vol: calls.append(vol['id']))
+
+        result = self.driver._migrate_volume(None, volume, host)
+
+        self.assertEqual((True, None), result)
+        moved_vol = dict(volume, host=host['host'])
+        temp_vol = self.driver._create_lun_from_lun.call_args_list[0][0][1]
+        self.assertEqual(host['host'], temp_vol['host'])
+        self.assertNotEqual(VOLUME_ID, temp_vol['id'])
+        self.assertEqual(
+            [mock.call(volume, temp_vol, verify=True, in_db=False),
+             mock.call(temp_vol, moved_vol, verify=True)],
+            self.driver._create_lun_from_lun.call_args_list)
+        self.driver.vmem_mg.lun.get_lun_info.assert_called_once_with(
+            temp_vol['id'])
+        # the temporary lun is on record before the volume's lun goes
+        self.assertEqual(['update', VOLUME_ID, temp_vol['id']], calls)
+        m_update.assert_called_once_with(
+            mock.ANY, VOLUME_ID,
+            {v7000_common.CONCERTO_MOVE_TEMP_LUN_KEY: temp_vol['id']},
+            False)
+        m_delete.assert_called_once_with(
+            mock.ANY, VOLUME_ID, v7000_common.CONCERTO_MOVE_TEMP_LUN_KEY)
+
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_update',
+                       side_effect=exception.ViolinBackendErr(message='db'))
+    @mock.patch.object(v7000_common.api, 'snapshot_get_all_for_volume',
+                       return_value=[])
+    def test_migrate_volume_keeps_source_unless_recorded(self,
+                                                         m_get_snapshots,
+                                                         m_update):
+        """The lun is kept unless the temporary lun is on record."""
+        volume = dict(VOLUME, status='available',
+                      host='cinder@violin#PoolA')
+        host = self._setup_migration()
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver._create_lun_from_lun = mock.Mock()
+        self.driver._delete_lun = mock.Mock()
+
+        self.assertRaises(exception.ViolinBackendErr,
+                          self.driver._migrate_volume, None, volume, host)
+
+        temp_vol = self.driver._create_lun_from_lun.call_args[0][1]
+        self.driver._delete_lun.assert_called_once_with(temp_vol)
+
+    def _setup_move_lun(self, copied=True):
+        response = {'success': True, 'object_id': '12345',
+                    'msg': 'Copy Snapshot resource successfully'}
+
+        conf = {
+            'lun.get_lun_info.return_value': {'subType': 'THICK'},
+            'lun.copy_lun_to_new_lun.return_value': response,
+            'snapshot.lun_has_a_snapshot_resource.return_value': False,
+            'snapshot.create_snapshot_resource.return_value': response,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._process_extra_specs = mock.Mock(
+            return_value={'pool_type': 'thick'})
+        self.driver._get_storage_pool = mock.Mock(
+            return_value=DEFAULT_THICK_POOL)
+        self.driver._wait_for_lun_or_snap_copy = mock.Mock(
+            return_value=copied)
+        self.driver._delete_lun = mock.Mock()
+
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_delete')
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_update')
+    @mock.patch.object(v7000_common.api, 'volume_get')
+    @mock.patch.object(v7000_common.api, 'snapshot_get_all_for_volume',
+                       return_value=[])
+    def test_migrate_volume_copies_through_temp_lun(self, m_get_snapshots,
+                                                    m_get, m_update,
+                                                    m_delete):
+        """The temporary lun is copied back without the cinder DB."""
+        volume = dict(VOLUME, status='available',
+                      host='cinder@violin#PoolA')
+        host = self._setup_migration()
+        self._setup_move_lun()
+
+        result = self.driver._migrate_volume(None, volume, host)
+
+        self.assertEqual((True, None), result)
+        self.assertFalse(m_get.called)
+        copies = self.driver.vmem_mg.lun.copy_lun_to_new_lun.call_args_list
+        temp_id = copies[0][1]['destination']
+        self.assertEqual(
+            [mock.call(source=VOLUME_ID, destination=temp_id,
+                       storage_pool_id=DEFAULT_THICK_POOL['storage_pool_id']),
+             mock.call(source=temp_id, destination=VOLUME_ID,
+                       storage_pool_id=DEFAULT_THICK_POOL['storage_pool_id'])],
+            copies)
+        # no copy progress is published for the temporary lun
+        waits = self.driver._wait_for_lun_or_snap_copy.call_args_list
+        self.assertEqual([None, VOLUME_ID],
+                         [c[1]['dest_vol_id'] for c in waits])
+        self.assertIn(temp_id, self.driver.luns_with_sra)
+        self.assertEqual(
+            [VOLUME_ID, temp_id],
+            [c[0][0]['id'] for c in self.driver._delete_lun.call_args_list])
+
+    @mock.patch.object(v7000_common.api, 'snapshot_get_all_for_volume',
+                       return_value=[])
+    def test_migrate_volume_keeps_source_on_copy_failure(self,
+                                                         m_get_snapshots):
+        """The lun is kept unless its copy is seen to complete."""
+        volume = dict(VOLUME, status='available',
+                      host='cinder@violin#PoolA')
+        host = self._setup_migration()
+        self._setup_move_lun(copied=False)
+
+        self.assertRaises(exception.ViolinBackendErr,
+                          self.driver._migrate_volume, None, volume, host)
+
+        self.assertEqual(
+            1, self.driver.vmem_mg.lun.copy_lun_to_new_lun.call_count)
+        temp_vol = self.driver._delete_lun.call_args[0][0]
+        self.assertNotEqual(VOLUME_ID, temp_vol['id'])
+        self.driver._delete_lun.assert_called_once_with(temp_vol)
+
+    def test_migrate_volume_same_pool(self):
+        volume = dict(VOLUME, status='available',
+                      host='cinder@violin#PoolB')
+        self.driver._create_lun_from_lun = mock.Mock()
+
+        with mock.patch.object(v7000_common.api,
+                               'snapshot_get_all_for_volume',
+                               return_value=[]):
+            result = self.driver._migrate_volume(
+                None, volume, self._setup_migration())
+
+        self.assertEqual((True, None), result)
+        self.assertFalse(self.driver._create_lun_from_lun.called)
+
+    def test_migrate_volume_other_array(self):
+        volume = dict(VOLUME, status='available')
+        self.driver._create_lun_from_lun = mock.Mock()
+
+        result = self.driver._migrate_volume(
+            None, volume, self._setup_migration(san_ip='9.9.9.9'))
+
+        self.assertEqual((False, None), result)
+        self.assertFalse(self.driver._create_lun_from_lun.called)
+
+    def test_migrate_volume_attached(self):
+        volume = dict(VOLUME, status='in-use', attach_status='attached')
+        self.driver._create_lun_from_lun = mock.Mock()
+
+        result = self.driver._migrate_volume(
+            None, volume, self._setup_migration())
+
+        self.assertEqual((False, None), result)
+        self.assertFalse(self.driver._create_lun_from_lun.called)
+
+    def _setup_retype(self, old_specs, new_specs):
+        def process_extra_specs(volume):
+            specs = old_specs if volume['volume_type_id'] is None else (
+                new_specs)
+            return dict(specs, thick=specs['pool_type'] == 'thick')
+        self.driver._process_extra_specs = mock.Mock(
+            side_effect=process_extra_specs)
+        self.driver._get_violin_extra_spec = mock.Mock(return_value=None)
+        self.driver._move_lun = mock.Mock()
+
+    def test_retype_in_place(self):
+        """Retypes keeping the layout and pool change no data."""
+        specs = {'pool_type': 'thick', 'lun_encryption': False}
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        host = self._setup_migration(pool='PoolA')
+        self._setup_retype(specs, specs)
+
+        result = self.driver._retype(None, volume, {'id': 'type2'}, {},
+                                     host)
+
+        self.assertTrue(result)
+        self.assertFalse(self.driver._move_lun.called)
+
+    def test_retype_new_pool_type(self):
+        """Retypes changing the layout copy the lun on the array."""
+        volume = dict(VOLUME, status='retyping', previous_status='available',
+                      attach_status='detached', host='cinder@violin#PoolA')
+        host = self._setup_migration(pool='PoolA')
+        self._setup_retype({'pool_type': 'thick', 'lun_encryption': False},
+                           {'pool_type': 'thin', 'lun_encryption': False})
+
+        with mock.patch.object(v7000_common.api,
+                               'snapshot_get_all_for_volume',
+                               return_value=[]):
+            result = self.driver._retype(None, volume, {'id': 'type2'}, {},
+                                         host)
+
+        self.assertTrue(result)
+        self.driver._move_lun.assert_called_once_with(
+            volume, dict(volume, volume_type_id='type2', host=host['host']))
+
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_delete')
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_update')
+    @mock.patch.object(v7000_common.api, 'volume_get')
+    @mock.patch.object(v7000_common.api, 'snapshot_get_all_for_volume',
+                       return_value=[])
+    def test_retype_copies_through_temp_lun(self, m_get_snapshots, m_get,
+                                            m_update, m_delete):
+        """A retyped lun is copied back without the cinder DB."""
+        volume = dict(VOLUME, status='retyping', previous_status='available',
+                      attach_status='detached', host='cinder@violin#PoolA')
+        host = self._setup_migration(pool='PoolA')
+        self._setup_move_lun()
+        self._setup_retype({'pool_type': 'thick', 'lun_encryption': False},
+                           {'pool_type': 'thin', 'lun_encryption': False})
+        del self.driver._move_lun
+
+        result = self.driver._retype(None, volume, {'id': 'type2'}, {},
+                                     host)
+
+        self.assertTrue(result)
+        self.assertFalse(m_get.called)
+        copies = self.driver.vmem_mg.lun.copy_lun_to_new_lun.call_args_list
+        temp_id = copies[0][1]['destination']
+        self.assertEqual([VOLUME_ID, temp_id],
+                         [c[1]['source'] for c in copies])
+        self.assertEqual(VOLUME_ID, copies[1][1]['destination'])
+        self.assertEqual(
+            [VOLUME_ID, temp_id],
+            [c[0][0]['id'] for c in self.driver._delete_lun.call_args_list])
+
+    def test_retype_in_use(self):
+        """Attached volumes are left to the generic retype."""
+        volume = dict(VOLUME, status='retyping', previous_status='in-use',
+                      attach_status='attached', host='cinder@violin#PoolA')
+        host = self._setup_migration(pool='PoolA')
+        self._setup_retype({'pool_type': 'thick', 'lun_encryption': False},
+                           {'pool_type': 'thin', 'lun_encryption': False})
+
+        result = self.driver._retype(None, volume, {'id': 'type2'}, {},
+                                     host)
+
+        self.assertFalse(result)
+        self.assertFalse(self.driver._move_lun.called)
+
+    def test_retype_encryption_change(self):
+        volume = dict(VOLUME, host='cinder@violin#PoolA')
+        host = self._setup_migration(pool='PoolA')
+        self._setup_retype({'pool_type': 'thick', 'lun_encryption': False},
+                           {'pool_type': 'thick', 'lun_encryption': True})
+
+        result = self.driver._retype(None, volume, {'id': 'type2'}, {},
+                                     host)
+
+        self.assertFalse(result)
+        self.assertFalse(self.driver._move_lun.called)
+
     def test_create_lun_from_lun_fails(self):
         """Lun full clone detects errors properly."""
         failure = exception.ViolinBackendErr
@@ -997,18 +1734,84 @@ class V7000CommonTestCase(test.TestCase):
         self.assertRaises(failure,
                           self.driver._create_lun_from_lun, SRC_VOL, VOLUME)
 
-    def test_create_lun_from_lun_fails_for_non_thick_luns(self):
-        """Cloning a volume from a non-thick LUN is not supported."""
-        failure = exception.ViolinBackendErr
+    def test_create_lun_from_lun_of_thin_lun(self):
+        """A thin LUN is cloned by copying a temporary TimeMark."""
         lun_info = {'subType': 'THIN'}
 
         conf = {
             'lun.get_lun_info.return_value': lun_info,
         }
         self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._create_lun_snapshot = mock.Mock()
+        self.driver._create_volume_from_snapshot = mock.Mock()
+        self.driver._delete_lun_snapshot = mock.Mock()
 
-        self.assertRaises(failure,
-                          self.driver._create_lun_from_lun, SRC_VOL, VOLUME)
+        result = self.driver._create_lun_from_lun(SRC_VOL, VOLUME)
+
+        snapshot = self.driver._create_lun_snapshot.call_args[0][0]
+        self.assertEqual(SRC_VOL['id'], snapshot['volume_id'])
+        self.driver._create_lun_snapshot.assert_called_once_with(
+            snapshot, SRC_VOL)
+        self.driver._create_volume_from_snapshot.assert_called_once_with(
+            snapshot, VOLUME, verify=False, in_db=True)
+        self.driver._delete_lun_snapshot.assert_called_once_with(snapshot)
+        self.assertFalse(self.driver.vmem_mg.lun.copy_lun_to_new_lun.called)
+        self.assertIsNone(result)
+
+    def test_create_lun_from_lun_of_dedup_lun_fails(self):
+        """The temporary TimeMark is deleted when the copy fails."""
+        failure = exception.ViolinBackendErr
+        lun_info = {'subType': 'DEDUP'}
+
+        conf = {
+            'lun.get_lun_info.return_value': lun_info,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._create_lun_snapshot = mock.Mock()
+        self.driver._create_volume_from_snapshot = mock.Mock(
+            side_effect=failure(message='fail'))
+        self.driver._delete_lun_snapshot = mock.Mock(
+            side_effect=failure(message='busy'))
+
+        self.assertRaisesRegexp(failure, 'fail',
+                                self.driver._create_lun_from_lun,
+                                SRC_VOL, VOLUME)
+        snapshot = self.driver._delete_lun_snapshot.call_args[0][0]
+        self.assertEqual({SRC_VOL['id']: [snapshot['id']]},
+                         self.driver.leftover_timemarks)
+
+    def test_delete_lun_removes_leftover_timemarks(self):
+        """Temp TimeMarks left by a clone go before the bookkeeping."""
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver.leftover_timemarks = {VOLUME_ID: ['snap1', 'snap2']}
+        calls = []
+        self.driver._delete_lun_snapshot = mock.Mock(
+            side_effect=lambda snap: calls.append(snap['id']))
+        self.driver._delete_lun_snapshot_bookkeeping = mock.Mock(
+            side_effect=lambda vol_id: calls.append('bookkeeping'))
+        self.driver._send_cmd = mock.Mock()
+
+        self.driver._delete_lun(VOLUME)
+
+        self.assertEqual(['snap1', 'snap2', 'bookkeeping'], calls)
+        self.assertEqual({}, self.driver.leftover_timemarks)
+
+    def test_delete_lun_keeps_undeletable_leftover_timemarks(self):
+        """The lun is kept while a leftover TimeMark is still there."""
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver.leftover_timemarks = {VOLUME_ID: ['snap1', 'snap2']}
+        self.driver._delete_lun_snapshot = mock.Mock(
+            side_effect=[None, exception.ViolinBackendErr(message='busy')])
+        self.driver._delete_lun_snapshot_bookkeeping = mock.Mock()
+        self.driver._send_cmd = mock.Mock()
+
+        self.assertRaises(exception.ViolinBackendErr,
+                          self.driver._delete_lun, VOLUME)
+
+        self.assertEqual({VOLUME_ID: ['snap2']},
+                         self.driver.leftover_timemarks)
+        self.assertFalse(self.driver._delete_lun_snapshot_bookkeeping.called)
+        self.assertFalse(self.driver._send_cmd.called)
 
     def test_create_consistencygroup_lun_from_lun(self):
         """Lun clone with a consistency group specified works ok."""
@@ -1043,7 +1846,8 @@ class V7000CommonTestCase(test.TestCase):
             source=SRC_VOL['id'], destination=vol['id'],
             storage_pool_id=DEFAULT_THICK_POOL['storage_pool_id'])
         self.driver._wait_for_lun_or_snap_copy.assert_called_once_with(
-            SRC_VOL['id'], dest_obj_id=object_id)
+            SRC_VOL['id'], dest_obj_id=object_id,
+            dest_vol_id=vol['id'], strict=False)
         self.driver._add_to_consistencygroup.assert_called_once_with(
             vol['consistencygroup_id'], vol['id'])
 
@@ -1166,7 +1970,7 @@ class V7000CommonTestCase(test.TestCase):
         x = v7000_common
         self.driver._process_extra_specs.assert_called_once_with(vol)
         self.driver._get_storage_pool.assert_called_once_with(
-            vol, snap_size_mb, pool_type, None)
+            vol, snap_size_mb, pool_type, None, use_host_pool=False)
         v.snapshot.create_snapshot_resource.assert_called_once_with(
             lun=VOLUME_ID,
             size=snap_size_mb,
@@ -1210,7 +2014,7 @@ class V7000CommonTestCase(test.TestCase):
         x = v7000_common
         self.driver._process_extra_specs.assert_called_once_with(vol)
         self.driver._get_storage_pool.assert_called_once_with(
-            vol, snap_size_mb, pool_type, None)
+            vol, snap_size_mb, pool_type, None, use_host_pool=False)
         v.snapshot.create_snapshot_resource.assert_called_once_with(
             lun=VOLUME_ID,
             size=snap_size_mb,
@@ -1278,6 +2082,65 @@ class V7000CommonTestCase(test.TestCase):
         v.snapshot.lun_has_a_snapshot_policy.assert_called_once_with(
             lun=VOLUME_ID)
 
+    def test_ensure_snapshot_resource_area_cached(self):
+        """A LUN already known to have an SRA is not checked again."""
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver.luns_with_sra.add(VOLUME_ID)
+
+        with mock.patch('cinder.db.sqlalchemy.api.volume_get') as m_get:
+            result = self.driver._ensure_snapshot_resource_area(VOLUME_ID)
+
+        v = self.driver.vmem_mg
+        self.assertIsNone(result)
+        self.assertFalse(m_get.called)
+        self.assertFalse(v.snapshot.lun_has_a_snapshot_resource.called)
+
+    @mock.patch.object(context, 'get_admin_context')
+    def test_ensure_snapshot_resource_area_records_state(
+            self, m_get_admin_context):
+        conf = {
+            'snapshot.lun_has_a_snapshot_resource.return_value': True,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        with mock.patch('cinder.db.sqlalchemy.api.volume_get',
+                        return_value=VOLUME.copy()):
+            self.driver._ensure_snapshot_resource_area(VOLUME_ID)
+            self.driver._ensure_snapshot_resource_area(VOLUME_ID)
+
+        v = self.driver.vmem_mg
+        self.assertIn(VOLUME_ID, self.driver.luns_with_sra)
+        v.snapshot.lun_has_a_snapshot_resource.assert_called_once_with(
+            lun=VOLUME_ID)
+
+    def test_ensure_snapshot_policy_cached(self):
+        """A LUN already known to have a policy is not checked again."""
+        conf = {
+            'snapshot.lun_has_a_snapshot_policy.return_value': True,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        self.driver._ensure_snapshot_policy(VOLUME_ID)
+        self.driver._ensure_snapshot_policy(VOLUME_ID)
+
+        v = self.driver.vmem_mg
+        self.assertIn(VOLUME_ID, self.driver.luns_with_snapshot_policy)
+        v.snapshot.lun_has_a_snapshot_policy.assert_called_once_with(
+            lun=VOLUME_ID)
+
+    def test_create_lun_snapshot_failure_clears_cached_state(self):
+        failure = exception.ViolinBackendErr
+
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver.luns_with_sra.add(VOLUME_ID)
+        self.driver.luns_with_snapshot_policy.add(VOLUME_ID)
+        self.driver._send_cmd = mock.Mock(side_effect=failure(message='x'))
+
+        self.assertRaises(failure, self.driver._create_lun_snapshot,
+                          SNAPSHOT)
+        self.assertNotIn(VOLUME_ID, self.driver.luns_with_sra)
+        self.assertNotIn(VOLUME_ID, self.driver.luns_with_snapshot_policy)
+
     def test_delete_lun_snapshot_bookkeeping(self):
         result_dict = {'success': True, 'msg': 'Successful'}
 
@@ -1287,11 +2150,15 @@ class V7000CommonTestCase(test.TestCase):
             'snapshot.delete_snapshot_resource.return_value': None,
         }
         self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver.luns_with_sra.add(VOLUME_ID)
+        self.driver.luns_with_snapshot_policy.add(VOLUME_ID)
 
         result = self.driver._delete_lun_snapshot_bookkeeping(
             volume_id=VOLUME_ID)
 
         self.assertIsNone(result)
+        self.assertNotIn(VOLUME_ID, self.driver.luns_with_sra)
+        self.assertNotIn(VOLUME_ID, self.driver.luns_with_snapshot_policy)
 
         v = self.driver.vmem_mg
         v.snapshot.get_snapshots.assert_called_with(VOLUME_ID)
@@ -1300,6 +2167,30 @@ class V7000CommonTestCase(test.TestCase):
         v.snapshot.delete_snapshot_resource.assert_called_once_with(
             lun=VOLUME_ID)
 
+    def test_save_and_load_state(self):
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        self.conf.violin_state_path = os.path.join(state_dir, 'violin')
+        data = {'interfaces': ['1.2.3.4'], 'version': '7.5.6'}
+
+        self.driver._save_state('test', data)
+
+        self.assertEqual(data, self.driver._load_state('test'))
+        self.assertEqual(['test-%s.json' % self.conf.san_ip],
+                         os.listdir(self.conf.violin_state_path))
+
+    def test_load_state_missing_or_corrupt(self):
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        self.conf.violin_state_path = state_dir
+
+        self.assertIsNone(self.driver._load_state('test'))
+
+        with open(self.driver._get_state_file('test'), 'w') as f:
+            f.write('{not json')
+
+        self.assertIsNone(self.driver._load_state('test'))
+
     def test_compress_snapshot_id(self):
         test_snap_id = "12345678-abcd-1234-cdef-0123456789ab"
         expected = "12345678abcd1234cdef0123456789ab"
@@ -1341,6 +2232,177 @@ class V7000CommonTestCase(test.TestCase):
             SRC_VOL['id'])
         self.assertTrue(result)
 
+    def _new_schedule(self):
+        # poll on every tick
+        return v7000_common.PollSchedule(0, min_interval=0)
+
+    @mock.patch('oslo_service.loopingcall.FixedIntervalLoopingCall')
+    def test_copy_poller_shares_status_requests(self, m_looping_call):
+        get_status = mock.Mock(side_effect=[
+            ('dest1', 512, 50),
+            ('dest2', None, 100),
+        ])
+        poller = v7000_common.CopyPoller(get_status, self._new_schedule)
+
+        done1 = poller.watch('lun', 'src', 'dest1')
+        done2 = poller.watch('lun', 'src', 'dest2')
+        m_looping_call.assert_called_once_with(poller._poll)
+
+        # dest1 is copying, dest2 is queued behind it
+        poller._poll()
+        self.assertFalse(done1.ready())
+        self.assertFalse(done2.ready())
+
+        # dest1 is done, dest2 has completed
+        self.assertRaises(loopingcall.LoopingCallDone, poller._poll)
+        self.assertTrue(done1.wait())
+        self.assertTrue(done2.wait())
+
+        get_status.assert_has_calls([mock.call('lun', 'src'),
+                                     mock.call('lun', 'src')])
+        self.assertEqual({}, poller._waiters)
+        self.assertIsNone(poller._timer)
+
+    @mock.patch('oslo_service.loopingcall.FixedIntervalLoopingCall')
+    def test_copy_poller_strict(self, m_looping_call):
+        """Strict waiters do not take another copy as theirs being done."""
+        get_status = mock.Mock(return_value=('dest3', 512, 50))
+        poller = v7000_common.CopyPoller(get_status, self._new_schedule)
+
+        strict = poller.watch('lun', 'src', 'dest1', strict=True)
+        loose = poller.watch('lun', 'src', 'dest2')
+
+        self.assertRaises(loopingcall.LoopingCallDone, poller._poll)
+        self.assertFalse(strict.wait())
+        self.assertTrue(loose.wait())
+
+    @mock.patch('oslo_service.loopingcall.FixedIntervalLoopingCall')
+    def test_copy_poller_error(self, m_looping_call):
+        get_status = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='fail'))
+        poller = v7000_common.CopyPoller(get_status, self._new_schedule)
+
+        done = poller.watch('snapshot', 'src', 11111)
+
+        self.assertRaises(loopingcall.LoopingCallDone, poller._poll)
+        self.assertRaises(exception.ViolinBackendErr, done.wait)
+
+    @mock.patch('oslo_service.loopingcall.FixedIntervalLoopingCall')
+    def test_copy_poller_malformed_status(self, m_looping_call):
+        """A status that cannot be read fails only the waiters of its copy."""
+        statuses = {'bad': ('dest1',), 'good': ('dest2', None, 100)}
+        poller = v7000_common.CopyPoller(
+            lambda kind, src: statuses[src], self._new_schedule)
+
+        bad = poller.watch('lun', 'bad', 'dest1')
+        good = poller.watch('lun', 'good', 'dest2')
+
+        self.assertRaises(loopingcall.LoopingCallDone, poller._poll)
+        self.assertRaises(IndexError, bad.wait)
+        self.assertTrue(good.wait())
+        self.assertEqual({}, poller._waiters)
+        self.assertIsNone(poller._timer)
+
+    @mock.patch('oslo_service.loopingcall.FixedIntervalLoopingCall')
+    def test_copy_poller_late_waiter_waits_for_next_tick(self,
+                                                         m_looping_call):
+        poller = v7000_common.CopyPoller(None, self._new_schedule)
+        late = []
+
+        def get_status(kind, src):
+            if not late:
+                late.append(poller.watch(kind, src, 'dest2'))
+            return ('dest1', None, 100)
+
+        poller.get_status = get_status
+        poller.watch('lun', 'src', 'dest1')
+
+        poller._poll()
+
+        self.assertFalse(late[0].ready())
+        self.assertEqual(1, len(poller._waiters[('lun', 'src')]))
+
+    @mock.patch('oslo_service.loopingcall.FixedIntervalLoopingCall')
+    def test_copy_poller_skips_sources_not_due(self, m_looping_call):
+        get_status = mock.Mock(return_value=('dest1', 512, 50))
+        poller = v7000_common.CopyPoller(get_status, self._new_schedule)
+        poller.watch('lun', 'src', 'dest1')
+        schedule, due = poller._schedules[('lun', 'src')]
+        poller._schedules[('lun', 'src')] = (schedule, time.time() + 60)
+
+        poller._poll()
+
+        self.assertFalse(get_status.called)
+
+    def test_poll_schedule_backs_off(self):
+        schedule = v7000_common.PollSchedule(4, min_interval=1)
+
+        intervals = [schedule.next_interval() for i in range(5)]
+
+        self.assertEqual([1.5, 2.25, 3.375, 4, 4], intervals)
+        self.assertIsNone(schedule.eta)
+
+    def test_poll_schedule_follows_progress(self):
+        with mock.patch('time.time', return_value=1000):
+            schedule = v7000_common.PollSchedule(30, min_interval=1)
+
+        # 10% done in 20s, so about 180s left
+        with mock.patch('time.time', return_value=1020):
+            interval = schedule.next_interval(10)
+
+        self.assertEqual(30, interval)
+        self.assertEqual(1200, schedule.eta)
+
+        # 90% done in 90s, so about 10s left
+        with mock.patch('time.time', return_value=1090):
+            interval = schedule.next_interval(90)
+
+        self.assertEqual(2.5, interval)
+        self.assertEqual(1100, schedule.eta)
+
+    @mock.patch('oslo_service.loopingcall.FixedIntervalLoopingCall')
+    def test_copy_poller_reports_progress(self, m_looping_call):
+        get_status = mock.Mock(return_value=('dest1', 512, 50))
+        report_progress = mock.Mock()
+        poller = v7000_common.CopyPoller(get_status, self._new_schedule,
+                                         report_progress)
+
+        poller.watch('lun', 'src', 'dest1', 'vol1')
+        poller.watch('lun', 'src', 'dest1')
+        poller._poll()
+
+        # only waiters that name their volume have progress reported
+        report_progress.assert_called_once_with('vol1', 512, 50, mock.ANY)
+
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_update')
+    def test_report_copy_progress(self, m_update):
+        with mock.patch('time.time', return_value=1000):
+            self.driver._report_copy_progress('vol1', 100, 10, None)
+        with mock.patch('time.time', return_value=1010):
+            self.driver._report_copy_progress('vol1', 200, 20, None)
+        with mock.patch('time.time', return_value=1040):
+            self.driver._report_copy_progress('vol1', 700, 70, 1060)
+
+        # the update at 1010 was throttled
+        self.assertEqual(2, m_update.call_count)
+        m_update.assert_called_with(
+            mock.ANY, 'vol1',
+            {'violin_copy_percent': '70',
+             'violin_copy_mbps': '15.0',
+             'violin_copy_eta': '1970-01-01T00:17:40'},
+            False)
+
+    @mock.patch.object(v7000_common.api, 'volume_admin_metadata_delete')
+    def test_clear_copy_progress(self, m_delete):
+        self.driver.copy_progress['vol1'] = (1000, 100)
+
+        self.driver._clear_copy_progress('vol1')
+        self.driver._clear_copy_progress('vol2')
+
+        self.assertEqual(len(v7000_common.CONCERTO_COPY_PROGRESS_KEYS),
+                         m_delete.call_count)
+        self.assertEqual({}, self.driver.copy_progress)
+
     def test_is_supported_vmos_version(self):
         version = 'Version 7.5.6'
         self.driver.vmem_mg = self.setup_mock_concerto()
@@ -1713,6 +2775,81 @@ class V7000CommonTestCase(test.TestCase):
             "create_lun",
         )
 
+    def test_get_storage_pool_from_host(self):
+        '''Select the pool the scheduler placed the volume in.'''
+        vol = VOLUME.copy()
+        vol['host'] = 'myhost@violin#PoolC'
+        pool_type = "thin"
+
+        selected_pool = {
+            'dedup': False,
+            'storage_pool': 'PoolC',
+            'storage_pool_id': 123,
+            'thin': True,
+        }
+
+        conf = {
+            'pool.select_storage_pool.return_value': selected_pool,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        result = self.driver._get_storage_pool(
+            vol, 100, pool_type, "create_lun")
+
+        self.assertEqual(result, selected_pool)
+        self.driver.vmem_mg.pool.select_storage_pool.assert_called_once_with(
+            100, pool_type, 'PoolC', [], [], "random", "create_lun")
+
+    def test_get_storage_pool_from_host_unsuitable(self):
+        '''Fail if the scheduler's pool is unsuitable, to reschedule.'''
+        vol = VOLUME.copy()
+        vol['host'] = 'myhost@violin#PoolC'
+        pool_type = "thin"
+
+        conf = {
+            'pool.select_storage_pool.return_value': None,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        self.assertRaises(exception.ViolinBackendErrNotFound,
+                          self.driver._get_storage_pool,
+                          vol, 100, pool_type, "create_lun")
+        self.driver.vmem_mg.pool.select_storage_pool.assert_called_once_with(
+            100, pool_type, 'PoolC', [], [], "random", "create_lun")
+
+    def test_get_storage_pool_ignores_host_for_sra(self):
+        '''SRAs may go to any pool the backend picks.'''
+        vol = VOLUME.copy()
+        vol['host'] = 'myhost@violin#PoolC'
+        pool_type = "thin"
+
+        conf = {
+            'pool.select_storage_pool.return_value': None,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        self.assertRaises(exception.ViolinBackendErrNotFound,
+                          self.driver._get_storage_pool,
+                          vol, 100, pool_type, None, use_host_pool=False)
+        self.driver.vmem_mg.pool.select_storage_pool.assert_called_once_with(
+            100, pool_type, None, [], [], "random", None)
+
+    def test_get_pool_capabilities(self):
+        self.conf.violin_dedup_only_pools = ['PoolA']
+        self.conf.violin_dedup_capable_pools = ['PoolC']
+
+        result = self.driver._get_pool_capabilities('PoolA')
+        self.assertTrue(result['dedup'])
+        self.assertFalse(result['thick_provisioning_support'])
+
+        result = self.driver._get_pool_capabilities('PoolC')
+        self.assertTrue(result['dedup'])
+        self.assertTrue(result['thick_provisioning_support'])
+
+        result = self.driver._get_pool_capabilities('PoolE')
+        self.assertFalse(result['dedup'])
+        self.assertTrue(result['thin_provisioning_support'])
+
     def test_wait_run_delete_lun_snapshot(self):
         response = {'success': True, 'msg': 'Delete TimeMark successfully'}
         compressed_snap_id = 'abcdabcd1234abcd1234abcdeffedcbb'
@@ -1761,6 +2898,125 @@ class V7000CommonTestCase(test.TestCase):
             len(response),
             self.driver.vmem_mg.snapshot.delete_lun_snapshot.call_count)
 
+    def test_wait_run_delete_lun_snapshot_uses_timemark_index(self):
+        response = {'success': True, 'msg': 'Delete TimeMark successfully'}
+        comment = 'abcdabcd1234abcd1234abcdeffedcbb'
+        oid = 'abc123-abc123abc123-abc123'
+
+        conf = {
+            'snapshot.delete_lun_snapshot.return_value': response,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver.timemark_oids = {VOLUME_ID: {comment: oid}}
+
+        self.driver._wait_run_delete_lun_snapshot(SNAPSHOT)
+
+        v = self.driver.vmem_mg
+        self.assertFalse(v.snapshot.snapshot_comment_to_object_id.called)
+        v.snapshot.delete_lun_snapshot.assert_called_once_with(
+            snapshot_object_id=oid)
+        self.assertEqual({}, self.driver.timemark_oids[VOLUME_ID])
+
+    def _new_deletion_service(self):
+        return v7000_common.DeletionService(
+            lambda: v7000_common.PollSchedule(0, min_interval=0))
+
+    def test_deletion_service_already_deleted(self):
+        service = self._new_deletion_service()
+        delete = mock.Mock(side_effect=vmemclient.core.error.
+                           NoMatchingObjectIdError('not found'))
+
+        self.assertTrue(service.run('snap', delete, 10))
+        self.assertEqual([], service.dead_letters)
+
+    def test_deletion_service_deadline(self):
+        service = self._new_deletion_service()
+        delete = mock.Mock(return_value={
+            'success': False, 'msg': 'Error 0x50f7564c'})
+
+        self.assertFalse(service.run('snap', delete, 0))
+        delete.assert_called_once_with()
+        self.assertEqual(1, len(service.dead_letters))
+        self.assertEqual({'violin_deletion_dead_letters': 1},
+                         service.get_stats())
+
+    def test_deletion_service_retries_exceptions(self):
+        service = self._new_deletion_service()
+        delete = mock.Mock(side_effect=[
+            exception.ViolinBackendErr(message='busy'),
+            {'success': True, 'msg': 'Delete TimeMark successfully'}])
+
+        self.assertTrue(service.run('snap', delete, 10))
+        self.assertEqual(2, delete.call_count)
+
+    def test_create_lun_snapshot_indexes_timemark(self):
+        oid = 'abc123-abc123abc123-abc123'
+        response = {'success': True, 'msg': 'Create TimeMark successfully',
+                    'object_id': oid}
+
+        self.driver.vmem_mg = self.setup_mock_concerto()
+        self.driver._ensure_snapshot_resource_area = mock.Mock()
+        self.driver._ensure_snapshot_policy = mock.Mock()
+        self.driver._send_cmd = mock.Mock(return_value=response)
+
+        self.driver._create_lun_snapshot(SNAPSHOT)
+
+        comment = self.driver._compress_snapshot_id(SNAPSHOT_ID)
+        self.assertEqual(oid, self.driver._get_timemark_oid(
+            VOLUME_ID, comment))
+        self.assertFalse(
+            self.driver.vmem_mg.snapshot.snapshot_comment_to_object_id.called)
+
+    def test_get_snapgroup_timemark_oid_is_cached(self):
+        comment = 'aabbccdd1221dcba4334abcdeffedcba'
+        oid = '123456_654321'
+
+        conf = {
+            'snapshot.snapgroup_snapshot_comment_to_object_id.return_value':
+                oid,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        self.assertEqual(oid, self.driver._get_snapgroup_timemark_oid(
+            GROUP_ID, comment))
+        self.assertEqual(oid, self.driver._get_snapgroup_timemark_oid(
+            GROUP_ID, comment))
+
+        v = self.driver.vmem_mg.snapshot
+        v.snapgroup_snapshot_comment_to_object_id.assert_called_once_with(
+            GROUP_ID, comment)
+
+    def test_forget_snapgroup_timemarks(self):
+        comment = 'aabbccdd1221dcba4334abcdeffedcba'
+        self.driver.timemark_oids = {
+            GROUP_ID: {comment: 'g1'},
+            VOLUME_ID: {comment: 'v1'},
+            SRC_VOL_ID: {comment: 'v2'},
+        }
+
+        self.driver._forget_snapgroup_timemarks(GROUP_ID, comment,
+                                                [VOLUME_ID])
+
+        self.assertEqual({GROUP_ID: {}, VOLUME_ID: {},
+                          SRC_VOL_ID: {comment: 'v2'}},
+                         self.driver.timemark_oids)
+
+    def _expected_pool_stats(self, name, free_gb, total_gb, provisioned_gb):
+        return {
+            'pool_name': name,
+            'free_capacity_gb': free_gb,
+            'total_capacity_gb': total_gb,
+            'provisioned_capacity_gb': provisioned_gb,
+            'max_over_subscription_ratio': 20.0,
+            'reserved_percentage': 0,
+            'QoS_support': False,
+            'consistencygroup_support': True,
+            'location_info': 'V7000:lab-host1.example.com',
+            'thin_provisioning_support': True,
+            'thick_provisioning_support': True,
+            'dedup': False,
+        }
+
     @mock.patch('socket.getfqdn')
     def test_get_volume_stats(self, m_getfqdn):
         expected_answers = {
@@ -1770,6 +3026,17 @@ class V7000CommonTestCase(test.TestCase):
             'free_capacity_gb': 2781,
             'total_capacity_gb': 14333,
             'consistencygroup_support': True,
+            'location_info': 'V7000:lab-host1.example.com',
+            'stats_timestamp': 1000,
+            'violin_copy_queue_depth': 0,
+            'violin_copy_queue_wait': 0.0,
+            'violin_deletion_dead_letters': 0,
+            'pools': [
+                self._expected_pool_stats('dedup-pool', 1535, 2047, 10),
+                self._expected_pool_stats('thick_pool_13531mgb', 0, 0, 0),
+                self._expected_pool_stats('StoragePool', 223, 10239, 3),
+                self._expected_pool_stats('thick-pool', 1023, 2047, 0),
+            ],
         }
         owner = 'lab-host1'
 
@@ -1781,11 +3048,190 @@ class V7000CommonTestCase(test.TestCase):
             'pool.get_storage_pools.return_value': STATS_STORAGE_POOL_RESPONSE,
         }
         self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver.lun_ledger = {
+            'vol1': ('dedup-pool', 10240, 1024),
+            'vol2': ('StoragePool', 2048, 2048),
+            'vol3': ('StoragePool', 1024, 1024),
+        }
 
-        result = self.driver._get_volume_stats(owner)
+        with mock.patch('time.time', return_value=1000):
+            result = self.driver._get_volume_stats(owner)
 
         self.assertDictEqual(expected_answers, result)
 
+    def test_get_volume_stats_from_collector(self):
+        stats = {'free_capacity_gb': 10, 'total_capacity_gb': 20}
+        self.driver.stats_collector = mock.Mock()
+        self.driver.stats_snapshot = (stats, 1000)
+        self.driver._collect_volume_stats = mock.Mock()
+
+        result = self.driver._get_volume_stats('lab-host1')
+
+        self.assertFalse(self.driver._collect_volume_stats.called)
+        self.assertEqual(1000, result['stats_timestamp'])
+        self.assertEqual(10, result['free_capacity_gb'])
+        self.assertNotIn('stats_timestamp', stats)
+
+    def test_get_volume_stats_collector_not_ready(self):
+        stats = {'free_capacity_gb': 10, 'total_capacity_gb': 20}
+        self.driver.stats_collector = mock.Mock()
+        self.driver._collect_volume_stats = mock.Mock(return_value=stats)
+
+        result = self.driver._get_volume_stats('lab-host1')
+
+        self.driver._collect_volume_stats.assert_called_once_with(
+            'lab-host1')
+        self.assertEqual(10, result['free_capacity_gb'])
+
+    def test_refresh_volume_stats(self):
+        stats = {'free_capacity_gb': 10, 'total_capacity_gb': 20}
+        self.conf.violin_stats_refresh_interval = 60
+        self.driver._collect_volume_stats = mock.Mock(return_value=stats)
+
+        with mock.patch('time.time', return_value=1000):
+            delay = self.driver._refresh_volume_stats('lab-host1')
+
+        self.assertEqual((stats, 1000), self.driver.stats_snapshot)
+        self.assertTrue(48 <= delay <= 72)
+
+    def test_refresh_volume_stats_keeps_snapshot_on_error(self):
+        snapshot = ({'free_capacity_gb': 10}, 1000)
+        self.conf.violin_stats_refresh_interval = 60
+        self.driver.stats_snapshot = snapshot
+        self.driver._collect_volume_stats = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='fail'))
+
+        delay = self.driver._refresh_volume_stats('lab-host1')
+
+        self.assertEqual(snapshot, self.driver.stats_snapshot)
+        self.assertTrue(48 <= delay <= 72)
+
+    @mock.patch('oslo_service.loopingcall.DynamicLoopingCall')
+    def test_start_stats_collector(self, m_looping_call):
+        self.conf.violin_stats_refresh_interval = 60
+
+        self.driver._start_stats_collector('lab-host1')
+        self.driver._start_stats_collector('lab-host1')
+
+        m_looping_call.assert_called_once_with(
+            self.driver._refresh_volume_stats, 'lab-host1')
+        m_looping_call.return_value.start.assert_called_once_with()
+
+    @mock.patch('oslo_service.loopingcall.DynamicLoopingCall')
+    def test_start_stats_collector_disabled(self, m_looping_call):
+        self.conf.violin_stats_refresh_interval = 0
+
+        self.driver._start_stats_collector('lab-host1')
+
+        self.assertFalse(m_looping_call.called)
+        self.assertIsNone(self.driver.stats_collector)
+
+    @mock.patch('socket.getfqdn')
+    def test_get_volume_stats_caches_dns_lookups(self, m_getfqdn):
+        m_getfqdn.side_effect = lambda x: str(x) + '.example.com'
+        self.conf.violin_stats_full_refresh_interval = 0
+
+        conf = {
+            'pool.get_storage_pools.return_value': STATS_STORAGE_POOL_RESPONSE,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        self.driver._get_volume_stats('lab-host1')
+        self.driver._get_volume_stats('lab-host1')
+
+        # one lookup each for lab-host1 and lab-host2, across both calls
+        self.assertEqual(2, m_getfqdn.call_count)
+
+    def _get_storage_pools(self, verify=False, include_full_info=False):
+        if include_full_info:
+            return STATS_STORAGE_POOL_RESPONSE
+        return [short_info for short_info, full_info
+                in STATS_STORAGE_POOL_RESPONSE]
+
+    @mock.patch('socket.getfqdn')
+    def test_get_pool_usage_unchanged(self, m_getfqdn):
+        m_getfqdn.side_effect = lambda x: str(x) + '.example.com'
+
+        conf = {
+            'pool.get_storage_pools.side_effect': self._get_storage_pools,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        first = self.driver._get_pool_usage('lab-host1')
+        second = self.driver._get_pool_usage('lab-host1')
+
+        self.assertEqual(first, second)
+        self.assertEqual(('dedup-pool', 1572827, 2097124),
+                         first[0])
+        self.driver.vmem_mg.pool.get_storage_pools.assert_has_calls([
+            mock.call(verify=True, include_full_info=True),
+            mock.call(verify=True, include_full_info=False)])
+        self.assertEqual(
+            2, self.driver.vmem_mg.pool.get_storage_pools.call_count)
+
+    @mock.patch('socket.getfqdn')
+    def test_get_pool_usage_changed(self, m_getfqdn):
+        m_getfqdn.side_effect = lambda x: str(x) + '.example.com'
+
+        conf = {
+            'pool.get_storage_pools.side_effect': self._get_storage_pools,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        self.driver._get_pool_usage('lab-host1')
+        self.driver.pool_signature['dedup-pool'] = (0, 0, 0)
+        self.driver._get_pool_usage('lab-host1')
+
+        self.driver.vmem_mg.pool.get_storage_pools.assert_called_with(
+            verify=True, include_full_info=True)
+        self.assertEqual(
+            3, self.driver.vmem_mg.pool.get_storage_pools.call_count)
+
+    @mock.patch('socket.getfqdn')
+    def test_get_pool_usage_full_refresh_interval(self, m_getfqdn):
+        m_getfqdn.side_effect = lambda x: str(x) + '.example.com'
+
+        conf = {
+            'pool.get_storage_pools.side_effect': self._get_storage_pools,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        with mock.patch('time.time', return_value=1000):
+            self.driver._get_pool_usage('lab-host1')
+        with mock.patch('time.time', return_value=1600):
+            self.driver._get_pool_usage('lab-host1')
+
+        self.driver.vmem_mg.pool.get_storage_pools.assert_called_with(
+            verify=True, include_full_info=True)
+        self.assertEqual(
+            2, self.driver.vmem_mg.pool.get_storage_pools.call_count)
+
+    @mock.patch('eventlet.greenthread.spawn_n')
+    @mock.patch('socket.getfqdn')
+    def test_fqdn_cache_refreshes_expired_entry_in_background(
+            self, m_getfqdn, m_spawn_n):
+        cache = v7000_common.FQDNCache(ttl=0, negative_ttl=0)
+        m_getfqdn.return_value = 'host1.example.com'
+
+        self.assertEqual('host1.example.com', cache.getfqdn('host1'))
+        m_getfqdn.return_value = 'host1.example.org'
+        self.assertEqual('host1.example.com', cache.getfqdn('host1'))
+
+        m_spawn_n.assert_called_once_with(cache._refresh, 'host1')
+        cache._refresh('host1')
+        self.assertEqual('host1.example.org', cache.getfqdn('host1'))
+
+    @mock.patch('socket.getfqdn')
+    def test_fqdn_cache_negative_ttl(self, m_getfqdn):
+        cache = v7000_common.FQDNCache(ttl=300, negative_ttl=30)
+        m_getfqdn.side_effect = lambda x: x
+
+        with mock.patch('time.time', return_value=1000):
+            cache.getfqdn('unknown-host')
+
+        self.assertEqual(('unknown-host', 1030),
+                         cache._entries['unknown-host'])
+
     def test_create_consistencygroup(self):
         response = {'success': True, 'msg': 'success'}
         context = None
@@ -2148,7 +3594,7 @@ class V7000CommonTestCase(test.TestCase):
                           context, CGSNAPSHOT, db)
 
     def test_wait_for_cgsnapshot(self):
-        group = GROUP.copy()
+        group = GROUP['id']
         comment = 'aabbccdd1221dcba4334abcdeffedcba'
         snapshots = [SNAPSHOT.copy(), ]
         oid = '123456_654321'
@@ -2167,6 +3613,25 @@ class V7000CommonTestCase(test.TestCase):
         v.snapshot.snapshot_comment_to_object_id.assert_called_once_with(
             SNAPSHOT['volume_id'], comment)
 
+    def test_cgsnapshot_stabilizer(self):
+        readings = {
+            'oid1': ['1 KB', '2 KB', '2 KB', '2 KB', '2 KB'],
+            'oid2': ['1 KB', '1 KB', '1 KB', '1 KB', '1 KB'],
+        }
+
+        def get_used_blocks(oid):
+            return readings[oid].pop(0)
+
+        stabilizer = v7000_common.CGSnapshotStabilizer(
+            get_used_blocks, {'vol1': 'oid1', 'vol2': 'oid2'})
+        other = v7000_common.CGSnapshotStabilizer(
+            mock.Mock(), {'vol3': 'oid3'})
+
+        results = [stabilizer.check() for i in range(5)]
+
+        self.assertEqual([False, False, False, False, True], results)
+        self.assertEqual(0, other.times_consistent)
+
     def test_delete_cgsnapshot(self):
         expected_model_update = {'status': 'deleted'}
         expected_snapshots = [SNAPSHOT.copy(), ]
@@ -2364,6 +3829,43 @@ class V7000CommonTestCase(test.TestCase):
             modified_snapshot, volumes[0])
         self.assertEqual(expected, result)
 
+    def test_create_consistencygroup_from_cgsnapshot_rolls_back(self):
+        """A failed member copy deletes the group and all its members."""
+        failure = exception.ViolinBackendErr
+        group = GROUP.copy()
+        volumes = [dict(GROUP_VOLUME, id='vol1'),
+                   dict(GROUP_VOLUME, id='vol2')]
+        snapshots = [dict(SNAPSHOT, id='snap1'),
+                     dict(SNAPSHOT, id='snap2')]
+
+        def copy(snapshot, volume):
+            if volume['id'] == 'vol2':
+                raise failure(message='fail')
+
+        conf = {
+            'snapshot.delete_snapgroup.return_value': {'success': True,
+                                                       'msg': ''},
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver._create_consistencygroup = mock.Mock()
+        self.driver._create_volume_from_snapshot = mock.Mock(
+            side_effect=copy)
+        self.driver._remove_from_consistencygroup = mock.Mock()
+        self.driver._delete_lun = mock.Mock()
+
+        self.assertRaises(failure,
+                          self.driver._create_consistencygroup_from_cgsnapshot,
+                          None, group, volumes, CGSNAPSHOT.copy(), snapshots)
+
+        self.assertEqual(2,
+                         self.driver._create_volume_from_snapshot.call_count)
+        self.driver._remove_from_consistencygroup.assert_called_once_with(
+            group['id'], ['vol1'])
+        self.driver.vmem_mg.snapshot.delete_snapgroup.assert_called_once_with(
+            group['id'])
+        self.assertEqual([mock.call(volumes[0]), mock.call(volumes[1])],
+                         self.driver._delete_lun.call_args_list)
+
     @mock.patch('uuid.uuid4')
     def test_create_consistencygroup_from_consistencygroup(self, m_uuid4):
         expected = (None, None)
@@ -2519,3 +4021,64 @@ class V7000CommonTestCase(test.TestCase):
             SRC_GROUP_ID, UUID4_COMPRESSED)
         self.assertEqual(len(retry_response),
                          v.delete_snapgroup_snapshot.call_count)
+
+    @mock.patch('uuid.uuid4')
+    def test_create_consistencygroup_from_consistencygroup_copy_fails(
+            self, m_uuid4):
+        """The temp cgsnapshot is deleted when the group is rolled back."""
+        group = GROUP.copy()
+        volumes = [dict(VOLUME, consistencygroup_id=group['id'])]
+        source_cg = SRC_GROUP.copy()
+        source_vols = [dict(SRC_VOL, consistencygroup_id=source_cg['id'])]
+        oid = 'abc123-abc123abc123-abc123'
+
+        response = {'success': True, 'msg': 'success'}
+        m_uuid4.return_value = UUID4
+        self.driver._ensure_consistencygroup_policy = mock.Mock()
+        self.driver._wait_for_cgsnapshot = mock.Mock()
+        self.driver._create_consistencygroup_from_cgsnapshot = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='fail'))
+        conf = {
+            'snapshot.create_snapgroup_snapshot.return_value': response,
+            'snapshot.snapgroup_snapshot_comment_to_object_id.return_value':
+                oid,
+            'snapshot.delete_snapgroup_snapshot.return_value': response,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        self.assertRaisesRegexp(
+            exception.ViolinBackendErr, 'fail',
+            self.driver._create_consistencygroup_from_consistencygroup,
+            None, group, volumes, source_cg, source_vols)
+
+        (self.driver.vmem_mg.snapshot.delete_snapgroup_snapshot.
+         assert_called_once_with(snapshot_object_id=oid))
+
+    @mock.patch('uuid.uuid4')
+    def test_create_consistencygroup_from_consistencygroup_cleanup_fails(
+            self, m_uuid4):
+        """The new group is kept when the temp cgsnapshot is left over."""
+        group = GROUP.copy()
+        volumes = [dict(VOLUME, consistencygroup_id=group['id'])]
+        source_cg = SRC_GROUP.copy()
+        source_vols = [dict(SRC_VOL, consistencygroup_id=source_cg['id'])]
+
+        response = {'success': True, 'msg': 'success'}
+        m_uuid4.return_value = UUID4
+        self.driver._ensure_consistencygroup_policy = mock.Mock()
+        self.driver._wait_for_cgsnapshot = mock.Mock()
+        self.driver._create_consistencygroup_from_cgsnapshot = mock.Mock(
+            return_value=None)
+        self.driver._forget_snapgroup_timemarks = mock.Mock()
+        self.driver.deletion_service.run = mock.Mock(return_value=False)
+        conf = {
+            'snapshot.create_snapgroup_snapshot.return_value': response,
+        }
+        self.driver.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+
+        result = self.driver._create_consistencygroup_from_consistencygroup(
+            None, group, volumes, source_cg, source_vols)
+
+        self.assertEqual((None, None), result)
+        self.assertTrue(self.driver.deletion_service.run.called)
+        self.assertFalse(self.driver._forget_snapgroup_timemarks.called)
@@ -153,6 +153,7 @@ class V7000FCPDriverTestCase(test.TestCase):
         config.san_is_local = False
         config.request_timeout = 300
         config.container = 'myContainer'
+        config.violin_fc_lookup_cache_ttl = 300
         return config
 
     def setup_mock_concerto(self, m_conf=None):
@@ -208,6 +209,40 @@ class V7000FCPDriverTestCase(test.TestCase):
             SRC_VOL, VOLUME)
         self.assertIsNone(result)
 
+    def test_clone_image(self):
+        image_meta = {'id': 'image1', 'checksum': 'abc'}
+        self.driver.common._clone_image = mock.Mock(
+            return_value=(None, True))
+
+        result = self.driver.clone_image(None, VOLUME, None, image_meta,
+                                         None)
+
+        self.driver.common._clone_image.assert_called_with(
+            VOLUME, image_meta)
+        self.assertEqual((None, True), result)
+
+    def test_migrate_volume(self):
+        host = {'host': 'cinder@violin#PoolB', 'capabilities': {}}
+        self.driver.common._migrate_volume = mock.Mock(
+            return_value=(True, None))
+
+        result = self.driver.migrate_volume(None, VOLUME, host)
+
+        self.driver.common._migrate_volume.assert_called_with(
+            None, VOLUME, host)
+        self.assertEqual((True, None), result)
+
+    def test_retype(self):
+        new_type = {'id': 'type2'}
+        host = {'host': 'cinder@violin#PoolB', 'capabilities': {}}
+        self.driver.common._retype = mock.Mock(return_value=True)
+
+        result = self.driver.retype(None, VOLUME, new_type, {}, host)
+
+        self.driver.common._retype.assert_called_with(
+            None, VOLUME, new_type, {}, host)
+        self.assertTrue(result)
+
     def test_delete_volume(self):
         """Volume deleted successfully."""
         self.driver.common._delete_lun = mock.Mock()
@@ -269,6 +304,44 @@ class V7000FCPDriverTestCase(test.TestCase):
                           '2100001b9745e231', '2100001b9745e25e'],
                          result)
 
+    def test_refresh_active_fc_targets(self):
+        """A changed port set replaces the targets and drops cached maps."""
+        new_wwns = FC_TARGET_WWPNS[:2]
+        self.driver._get_active_fc_targets = mock.Mock(
+            return_value=new_wwns)
+        self.driver.initiator_target_maps = {'cached': 'entry'}
+
+        self.driver._refresh_active_fc_targets()
+
+        self.assertEqual(new_wwns, self.driver.gateway_fc_wwns)
+        self.assertEqual({}, self.driver.initiator_target_maps)
+
+    def test_refresh_active_fc_targets_unchanged(self):
+        self.driver._get_active_fc_targets = mock.Mock(
+            return_value=list(reversed(FC_TARGET_WWPNS)))
+        self.driver.initiator_target_maps = {'cached': 'entry'}
+
+        self.driver._refresh_active_fc_targets()
+
+        self.assertEqual(FC_TARGET_WWPNS, self.driver.gateway_fc_wwns)
+        self.assertEqual({'cached': 'entry'},
+                         self.driver.initiator_target_maps)
+
+    def test_refresh_active_fc_targets_keeps_list_when_none_found(self):
+        self.driver._get_active_fc_targets = mock.Mock(return_value=[])
+
+        self.driver._refresh_active_fc_targets()
+
+        self.assertEqual(FC_TARGET_WWPNS, self.driver.gateway_fc_wwns)
+
+    def test_refresh_active_fc_targets_backend_error(self):
+        self.driver._get_active_fc_targets = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='fail'))
+
+        self.driver._refresh_active_fc_targets()
+
+        self.assertEqual(FC_TARGET_WWPNS, self.driver.gateway_fc_wwns)
+
     def test_initialize_connection(self):
         lun_id = 1
         target_wwns = self.driver.gateway_fc_wwns
@@ -361,6 +434,7 @@ class V7000FCPDriverTestCase(test.TestCase):
         self.driver.common.vmem_mg = self.setup_mock_concerto()
         self.driver.common._send_cmd = mock.Mock(
             return_value=response)
+        self.driver.lun_id_map = {CONNECTOR['host']: {VOLUME['id']: 8}}
 
         result = self.driver._unexport_lun(VOLUME, CONNECTOR)
 
@@ -368,6 +442,7 @@ class V7000FCPDriverTestCase(test.TestCase):
             self.driver.common.vmem_mg.lun.unassign_client_lun,
             "Unassign SAN client successfully",
             VOLUME['id'], CONNECTOR['host'], True)
+        self.assertEqual({}, self.driver.lun_id_map[CONNECTOR['host']])
         self.assertIsNone(result)
 
     def test_get_lun_id(self):
@@ -380,17 +455,42 @@ class V7000FCPDriverTestCase(test.TestCase):
         result = self.driver._get_lun_id(VOLUME['id'], CONNECTOR['host'])
 
         self.assertEqual(8, result)
+        self.assertEqual({VOLUME['id']: 8},
+                         self.driver.lun_id_map[CONNECTOR['host']])
+
+    def test_get_lun_id_from_cached_map(self):
+        """A known volume is looked up without querying the backend."""
+        self.driver.common.vmem_mg = self.setup_mock_concerto()
+        self.driver.lun_id_map = {CONNECTOR['host']: {VOLUME['id']: 3}}
+
+        result = self.driver._get_lun_id(VOLUME['id'], CONNECTOR['host'])
+
+        self.assertEqual(3, result)
+        self.assertFalse(
+            self.driver.common.vmem_mg.client.get_client_info.called)
 
     def test_is_lun_id_ready(self):
-        lun_id = '1'
+        lun_ids = {VOLUME['id']: 1}
         self.driver.common.vmem_mg = self.setup_mock_concerto()
 
-        self.driver._get_lun_id = mock.Mock(return_value=lun_id)
+        self.driver._update_lun_id_map = mock.Mock(return_value=lun_ids)
 
         result = self.driver._is_lun_id_ready(
             VOLUME['id'], CONNECTOR['host'])
+
+        self.driver._update_lun_id_map.assert_called_once_with(
+            CONNECTOR['host'])
         self.assertTrue(result)
 
+    def test_is_lun_id_ready_not_assigned(self):
+        self.driver.common.vmem_mg = self.setup_mock_concerto()
+
+        self.driver._update_lun_id_map = mock.Mock(return_value={})
+
+        result = self.driver._is_lun_id_ready(
+            VOLUME['id'], CONNECTOR['host'])
+        self.assertFalse(result)
+
     def test_build_initiator_target_map(self):
         """Successfully build a map when zoning is enabled."""
         expected_targ_wwns = FC_TARGET_WWPNS
@@ -433,6 +533,47 @@ class V7000FCPDriverTestCase(test.TestCase):
         self.assertEqual(expected_targ_wwns, targ_wwns)
         self.assertEqual(expected_init_targ_map, init_targ_map)
 
+    def test_build_initiator_target_map_is_cached(self):
+        """Fabric lookups are reused for the same set of initiators."""
+        self.driver.lookup_service = mock.Mock()
+        (self.driver.lookup_service.get_device_mapping_from_network.
+         return_value) = FC_FABRIC_MAP
+        connector = CONNECTOR.copy()
+        connector['wwpns'] = list(reversed(CONNECTOR['wwpns']))
+
+        first = self.driver._build_initiator_target_map(CONNECTOR)
+        first[1][FC_INITIATOR_WWPNS[0]].append('garbage')
+        second = self.driver._build_initiator_target_map(connector)
+
+        lookup = self.driver.lookup_service.get_device_mapping_from_network
+        self.assertEqual(1, lookup.call_count)
+        self.assertEqual(set(first[0]), set(second[0]))
+        self.assertNotIn('garbage', second[1][FC_INITIATOR_WWPNS[0]])
+
+    def test_build_initiator_target_map_cache_disabled(self):
+        self.conf.violin_fc_lookup_cache_ttl = 0
+        self.driver.lookup_service = mock.Mock()
+        (self.driver.lookup_service.get_device_mapping_from_network.
+         return_value) = FC_FABRIC_MAP
+
+        self.driver._build_initiator_target_map(CONNECTOR)
+        self.driver._build_initiator_target_map(CONNECTOR)
+
+        lookup = self.driver.lookup_service.get_device_mapping_from_network
+        self.assertEqual(2, lookup.call_count)
+
+    def test_invalidate_initiator_target_maps(self):
+        self.driver.lookup_service = mock.Mock()
+        (self.driver.lookup_service.get_device_mapping_from_network.
+         return_value) = FC_FABRIC_MAP
+
+        self.driver._build_initiator_target_map(CONNECTOR)
+        self.driver._invalidate_initiator_target_maps()
+        self.driver._build_initiator_target_map(CONNECTOR)
+
+        lookup = self.driver.lookup_service.get_device_mapping_from_network
+        self.assertEqual(2, lookup.call_count)
+
     def test_is_initiator_connected_to_array(self):
         """Successfully finds an initiator with remaining active session."""
         conf = {
@@ -222,6 +222,40 @@ class V7000ISCSIDriverTestCase(test.TestCase):
             SRC_VOL, VOLUME)
         self.assertTrue(result is None)
 
+    def test_clone_image(self):
+        image_meta = {'id': 'image1', 'checksum': 'abc'}
+        self.driver.common._clone_image = mock.Mock(
+            return_value=(None, True))
+
+        result = self.driver.clone_image(None, VOLUME, None, image_meta,
+                                         None)
+
+        self.driver.common._clone_image.assert_called_with(
+            VOLUME, image_meta)
+        self.assertEqual((None, True), result)
+
+    def test_migrate_volume(self):
+        host = {'host': 'cinder@violin#PoolB', 'capabilities': {}}
+        self.driver.common._migrate_volume = mock.Mock(
+            return_value=(True, None))
+
+        result = self.driver.migrate_volume(None, VOLUME, host)
+
+        self.driver.common._migrate_volume.assert_called_with(
+            None, VOLUME, host)
+        self.assertEqual((True, None), result)
+
+    def test_retype(self):
+        new_type = {'id': 'type2'}
+        host = {'host': 'cinder@violin#PoolB', 'capabilities': {}}
+        self.driver.common._retype = mock.Mock(return_value=True)
+
+        result = self.driver.retype(None, VOLUME, new_type, {}, host)
+
+        self.driver.common._retype.assert_called_with(
+            None, VOLUME, new_type, {}, host)
+        self.assertTrue(result)
+
     def test_delete_volume(self):
         """Volume deleted successfully."""
         self.driver.common._delete_lun = mock.Mock()
@@ -355,6 +389,7 @@ class V7000ISCSIDriverTestCase(test.TestCase):
         self.driver.common.vmem_mg = self.setup_mock_concerto()
         self.driver.common._send_cmd = mock.Mock(
             return_value=response)
+        self.driver.lun_id_map = {CONNECTOR['host']: {VOLUME['id']: 8}}
 
         result = self.driver._unexport_lun(VOLUME, TARGET, CONNECTOR)
 
@@ -362,18 +397,88 @@ class V7000ISCSIDriverTestCase(test.TestCase):
             self.driver.common.vmem_mg.lun.unassign_lun_from_iscsi_target,
             "Unassign device successfully",
             VOLUME['id'], TARGET, True)
+        self.assertEqual({}, self.driver.lun_id_map[CONNECTOR['host']])
         self.assertTrue(result is None)
 
     def test_is_lun_id_ready(self):
-        lun_id = '1'
+        lun_ids = {VOLUME['id']: 1}
         self.driver.common.vmem_mg = self.setup_mock_concerto()
 
-        self.driver._get_lun_id = mock.Mock(return_value=lun_id)
+        self.driver._update_lun_id_map = mock.Mock(return_value=lun_ids)
 
         result = self.driver._is_lun_id_ready(
             VOLUME['id'], CONNECTOR['host'])
+
+        self.driver._update_lun_id_map.assert_called_once_with(
+            CONNECTOR['host'])
         self.assertTrue(result)
 
+    def test_is_lun_id_ready_not_assigned(self):
+        self.driver.common.vmem_mg = self.setup_mock_concerto()
+
+        self.driver._update_lun_id_map = mock.Mock(return_value={})
+
+        result = self.driver._is_lun_id_ready(
+            VOLUME['id'], CONNECTOR['host'])
+        self.assertFalse(result)
+
+    def test_load_iscsi_interfaces(self):
+        ips = ['192.168.91.1', '192.168.92.1']
+        state = {'san_ip': self.conf.san_ip, 'version': '1.1.1',
+                 'timestamp': 0, 'interfaces': ips}
+
+        self.driver.common.vmem_mg = self.setup_mock_concerto()
+        self.driver.common._load_state = mock.Mock(return_value=state)
+
+        result = self.driver._load_iscsi_interfaces()
+
+        self.driver.common._load_state.assert_called_once_with(
+            v7000_iscsi.ISCSI_INTERFACES_STATE)
+        self.assertEqual(ips, result)
+
+    def test_load_iscsi_interfaces_version_changed(self):
+        state = {'san_ip': self.conf.san_ip, 'version': '0.0.1',
+                 'timestamp': 0, 'interfaces': ['192.168.91.1']}
+
+        self.driver.common.vmem_mg = self.setup_mock_concerto()
+        self.driver.common._load_state = mock.Mock(return_value=state)
+
+        self.assertIsNone(self.driver._load_iscsi_interfaces())
+
+    def test_discover_iscsi_interfaces(self):
+        ips = ['192.168.91.1', '192.168.92.1']
+        conf = {
+            'utility.get_iscsi_interfaces.return_value': ips,
+        }
+        self.driver.common.vmem_mg = self.setup_mock_concerto(m_conf=conf)
+        self.driver.common._save_state = mock.Mock()
+
+        result = self.driver._discover_iscsi_interfaces()
+
+        self.assertEqual(ips, result)
+        name, state = self.driver.common._save_state.call_args[0]
+        self.assertEqual(v7000_iscsi.ISCSI_INTERFACES_STATE, name)
+        self.assertEqual(ips, state['interfaces'])
+        self.assertEqual(self.conf.san_ip, state['san_ip'])
+        self.assertEqual('1.1.1', state['version'])
+
+    def test_revalidate_iscsi_interfaces(self):
+        ips = ['192.168.95.1']
+        self.driver._discover_iscsi_interfaces = mock.Mock(return_value=ips)
+
+        self.driver._revalidate_iscsi_interfaces()
+
+        self.assertEqual(ips, self.driver.gateway_iscsi_ip_addresses)
+
+    def test_revalidate_iscsi_interfaces_keeps_list_on_error(self):
+        ips = list(self.driver.gateway_iscsi_ip_addresses)
+        self.driver._discover_iscsi_interfaces = mock.Mock(
+            side_effect=exception.ViolinBackendErr(message='fail'))
+
+        self.driver._revalidate_iscsi_interfaces()
+
+        self.assertEqual(ips, self.driver.gateway_iscsi_ip_addresses)
+
     def test_get_lun_id(self):
 
         conf = {
@@ -384,6 +489,19 @@ class V7000ISCSIDriverTestCase(test.TestCase):
         result = self.driver._get_lun_id(VOLUME['id'], CONNECTOR['host'])
 
         self.assertEqual(8, result)
+        self.assertEqual({VOLUME['id']: 8},
+                         self.driver.lun_id_map[CONNECTOR['host']])
+
+    def test_get_lun_id_from_cached_map(self):
+        """A known volume is looked up without querying the backend."""
+        self.driver.common.vmem_mg = self.setup_mock_concerto()
+        self.driver.lun_id_map = {CONNECTOR['host']: {VOLUME['id']: 3}}
+
+        result = self.driver._get_lun_id(VOLUME['id'], CONNECTOR['host'])
+
+        self.assertEqual(3, result)
+        self.assertFalse(
+            self.driver.common.vmem_mg.client.get_client_info.called)
 
     def test_create_consistencygroup(self):
         self.driver.common._create_consistencygroup = mock.Mock(
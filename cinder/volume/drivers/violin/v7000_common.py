@@ -28,23 +28,36 @@ properly in an active-active HA configuration.  See OpenStack Cinder
 driver documentation for more information.
 """
 
+import collections
+import contextlib
+import datetime
+import errno
+import json
 import math
+import os
+import random
 import re
 import six
 import socket
 import time
 import uuid
 
+from eventlet import event
+from eventlet import greenpool
+from eventlet import greenthread
+from eventlet import tpool
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_service import loopingcall
+from oslo_utils import excutils
 from oslo_utils import units
 
 from cinder import context
 from cinder.db.sqlalchemy import api
 from cinder import exception
-from cinder.i18n import _, _LE, _LI
+from cinder.i18n import _, _LE, _LI, _LW
 from cinder import utils
+from cinder.volume import utils as volume_utils
 from cinder.volume import volume_types
 
 
@@ -70,6 +83,24 @@ CONCERTO_DEFAULT_SRA_EXPANSION_MAX_SIZE = None
 CONCERTO_DEFAULT_SRA_ENABLE_SHRINK = False
 CONCERTO_DEFAULT_POLICY_MAX_SNAPSHOTS = 1000
 CONCERTO_DEFAULT_POLICY_RETENTION_MODE = 'All'
+CONCERTO_DNS_CACHE_TTL = 300
+CONCERTO_DNS_CACHE_NEGATIVE_TTL = 30
+CONCERTO_STATS_REFRESH_JITTER = 0.2
+CONCERTO_POLL_MIN_INTERVAL = 0.5
+CONCERTO_POLL_BACKOFF = 1.5
+CONCERTO_POLL_ETA_FRACTION = 0.25
+CONCERTO_CG_WAIT_CONCURRENCY = 16
+CONCERTO_CG_WAIT_STABLE_READINGS = 3
+CONCERTO_CG_COPY_CONCURRENCY = 16
+CONCERTO_COPY_PROGRESS_INTERVAL = 30
+CONCERTO_COPY_PROGRESS_KEYS = ('violin_copy_percent', 'violin_copy_mbps',
+                               'violin_copy_eta')
+# Number of recent copy job waits the average queue wait is taken over
+CONCERTO_COPY_WAIT_SAMPLES = 100
+CONCERTO_IMAGE_CACHE_STATE = 'image-cache'
+CONCERTO_LEFTOVER_TIMEMARKS_STATE = 'leftover-timemarks'
+# Admin metadata key naming the temporary lun holding a moved volume's data
+CONCERTO_MOVE_TEMP_LUN_KEY = 'violin_move_temp_lun'
 
 
 violin_opts = [
@@ -98,19 +129,607 @@ violin_opts = [
                 default=[],
                 help='List of target iSCSI addresses to use.'),
 
+    cfg.IntOpt('violin_fc_lookup_cache_ttl',
+               default=300,
+               help='Number of seconds FC fabric lookup results are '
+                    'reused for a host, 0 disables caching'),
+
+    cfg.IntOpt('violin_fc_target_refresh_interval',
+               default=300,
+               help='Number of seconds between re-reads of the active FC '
+                    'target ports, 0 disables the refresh'),
+
+    cfg.StrOpt('violin_state_path',
+               default='$state_path/violin',
+               help='Directory where the driver keeps local state files, '
+                    'such as the discovered iSCSI interfaces'),
+
+    cfg.IntOpt('violin_stats_refresh_interval',
+               default=60,
+               help='Average number of seconds between background '
+                    'refreshes of the array capacity stats, 0 gathers '
+                    'them on every scheduler report instead'),
+
+    cfg.IntOpt('violin_stats_full_refresh_interval',
+               default=600,
+               help='Maximum number of seconds the per-device storage pool '
+                    'details are reused while the pool summaries are '
+                    'unchanged, 0 always fetches them'),
+
+    cfg.IntOpt('violin_ledger_refresh_interval',
+               default=600,
+               help='Number of seconds between two rebuilds of the per-pool '
+                    'provisioned capacity from the cinder DB, 0 rebuilds it '
+                    'on every stats collection'),
+
+    cfg.IntOpt('violin_max_poll_interval',
+               default=30,
+               help='Maximum number of seconds between two polls of a '
+                    'copy, snapshot or delete running on the array'),
+
+    cfg.IntOpt('violin_max_copies_per_pool',
+               default=4,
+               help='Maximum number of lun copies running at the same time '
+                    'out of or into one storage pool, further copies are '
+                    'queued, 0 disables the limit'),
+
+    cfg.IntOpt('violin_image_cache_size_gb',
+               default=0,
+               help='Maximum number of GB of glance image luns cached in '
+                    'each storage pool for creating volumes from images, '
+                    '0 disables the cache'),
+
 ]
 
 CONF = cfg.CONF
 CONF.register_opts(violin_opts)
 
 
+class FQDNCache(object):
+    """TTL-bounded cache of socket.getfqdn() answers.
+
+    Resolver calls are made in a native thread so that a slow DNS
+    server only delays the caller and not every greenthread.  Expired
+    entries keep being served while they are refreshed in the
+    background, so only the very first lookup of a name waits on DNS.
+    """
+
+    def __init__(self, ttl, negative_ttl):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = {}
+        self._refreshing = set()
+
+    def clear(self):
+        """Drop every cached answer."""
+        self._entries.clear()
+        self._refreshing.clear()
+
+    def getfqdn(self, name):
+        """Return the fully qualified domain name for name.
+
+        :param name:  hostname or IP address to resolve
+        :returns: the cached or freshly resolved FQDN
+        """
+        entry = self._entries.get(name)
+        if entry is None:
+            return self._resolve(name)
+
+        fqdn, expires = entry
+        if expires <= time.time() and name not in self._refreshing:
+            self._refreshing.add(name)
+            greenthread.spawn_n(self._refresh, name)
+
+        return fqdn
+
+    def _resolve(self, name):
+        fqdn = tpool.execute(socket.getfqdn, name)
+
+        # getfqdn() hands back its argument when the lookup fails, so
+        # such answers are only trusted for the shorter negative TTL.
+        if fqdn == name:
+            ttl = self.negative_ttl
+        else:
+            ttl = self.ttl
+
+        self._entries[name] = (fqdn, time.time() + ttl)
+        return fqdn
+
+    def _refresh(self, name):
+        try:
+            self._resolve(name)
+        except Exception:
+            LOG.exception(_LE("Failed to refresh DNS entry for %s."), name)
+        finally:
+            self._refreshing.discard(name)
+
+
+FQDN_CACHE = FQDNCache(CONCERTO_DNS_CACHE_TTL,
+                       CONCERTO_DNS_CACHE_NEGATIVE_TTL)
+
+
+class PollSchedule(object):
+    """Adaptive delays between the polls of a long running array task.
+
+    Polls come quickly at first, so that short tasks are noticed soon
+    after they are over, and then back off geometrically.  When the
+    task reports how far along it is, the next poll is aimed at a
+    fraction of the estimated time left instead.  Delays never exceed
+    max_interval.
+    """
+
+    def __init__(self, max_interval, min_interval=CONCERTO_POLL_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.interval = min_interval
+        self.started = time.time()
+        self.eta = None
+
+    def next_interval(self, percent=None):
+        """Compute the delay until the next poll.
+
+        :param percent: percent of the task done, if known
+        :returns: seconds to wait before polling again
+        """
+        now = time.time()
+        elapsed = now - self.started
+
+        if percent and 0 < percent < 100 and elapsed > 0:
+            remaining = elapsed * (100 - percent) / float(percent)
+            self.eta = now + remaining
+            interval = remaining * CONCERTO_POLL_ETA_FRACTION
+        else:
+            interval = self.interval * CONCERTO_POLL_BACKOFF
+
+        self.interval = min(max(interval, self.min_interval),
+                            self.max_interval)
+        return self.interval
+
+
+class CGSnapshotStabilizer(object):
+    """Tells when the member TimeMarks of a cgsnapshot stop changing.
+
+    Each wait uses its own instance.  Every check reads the used blocks
+    of all members concurrently, and the snapshot is considered done
+    once they came back unchanged for enough checks in a row.
+    """
+
+    def __init__(self, get_used_blocks, oids,
+                 required=CONCERTO_CG_WAIT_STABLE_READINGS,
+                 concurrency=CONCERTO_CG_WAIT_CONCURRENCY):
+        """Create a detector.
+
+        :param get_used_blocks: callable(oid) returning the used blocks
+                                of a TimeMark
+        :param oids: dict of cinder volume ID to member TimeMark oid
+        :param required: number of unchanged readings in a row needed
+        :param concurrency: maximum number of reads in flight
+        """
+        self.get_used_blocks = get_used_blocks
+        self.oids = oids
+        self.required = required
+        self.pool = greenpool.GreenPool(concurrency)
+        self.last_values = None
+        self.times_consistent = 0
+
+    def check(self):
+        """Take one reading of every member.
+
+        :returns: True once the members are stable
+        """
+        values = dict(self.pool.imap(self._read, self.oids.items()))
+
+        if values == self.last_values:
+            self.times_consistent += 1
+        else:
+            self.times_consistent = 0
+            self.last_values = values
+
+        return self.times_consistent >= self.required
+
+    def _read(self, item):
+        volume_id, oid = item
+        return volume_id, self.get_used_blocks(oid)
+
+
+class DeletionService(object):
+    """Runs backend deletions that must be retried until they stick.
+
+    Every deletion gets its own deadline.  Deletions that run past their
+    deadline are recorded in the dead_letters list, rather than holding
+    their caller forever, and counted in the volume stats.
+    """
+
+    def __init__(self, new_schedule):
+        """Create a deletion service.
+
+        :param new_schedule: callable returning a new PollSchedule
+        """
+        self.new_schedule = new_schedule
+        self.dead_letters = []
+
+    def run(self, name, delete_func, timeout):
+        """Delete something, retrying until it is gone or given up on.
+
+        :param name: description of what is deleted, for the logs
+        :param delete_func: callable making one deletion attempt and
+                            returning the backend response dict
+        :param timeout: seconds after which the deletion is given up
+        :returns: True once deleted, False if given up on
+        """
+        deadline = time.time() + timeout
+        schedule = self.new_schedule()
+
+        def _loop_func():
+            outcome, msg = self._attempt(delete_func)
+
+            if outcome == 'done':
+                LOG.debug("Deleted %(name)s: %(msg)s",
+                          {'name': name, 'msg': msg})
+                raise loopingcall.LoopingCallDone(retvalue=True)
+            elif time.time() >= deadline:
+                self._give_up(name, _('timed out after %(timeout)ss: '
+                                      '%(msg)s') %
+                              {'timeout': timeout, 'msg': msg})
+                raise loopingcall.LoopingCallDone(retvalue=False)
+
+            LOG.warning(_LW("Delete %(name)s encountered temporary error: "
+                            "%(msg)s"), {'name': name, 'msg': msg})
+            return min(schedule.next_interval(),
+                       max(deadline - time.time(), 0))
+
+        timer = loopingcall.DynamicLoopingCall(_loop_func)
+        return timer.start().wait()
+
+    def _attempt(self, delete_func):
+        """Make one deletion attempt and classify its outcome.
+
+        :param delete_func: callable making the attempt
+        :returns: ('done' | 'retry', message) tuple
+        """
+        try:
+            ans = delete_func()
+        except vmemclient.core.error.NoMatchingObjectIdError:
+            return 'done', 'already deleted'
+        except Exception as e:
+            return 'retry', six.text_type(e)
+
+        msg = ans.get('msg') or ''
+        if ans['success']:
+            return 'done', msg
+        return 'retry', msg
+
+    def get_stats(self):
+        """Return the number of deletions given up on."""
+        return {'violin_deletion_dead_letters': len(self.dead_letters)}
+
+    def _give_up(self, name, reason):
+        LOG.error(_LE("Giving up on deleting %(name)s: %(reason)s"),
+                  {'name': name, 'reason': reason})
+        self.dead_letters.append({'name': name, 'reason': reason,
+                                  'time': time.time()})
+
+
+class CopyPoller(object):
+    """One poller for the progress of every in-flight lun copy.
+
+    Waiters register the copy they wait for and get an eventlet Event
+    back.  Each poll makes a single status request per copy kind and
+    source volume, however many waiters share it, and sends True or
+    False to the events of the copies that are over.  Every source is
+    polled on its own PollSchedule, the poller only ticks often enough
+    to honor the shortest one.
+    """
+
+    def __init__(self, get_status, new_schedule, report_progress=None,
+                 tick=CONCERTO_POLL_MIN_INTERVAL):
+        """Create a poller.
+
+        :param get_status: callable(kind, src_vol_id) returning the
+                           (target id, MB copied, percent) copy status
+        :param new_schedule: callable returning a new PollSchedule
+        :param report_progress: optional callable(volume_id, mb_copied,
+                                percent, eta) told about running copies
+        :param tick: seconds between two checks for due polls
+        """
+        self.get_status = get_status
+        self.new_schedule = new_schedule
+        self.report_progress = report_progress
+        self.tick = tick
+        self._waiters = {}
+        self._schedules = {}
+        self._timer = None
+
+    def watch(self, kind, src_vol_id, wait_id, volume_id=None,
+              strict=False):
+        """Register interest in a copy.
+
+        :param kind: 'lun' or 'snapshot', the kind of copy
+        :param src_vol_id: cinder volume ID of the copy source
+        :param wait_id: ID the status reports for the copy destination
+        :param volume_id: cinder volume ID of the destination, to have
+                          the copy progress reported
+        :param strict: True to only count the copy as complete when its
+                       own destination is reported complete
+        :returns: an Event sent True or False once the copy is over
+        """
+        key = (kind, src_vol_id)
+        done = event.Event()
+        self._waiters.setdefault(key, []).append(
+            (wait_id, done, volume_id, strict))
+
+        if key not in self._schedules:
+            schedule = self.new_schedule()
+            self._schedules[key] = (schedule, time.time() + schedule.interval)
+
+        if not self._timer:
+            self._timer = loopingcall.FixedIntervalLoopingCall(self._poll)
+            self._timer.start(interval=self.tick)
+
+        return done
+
+    def _poll(self):
+        try:
+            for key in list(self._waiters):
+                try:
+                    self._poll_key(key)
+                except Exception as e:
+                    LOG.exception(_LE("Failed to process the %(kind)s copy "
+                                      "status of %(src)s."),
+                                  {'kind': key[0], 'src': key[1]})
+                    self._fail_waiters(key, e)
+        except Exception:
+            # a dead loop must not keep later waiters from starting a
+            # new one
+            self._timer = None
+            raise
+
+        if not self._waiters:
+            self._timer = None
+            raise loopingcall.LoopingCallDone()
+
+    def _poll_key(self, key):
+        kind, src_vol_id = key
+        schedule, due = self._schedules[key]
+        if due > time.time():
+            return
+
+        # Waiters registering while the status is fetched must wait
+        # for the next tick, the answer may predate their copy.
+        waiters = list(self._waiters[key])
+
+        status = self.get_status(kind, src_vol_id)
+        percent = status[2]
+        finished = []
+        running = []
+        for waiter in waiters:
+            result = self._get_copy_result(waiter[0], status, waiter[3])
+            if result is not None:
+                finished.append((waiter, result))
+            elif waiter[2] and status[0] == waiter[0]:
+                running.append(waiter[2])
+
+        for waiter, result in finished:
+            self._waiters[key].remove(waiter)
+            waiter[1].send(result)
+
+        if not self._waiters[key]:
+            del self._waiters[key]
+            del self._schedules[key]
+            return
+
+        if finished:
+            # the next copy out of this source is starting
+            schedule = self.new_schedule()
+            percent = None
+
+        interval = schedule.next_interval(percent)
+        self._schedules[key] = (schedule, time.time() + interval)
+        if schedule.eta:
+            LOG.debug("%(kind)s copy of %(src)s: next poll in "
+                      "%(next).1fs, done in about %(eta)ds.",
+                      {'kind': kind, 'src': src_vol_id,
+                       'next': interval,
+                       'eta': max(schedule.eta - time.time(), 0)})
+
+        if self.report_progress and status[1] is not None:
+            for volume_id in running:
+                self.report_progress(volume_id, status[1], status[2],
+                                     schedule.eta)
+
+    def _fail_waiters(self, key, error):
+        """Send an error to every waiter of a copy and stop polling it."""
+        self._schedules.pop(key, None)
+        for waiter in self._waiters.pop(key, []):
+            if not waiter[1].ready():
+                waiter[1].send_exception(error)
+
+    @staticmethod
+    def _get_copy_result(wait_id, status, strict=False):
+        """Interpret a copy status for one destination.
+
+        :param wait_id: ID the status reports for the copy destination
+        :param status: (target id, MB copied, percent) from the array
+        :param strict: True if a status about another destination does
+                       not count as the copy being complete
+        :returns: True or False once the copy is over, else None
+        """
+        target_id, mb_copied, percent = status
+
+        if target_id is None:
+            # pre-copy transient result
+            LOG.debug("lun or snap copy prepping.")
+        elif target_id != wait_id and strict:
+            # another lun is being copied, which does not tell whether
+            # this copy is complete
+            LOG.debug("lun or snap copy superseded by copy to %s.",
+                      target_id)
+            return False
+        elif target_id != wait_id:
+            # the copy is complete, another lun is being copied
+            LOG.debug("lun or snap copy complete.")
+            return True
+        elif mb_copied is not None:
+            # copy is in progress
+            LOG.debug("MB copied:%d, percent done: %d.",
+                      mb_copied, percent)
+        elif percent == 0:
+            # copy has just started
+            LOG.debug("lun or snap copy started.")
+        elif percent == 100:
+            # copy is complete
+            LOG.debug("lun or snap copy complete.")
+            return True
+        else:
+            # unexpected case
+            LOG.debug("unexpected case (%(id)s, %(bytes)s, %(percent)s)",
+                      {'id': six.text_type(target_id),
+                       'bytes': six.text_type(mb_copied),
+                       'percent': six.text_type(percent)})
+            return False
+
+        return None
+
+
+class CopyScheduler(object):
+    """Queues lun copies so that no storage pool runs too many at once.
+
+    Every copy job holds a slot in its source and destination pools
+    while it runs.  Jobs that would take a pool over its limit wait in
+    a FIFO queue per tenant, and the tenants take turns in starting
+    their next job, so one tenant's burst of clones cannot hold back
+    the copies of everyone else.
+    """
+
+    def __init__(self, get_limit):
+        """Create a scheduler.
+
+        :param get_limit: callable returning the maximum number of jobs
+                          running per pool, 0 for no limit
+        """
+        self.get_limit = get_limit
+        self._running = {}
+        self._queues = collections.OrderedDict()
+        self._waits = collections.deque(maxlen=CONCERTO_COPY_WAIT_SAMPLES)
+
+    @contextlib.contextmanager
+    def job(self, tenant, src_pool, dest_pool):
+        """Run a copy once its pools have room for it.
+
+        :param tenant: project ID the copy is done for
+        :param src_pool: name of the source pool, None if unknown
+        :param dest_pool: name of the destination pool, None if unknown
+        """
+        job = {'pools': set(p for p in (src_pool, dest_pool) if p),
+               'queued': time.time(),
+               'started': event.Event()}
+        self._queues.setdefault(tenant, collections.deque()).append(job)
+        self._dispatch()
+
+        try:
+            job['started'].wait()
+        except BaseException:
+            # killed while queued, possibly right after being started
+            if job['started'].ready():
+                self._release(job)
+            else:
+                self._dequeue(tenant, job)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(job)
+
+    def get_stats(self):
+        """Return the queue depth and the average recent queue wait."""
+        waits = list(self._waits)
+        return {
+            'violin_copy_queue_depth': sum(
+                len(q) for q in self._queues.values()),
+            'violin_copy_queue_wait': (
+                round(sum(waits) / len(waits), 1) if waits else 0.0),
+        }
+
+    def _has_room(self, job):
+        limit = self.get_limit()
+        return limit <= 0 or all(self._running.get(pool, 0) < limit
+                                 for pool in job['pools'])
+
+    def _dequeue(self, tenant, job):
+        queue = self._queues[tenant]
+        queue.remove(job)
+        if not queue:
+            del self._queues[tenant]
+
+    def _release(self, job):
+        for pool in job['pools']:
+            self._running[pool] -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start every queued job that fits, taking turns by tenant."""
+        started = True
+        while started:
+            started = False
+            for tenant in list(self._queues):
+                job = next((j for j in self._queues[tenant]
+                            if self._has_room(j)), None)
+                if job is None:
+                    continue
+
+                self._dequeue(tenant, job)
+                if tenant in self._queues:
+                    # served, so go to the back of the line
+                    self._queues[tenant] = self._queues.pop(tenant)
+
+                for pool in job['pools']:
+                    self._running[pool] = self._running.get(pool, 0) + 1
+                self._waits.append(time.time() - job['queued'])
+                job['started'].send(True)
+                started = True
+
+
 class V7000Common(object):
     """Contains common code for the Violin V7000 drivers."""
 
-    def __init__(self, config):
+    def __init__(self, config, host=None):
         self.vmem_mg = None
         self.container = ""
         self.config = config
+        self.host = host
+        # LUNs known to already have an SRA and a snapshot policy
+        self.luns_with_sra = set()
+        self.luns_with_snapshot_policy = set()
+        # TimeMark object IDs by LUN or snapgroup name, then by comment
+        self.timemark_oids = {}
+        # Latest (stats, timestamp) gathered by the stats collector
+        self.stats_snapshot = None
+        self.stats_collector = None
+        # Per-pool device totals and the pool summaries they came from
+        self.pool_usage = None
+        self.pool_signature = None
+        self.pool_usage_time = 0
+        # Pool, provisioned and allocated MB of every lun, by volume ID
+        self.lun_ledger = {}
+        self.lun_ledger_time = 0
+        self.copy_poller = CopyPoller(self._get_copy_status,
+                                      self._new_poll_schedule,
+                                      self._report_copy_progress)
+        # Last (time, MB copied) published for each volume being copied
+        self.copy_progress = {}
+        self.deletion_service = DeletionService(self._new_poll_schedule)
+        self.copy_scheduler = CopyScheduler(
+            lambda: self.config.violin_max_copies_per_pool)
+        # Cached image luns by pool, then by image ID and checksum
+        self.image_cache = None
+        # (pool, cache key) of the image luns being copied
+        self.image_cache_fills = set()
+        # Events sent once an image cache copy out of a volume is done,
+        # by volume ID
+        self.image_cache_sources = {}
+        # IDs of temporary TimeMarks that could not be deleted, by volume ID
+        self.leftover_timemarks = None
 
     def do_setup(self, context):
         """Any initialization the driver does while starting."""
@@ -197,6 +816,9 @@ class V7000Common(object):
             LOG.exception(_LE("Lun create for %s failed!"), volume['id'])
             raise
 
+        self._ledger_add_lun(volume['id'], selected_pool['storage_pool'],
+                             full_size_mb, spec_dict['size_mb'])
+
         if volume.get('consistencygroup_id'):
             LOG.debug('Adding volume %(v)s to consistency group %(g)s',
                       {'v': volume['id'], 'g': volume['consistencygroup_id']})
@@ -214,8 +836,16 @@ class V7000Common(object):
 
         LOG.debug("Deleting lun %s.", volume['id'])
 
+        # An image cache copy out of the lun holds a TimeMark of it
+        fill = self.image_cache_sources.get(volume['id'])
+        if fill:
+            LOG.debug("Waiting for the image cache copy out of lun %s.",
+                      volume['id'])
+            fill.wait()
+
         # If the LUN has ever had a snapshot, it has an SRA and policy
         # that must be deleted first.
+        self._delete_leftover_timemarks(volume['id'])
         self._delete_lun_snapshot_bookkeeping(volume['id'])
 
         try:
@@ -234,6 +864,8 @@ class V7000Common(object):
             LOG.exception(_LE("Lun delete for %s failed!"), volume['id'])
             raise
 
+        self.lun_ledger.pop(volume['id'], None)
+
     def _extend_lun(self, volume, new_size):
         """Extend an existing volume's size.
 
@@ -242,13 +874,9 @@ class V7000Common(object):
         """
         v = self.vmem_mg
 
-        typeid = volume['volume_type_id']
-        if typeid and not self.vmem_mg.utility.is_external_head:
-            spec_value = self._get_volume_type_extra_spec(volume, "dedup")
-            if spec_value and spec_value.lower() == "true":
-                # A Dedup lun's size cannot be modified in Concerto.
-                msg = _('Dedup lun cannot be extended')
-                raise exception.VolumeDriverException(message=msg)
+        if not self._is_lun_extendable(volume):
+            msg = _('Dedup lun cannot be extended')
+            raise exception.VolumeDriverException(message=msg)
 
         size_mb = volume['size'] * units.Ki
         new_size_mb = new_size * units.Ki
@@ -271,7 +899,22 @@ class V7000Common(object):
             LOG.exception(_LE("LUN extend failed!"))
             raise
 
-    def _create_lun_snapshot(self, snapshot):
+        self._ledger_extend_lun(volume['id'], delta_mb)
+
+    def _is_lun_extendable(self, volume):
+        """Return False if the lun of a volume cannot be extended.
+
+        :param volume:  volume object provided by the Manager
+        """
+        typeid = volume['volume_type_id']
+        if typeid and not self.vmem_mg.utility.is_external_head:
+            spec_value = self._get_volume_type_extra_spec(volume, "dedup")
+            if spec_value and spec_value.lower() == "true":
+                # A Dedup lun's size cannot be modified in Concerto.
+                return False
+        return True
+
+    def _create_lun_snapshot(self, snapshot, volume=None):
         """Create a new cinder snapshot on a volume.
 
         This maps onto a Concerto 'timemark', but we must always first
@@ -279,6 +922,8 @@ class V7000Common(object):
         snapshot policy exists.
 
         :param snapshot:  cinder snapshot object provided by the Manager
+        :param volume:  optional cinder volume of the snapshot's lun, see
+                        _ensure_snapshot_resource_area()
 
         Exceptions:
             VolumeBackendAPIException: If SRA could not be created, or
@@ -298,16 +943,18 @@ class V7000Common(object):
                    'vol_id': cinder_volume_id,
                    'dpy_name': snapshot['display_name']})
 
-        self._ensure_snapshot_resource_area(cinder_volume_id)
+        self._ensure_snapshot_resource_area(cinder_volume_id, volume)
 
         self._ensure_snapshot_policy(cinder_volume_id)
 
+        comment = self._compress_snapshot_id(cinder_snapshot_id)
+
         try:
-            self._send_cmd(
+            resp = self._send_cmd(
                 self.vmem_mg.snapshot.create_lun_snapshot,
                 "Create TimeMark successfully",
                 lun=cinder_volume_id,
-                comment=self._compress_snapshot_id(cinder_snapshot_id),
+                comment=comment,
                 priority=CONCERTO_DEFAULT_PRIORITY,
                 enable_notification=False)
         except Exception:
@@ -315,8 +962,16 @@ class V7000Common(object):
                               "volume %(vol)s snapshot %(snap)s failed!"),
                           {'vol': cinder_volume_id,
                            'snap': cinder_snapshot_id})
+            # The cached SRA/policy state may be stale, so have the
+            # next attempt check the backend again.
+            self.luns_with_sra.discard(cinder_volume_id)
+            self.luns_with_snapshot_policy.discard(cinder_volume_id)
             raise
 
+        if resp.get('object_id'):
+            self._remember_timemark_oid(
+                cinder_volume_id, comment, resp['object_id'])
+
     def _delete_lun_snapshot(self, snapshot):
         """Delete the specified cinder snapshot.
 
@@ -336,7 +991,8 @@ class V7000Common(object):
 
         return self._wait_run_delete_lun_snapshot(snapshot)
 
-    def _create_volume_from_snapshot(self, snapshot, volume):
+    def _create_volume_from_snapshot(self, snapshot, volume, verify=False,
+                                     in_db=True):
         """Create a new cinder volume from a given snapshot of a lun
 
         This maps onto a Concerto 'copy  snapshot to lun'. Concerto
@@ -344,6 +1000,10 @@ class V7000Common(object):
 
         :param snapshot:  cinder snapshot object provided by the Manager
         :param volume:  cinder volume to be created
+        :param verify:  True to fail unless the copy to this very lun is
+                        seen to complete
+        :param in_db:  False if the lun is not a volume in the cinder DB,
+                       the copy progress is then not published
         """
 
         cinder_volume_id = volume['id']
@@ -359,39 +1019,51 @@ class V7000Common(object):
                    'dpy_name': snapshot['display_name']})
 
         source_lun_info = self.vmem_mg.lun.get_lun_info(snapshot['volume_id'])
-        if source_lun_info['subType'] != 'THICK':
-            msg = _('Lun copy currently only supported for thick luns')
-            LOG.warn(msg)
-            raise exception.ViolinBackendErr(message=msg)
 
         spec_dict = self._process_extra_specs(volume)
+        pool_type = self._get_copy_pool_type(source_lun_info, spec_dict)
         selected_pool = self._get_storage_pool(
-            volume, size_mb, spec_dict['pool_type'], "create_lun")
+            volume, size_mb, pool_type, "create_lun")
 
-        try:
-            result = self.vmem_mg.lun.copy_snapshot_to_new_lun(
-                source_lun=snapshot['volume_id'],
-                source_snapshot_comment=self._compress_snapshot_id(
-                    cinder_snapshot_id),
-                destination=cinder_volume_id,
-                storage_pool_id=selected_pool['storage_pool_id'])
-
-            if not result['success']:
-                self._check_error_code(result)
-
-        except Exception:
-            LOG.warn(
-                _("Copy snapshot to volume for "
-                  "snapshot %(snap)s volume %(vol)s failed!") %
-                {'snap': cinder_snapshot_id,
-                 'vol': cinder_volume_id})
-            raise
-
-        # get the destination lun info and extract virtualdeviceid
-        info = self.vmem_mg.lun.get_lun_info(object_id=result['object_id'])
+        with self.copy_scheduler.job(
+                volume.get('project_id'),
+                self._get_lun_pool(snapshot['volume_id']),
+                selected_pool['storage_pool']):
+            try:
+                result = self.vmem_mg.lun.copy_snapshot_to_new_lun(
+                    source_lun=snapshot['volume_id'],
+                    source_snapshot_comment=self._compress_snapshot_id(
+                        cinder_snapshot_id),
+                    destination=cinder_volume_id,
+                    storage_pool_id=selected_pool['storage_pool_id'])
+
+                if not result['success']:
+                    self._check_error_code(result)
+
+            except Exception:
+                LOG.warn(
+                    _("Copy snapshot to volume for "
+                      "snapshot %(snap)s volume %(vol)s failed!") %
+                    {'snap': cinder_snapshot_id,
+                     'vol': cinder_volume_id})
+                raise
 
-        self._wait_for_lun_or_snap_copy(
-            snapshot['volume_id'], dest_vdev_id=info['virtualDeviceID'])
+            # get the destination lun info and extract virtualdeviceid
+            info = self.vmem_mg.lun.get_lun_info(
+                object_id=result['object_id'])
+
+            copied = self._wait_for_lun_or_snap_copy(
+                snapshot['volume_id'], dest_vdev_id=info['virtualDeviceID'],
+                dest_vol_id=cinder_volume_id if in_db else None,
+                strict=verify)
+            if verify and copied is not True:
+                raise exception.ViolinBackendErr(
+                    _("Copy of snapshot %(snap)s to volume %(vol)s did not "
+                      "complete") % {'snap': cinder_snapshot_id,
+                                     'vol': cinder_volume_id})
+        self._ledger_add_lun(
+            cinder_volume_id, selected_pool['storage_pool'], size_mb,
+            self._get_allocated_mb(pool_type, size_mb))
 
         if volume.get('consistencygroup_id'):
             LOG.debug('Adding volume %(v)s to consistency group %(g)s',
@@ -401,38 +1073,37 @@ class V7000Common(object):
             self._add_to_consistencygroup(
                 volume['consistencygroup_id'], cinder_volume_id)
 
-    def _create_lun_from_lun(self, src_vol, dest_vol):
+    def _create_lun_from_lun(self, src_vol, dest_vol, verify=False,
+                             in_db=True):
         """Copy the contents of a lun to a new lun (i.e., full clone).
 
         :param src_vol:  cinder volume to clone
         :param dest_vol:  cinder volume to be created
+        :param verify:  True to fail unless the copy to this very lun is
+                        seen to complete
+        :param in_db:  False if dest_vol is not a volume in the cinder DB,
+                       the copy progress is then not published
         """
         size_mb = dest_vol['size'] * units.Ki
         result = None
         spec_dict = {}
 
-        try:
-            source_lun_info = self.vmem_mg.lun.get_lun_info(src_vol['id'])
-            if source_lun_info['subType'] != 'THICK':
-                msg = _('Lun copy currently only supported for thick luns')
-                LOG.warn(msg)
-                raise exception.ViolinBackendErr(message=msg)
+        source_lun_info = self.vmem_mg.lun.get_lun_info(src_vol['id'])
+        if source_lun_info['subType'] != 'THICK':
+            # The array only copies thick luns directly, other luns are
+            # copied out of a TimeMark
+            return self._create_lun_from_lun_timemark(
+                src_vol, dest_vol, source_lun_info['subType'], verify, in_db)
 
+        try:
             # In order to do a full clone the source lun must have a
             # snapshot resource
-            self._ensure_snapshot_resource_area(src_vol['id'])
+            self._ensure_snapshot_resource_area(src_vol['id'], src_vol)
 
             spec_dict = self._process_extra_specs(dest_vol)
             selected_pool = self._get_storage_pool(
                 dest_vol, size_mb, spec_dict['pool_type'], None)
 
-            result = self.vmem_mg.lun.copy_lun_to_new_lun(
-                source=src_vol['id'], destination=dest_vol['id'],
-                storage_pool_id=selected_pool['storage_pool_id'])
-
-            if not result['success']:
-                self._check_error_code(result)
-
         except Exception:
             LOG.warn(
                 _("Create new lun from lun for "
@@ -441,8 +1112,37 @@ class V7000Common(object):
                  'dest': dest_vol['id']})
             raise
 
-        self._wait_for_lun_or_snap_copy(
-            src_vol['id'], dest_obj_id=result['object_id'])
+        with self.copy_scheduler.job(
+                dest_vol.get('project_id'),
+                self._get_lun_pool(src_vol['id'], src_vol),
+                selected_pool['storage_pool']):
+            try:
+                result = self.vmem_mg.lun.copy_lun_to_new_lun(
+                    source=src_vol['id'], destination=dest_vol['id'],
+                    storage_pool_id=selected_pool['storage_pool_id'])
+
+                if not result['success']:
+                    self._check_error_code(result)
+
+            except Exception:
+                LOG.warn(
+                    _("Create new lun from lun for "
+                      "source %(src)s => destination %(dest)s failed!") %
+                    {'src': src_vol['id'],
+                     'dest': dest_vol['id']})
+                raise
+
+            copied = self._wait_for_lun_or_snap_copy(
+                src_vol['id'], dest_obj_id=result['object_id'],
+                dest_vol_id=dest_vol['id'] if in_db else None,
+                strict=verify)
+            if verify and copied is not True:
+                raise exception.ViolinBackendErr(
+                    _("Copy of lun %(src)s to %(dest)s did not complete") %
+                    {'src': src_vol['id'], 'dest': dest_vol['id']})
+        self._ledger_add_lun(
+            dest_vol['id'], selected_pool['storage_pool'], size_mb,
+            self._get_allocated_mb(spec_dict['pool_type'], size_mb))
 
         if dest_vol.get('consistencygroup_id'):
             LOG.debug('Adding volume %(v)s to consistency group %(g)s',
@@ -452,6 +1152,530 @@ class V7000Common(object):
             self._add_to_consistencygroup(
                 dest_vol['consistencygroup_id'], dest_vol['id'])
 
+    def _create_lun_from_lun_timemark(self, src_vol, dest_vol, sub_type,
+                                      verify=False, in_db=True):
+        """Clone a thin or dedup lun by copying a temporary TimeMark of it.
+
+        :param src_vol:  cinder volume to clone
+        :param dest_vol:  cinder volume to be created
+        :param sub_type:  array lun type of the source, for the logs
+        :param verify:  True to fail unless the copy is seen to complete
+        :param in_db:  False if dest_vol is not a volume in the cinder DB
+        """
+        snapshot = {'id': str(uuid.uuid4()),
+                    'volume_id': src_vol['id'],
+                    'display_name': None}
+
+        LOG.debug("Cloning %(type)s lun %(src)s to %(dest)s through temp "
+                  "snapshot %(snap)s.",
+                  {'type': sub_type, 'src': src_vol['id'],
+                   'dest': dest_vol['id'], 'snap': snapshot['id']})
+
+        self._create_lun_snapshot(snapshot, src_vol)
+        try:
+            self._create_volume_from_snapshot(snapshot, dest_vol,
+                                              verify=verify, in_db=in_db)
+        finally:
+            self._delete_temp_lun_snapshot(snapshot)
+
+    def _delete_temp_lun_snapshot(self, snapshot):
+        """Delete a temporary TimeMark, recording it if that fails.
+
+        A leftover TimeMark would keep its lun from being deleted, so
+        another attempt is made when it is, see
+        _delete_leftover_timemarks().  Failures are logged but not raised.
+
+        :param snapshot:  the temporary snapshot of a lun
+        """
+        try:
+            self._delete_lun_snapshot(snapshot)
+        except Exception:
+            LOG.exception(_LE("Failed to delete temp snapshot "
+                              "%(snap)s of %(vol)s."),
+                          {'snap': snapshot['id'],
+                           'vol': snapshot['volume_id']})
+            self._get_leftover_timemarks().setdefault(
+                snapshot['volume_id'], []).append(snapshot['id'])
+            self._save_state(CONCERTO_LEFTOVER_TIMEMARKS_STATE,
+                             self.leftover_timemarks)
+
+    def _get_leftover_timemarks(self):
+        """Return the leftover temp TimeMarks, loading them when needed."""
+        if self.leftover_timemarks is None:
+            self.leftover_timemarks = (
+                self._load_state(CONCERTO_LEFTOVER_TIMEMARKS_STATE) or {})
+        return self.leftover_timemarks
+
+    def _delete_leftover_timemarks(self, volume_id):
+        """Delete the temp TimeMarks a clone of a lun left behind.
+
+        :param volume_id:  cinder volume ID of the lun
+
+        Exceptions:
+            ViolinBackendErr: If a TimeMark still cannot be deleted.
+        """
+        leftovers = self._get_leftover_timemarks()
+        if volume_id not in leftovers:
+            return
+
+        try:
+            while leftovers[volume_id]:
+                self._delete_lun_snapshot(
+                    {'id': leftovers[volume_id][0], 'volume_id': volume_id,
+                     'display_name': None})
+                leftovers[volume_id].pop(0)
+            del leftovers[volume_id]
+        finally:
+            self._save_state(CONCERTO_LEFTOVER_TIMEMARKS_STATE, leftovers)
+
+    def _clone_image(self, volume, image_meta):
+        """Create a volume from an image lun cached on the array.
+
+        :param volume:  cinder volume to be created
+        :param image_meta:  glance metadata of the image
+        :returns: (None, True) if the volume was cloned from the
+                  cache, (None, False) if the image must be fetched
+        """
+        if self.config.violin_image_cache_size_gb <= 0:
+            return None, False
+
+        key = self._get_image_cache_key(image_meta)
+        pool_name = volume_utils.extract_host(volume['host'], 'pool')
+        entry = self._get_image_cache().get(pool_name, {}).get(key)
+
+        if not entry or entry['size'] > volume['size']:
+            return None, False
+        if (volume['size'] > entry['size'] and
+                not self._is_lun_extendable(volume)):
+            return None, False
+
+        LOG.debug("Cloning volume %(vol)s from cached lun %(lun)s of "
+                  "image %(image)s.", {'vol': volume['id'],
+                                       'lun': entry['lun'],
+                                       'image': image_meta['id']})
+
+        cache_vol = self._get_image_cache_volume(entry, volume['host'])
+        clone = dict(volume, size=entry['size'])
+        try:
+            self._create_lun_from_lun(cache_vol, clone)
+        except Exception:
+            # The lun may have gone away behind our back.  Cinder falls
+            # back to fetching the image into a new lun of the volume.
+            LOG.exception(_LE("Failed to clone volume %(vol)s from cached "
+                              "lun %(lun)s, dropping it from the cache."),
+                          {'vol': volume['id'], 'lun': entry['lun']})
+            self._delete_unused_lun(clone)
+            try:
+                self._delete_lun(cache_vol)
+            except Exception:
+                LOG.exception(_LE("Failed to delete cached lun %s, keeping "
+                                  "it."), entry['lun'])
+                return None, False
+            del self.image_cache[pool_name][key]
+            self._save_state(CONCERTO_IMAGE_CACHE_STATE, self.image_cache)
+            return None, False
+
+        if volume['size'] > entry['size']:
+            try:
+                self._extend_lun(clone, volume['size'])
+            except Exception:
+                LOG.exception(_LE("Failed to extend volume %s cloned from "
+                                  "the image cache."), volume['id'])
+                self._delete_unused_lun(clone)
+                return None, False
+
+        entry['last_used'] = time.time()
+        self._save_state(CONCERTO_IMAGE_CACHE_STATE, self.image_cache)
+
+        return None, True
+
+    def _cache_image_volume(self, context, volume, image_service, image_id):
+        """Keep a copy of a volume the image was just written to.
+
+        The copy becomes the source of later volumes created from the
+        same image in the same pool.  A TimeMark of the volume is taken
+        before the volume is handed over, and copied in the background,
+        so writes to the volume never reach the cache.  Failures are
+        logged but not raised, the volume itself is fine.
+
+        An image lun bigger than the volume is replaced, so that volumes
+        as small as the image was written to can be cloned from it.
+
+        :param context:  the context of the caller
+        :param volume:  cinder volume holding the image
+        :param image_service:  glance image service
+        :param image_id:  glance ID of the image
+        """
+        capacity = self.config.violin_image_cache_size_gb
+        pool_name = volume_utils.extract_host(volume['host'], 'pool')
+        if capacity <= 0 or volume['size'] > capacity or not pool_name:
+            return
+
+        try:
+            image_meta = image_service.show(context, image_id)
+            key = self._get_image_cache_key(image_meta)
+            if not key:
+                return
+
+            entries = self._get_image_cache().setdefault(pool_name, {})
+            if key in entries and entries[key]['size'] <= volume['size']:
+                entries[key]['last_used'] = time.time()
+                self._save_state(CONCERTO_IMAGE_CACHE_STATE,
+                                 self.image_cache)
+                return
+        except Exception:
+            LOG.exception(_LE("Failed to cache image %(image)s of volume "
+                              "%(vol)s."), {'image': image_id,
+                                            'vol': volume['id']})
+            return
+
+        if (pool_name, key) in self.image_cache_fills:
+            return
+
+        snapshot = {'id': str(uuid.uuid4()),
+                    'volume_id': volume['id'],
+                    'display_name': None}
+        try:
+            self._create_lun_snapshot(snapshot, volume)
+        except Exception:
+            LOG.exception(_LE("Failed to cache image %(image)s of volume "
+                              "%(vol)s."), {'image': image_id,
+                                            'vol': volume['id']})
+            return
+
+        self.image_cache_fills.add((pool_name, key))
+        self.image_cache_sources[volume['id']] = event.Event()
+        greenthread.spawn_n(self._fill_image_cache, volume, snapshot,
+                            pool_name, key, image_id)
+
+    def _fill_image_cache(self, volume, snapshot, pool_name, key, image_id):
+        """Copy a TimeMark holding an image into a new cached image lun.
+
+        :param volume:  cinder volume holding the image
+        :param snapshot:  temporary snapshot of the volume to copy, it is
+                          deleted once copied
+        :param pool_name:  storage pool of the cache
+        :param key:  cache key of the image
+        :param image_id:  glance ID of the image
+        """
+        capacity = self.config.violin_image_cache_size_gb
+        entry = {'lun': str(uuid.uuid4()),
+                 'size': volume['size'],
+                 'image_id': image_id}
+        cache_vol = self._get_image_cache_volume(entry, volume['host'])
+
+        LOG.debug("Caching image %(image)s of volume %(vol)s in lun "
+                  "%(lun)s.", {'image': image_id, 'vol': volume['id'],
+                               'lun': entry['lun']})
+
+        try:
+            self._create_volume_from_snapshot(snapshot, cache_vol,
+                                              in_db=False)
+        except Exception:
+            LOG.exception(_LE("Failed to cache image %(image)s of volume "
+                              "%(vol)s."), {'image': image_id,
+                                            'vol': volume['id']})
+            self._delete_unused_lun(cache_vol)
+        else:
+            self._add_image_cache_entry(pool_name, key, entry, capacity)
+        finally:
+            self._delete_temp_lun_snapshot(snapshot)
+            self.image_cache_fills.discard((pool_name, key))
+            self.image_cache_sources.pop(volume['id']).send()
+
+    def _add_image_cache_entry(self, pool_name, key, entry, capacity):
+        """Add a new image lun to the cache, replacing a bigger one.
+
+        If the lun it replaces cannot be deleted, for instance while a
+        clone is copied out of it, that one is kept and the new lun is
+        deleted instead.
+
+        :param pool_name:  storage pool of the cache
+        :param key:  cache key of the image
+        :param entry:  the cache entry of the new image lun
+        :param capacity:  GB of image luns the pool may keep
+        """
+        entries = self.image_cache.setdefault(pool_name, {})
+        old = entries.get(key)
+        if old:
+            LOG.debug("Replacing image %(image)s lun %(old)s with smaller "
+                      "lun %(lun)s.", {'image': entry['image_id'],
+                                       'old': old['lun'],
+                                       'lun': entry['lun']})
+            try:
+                self._delete_lun(self._get_image_cache_volume(old))
+            except Exception:
+                LOG.warning(_LW("Unable to replace image lun %s, keeping "
+                                "it."), old['lun'])
+                self._delete_unused_lun(self._get_image_cache_volume(entry))
+                return
+
+        entry['last_used'] = time.time()
+        entries[key] = entry
+        self._evict_image_cache(pool_name, capacity)
+        self._save_state(CONCERTO_IMAGE_CACHE_STATE, self.image_cache)
+
+    def _delete_unused_lun(self, volume):
+        """Delete a lun left over by a failed copy, logging errors.
+
+        :param volume:  volume dict standing for the lun
+        """
+        try:
+            self._delete_lun(volume)
+        except Exception:
+            LOG.exception(_LE("Failed to delete unused lun %s."),
+                          volume['id'])
+
+    def _evict_image_cache(self, pool_name, capacity):
+        """Delete the least recently used image luns of a pool.
+
+        :param pool_name:  storage pool of the cache
+        :param capacity:  GB of image luns the pool may keep
+        """
+        entries = self.image_cache[pool_name]
+        used = sum(e['size'] for e in entries.values())
+
+        lru = sorted(entries.items(), key=lambda item: item[1]['last_used'])
+        for key, entry in lru:
+            if used <= capacity:
+                break
+
+            LOG.debug("Evicting image %(image)s lun %(lun)s from the "
+                      "cache.", {'image': entry['image_id'],
+                                 'lun': entry['lun']})
+            try:
+                self._delete_lun(self._get_image_cache_volume(entry))
+            except Exception:
+                LOG.warning(_LW("Unable to evict image lun %s, keeping "
+                                "it."), entry['lun'])
+                continue
+
+            del entries[key]
+            used -= entry['size']
+
+    def _get_image_cache(self):
+        """Return the image luns by pool, loading them when needed."""
+        if self.image_cache is None:
+            self.image_cache = (
+                self._load_state(CONCERTO_IMAGE_CACHE_STATE) or {})
+        return self.image_cache
+
+    def _get_image_cache_key(self, image_meta):
+        """Return the cache key of an image, None if it has no checksum."""
+        if not image_meta.get('checksum'):
+            return None
+        return '%s:%s' % (image_meta['id'], image_meta['checksum'])
+
+    def _get_image_cache_volume(self, entry, host=None):
+        """Return a volume dict standing for a cached image lun."""
+        return {'id': entry['lun'],
+                'size': entry['size'],
+                'host': host,
+                'display_name': 'image-%s' % entry['image_id'],
+                'volume_type_id': None,
+                'provider_location': None}
+
+    def _migrate_volume(self, ctxt, volume, host):
+        """Move a volume to another pool of the same array.
+
+        The lun is copied on the array into the pool of the destination
+        host, see _move_lun().
+
+        :param ctxt:  the context of the caller
+        :param volume:  cinder volume to migrate
+        :param host:  dict with the destination 'host' string and its
+                      'capabilities'
+        :returns: (True, None) if the volume was moved, (False, None) if
+                  the generic migration must be used
+        """
+        if (host['capabilities'].get('location_info') !=
+                self._get_location_info(self.config.san_ip)):
+            return False, None
+
+        reason = self._get_migration_blocker(ctxt, volume)
+        if reason:
+            LOG.info(_LI("Volume %(vol)s cannot be migrated on the array, "
+                         "%(reason)s."), {'vol': volume['id'],
+                                          'reason': reason})
+            return False, None
+
+        dest_pool = volume_utils.extract_host(host['host'], 'pool')
+        if dest_pool == self._get_lun_pool(volume['id'], volume):
+            # Another backend of the same array and pool, nothing to move
+            return True, None
+
+        LOG.debug("Migrating volume %(vol)s to pool %(pool)s.",
+                  {'vol': volume['id'], 'pool': dest_pool})
+
+        self._move_lun(volume, dict(volume, host=host['host']))
+
+        return True, None
+
+    def _retype(self, ctxt, volume, new_type, diff, host):
+        """Change the volume type of a volume without the generic copy.
+
+        Changes leaving the lun layout and pool alone are only recorded
+        by cinder.  A new pool type, storage pool or host pool is
+        applied by copying the lun on the array, see _move_lun().
+
+        :param ctxt:  the context of the caller
+        :param volume:  cinder volume to retype
+        :param new_type:  the new volume type
+        :param diff:  differences between the old and new types
+        :param host:  dict with the destination 'host' string and its
+                      'capabilities'
+        :returns: True if the volume was retyped, False if the generic
+                  migration must be used
+        """
+        new_vol = dict(volume, volume_type_id=new_type['id'],
+                       host=host['host'])
+        old_specs = self._process_extra_specs(volume)
+        new_specs = self._process_extra_specs(new_vol)
+
+        if (diff.get('encryption') or
+                old_specs['lun_encryption'] != new_specs['lun_encryption']):
+            LOG.info(_LI("Retype of volume %s changes its encryption, "
+                         "using a migration."), volume['id'])
+            return False
+
+        current_pool = self._get_lun_pool(volume['id'], volume)
+        new_pool = (self._get_violin_extra_spec(new_vol, 'storage_pool') or
+                    volume_utils.extract_host(host['host'], 'pool'))
+
+        if (old_specs['pool_type'] == new_specs['pool_type'] and
+                new_pool in (None, current_pool)):
+            LOG.debug("Retyping volume %s in place.", volume['id'])
+            return True
+
+        if (host['capabilities'].get('location_info') !=
+                self._get_location_info(self.config.san_ip)):
+            return False
+
+        reason = self._get_migration_blocker(ctxt, volume, retype=True)
+        if not reason and new_specs['thick']:
+            lun_info = self.vmem_mg.lun.get_lun_info(volume['id'])
+            if lun_info['subType'] != 'THICK':
+                reason = _('copies of thin luns stay thin')
+        if reason:
+            LOG.info(_LI("Volume %(vol)s cannot be retyped on the array, "
+                         "%(reason)s."), {'vol': volume['id'],
+                                          'reason': reason})
+            return False
+
+        LOG.debug("Retyping volume %(vol)s to a %(type)s lun in pool "
+                  "%(pool)s.", {'vol': volume['id'],
+                                'type': new_specs['pool_type'],
+                                'pool': new_pool})
+
+        self._move_lun(volume, new_vol)
+
+        return True
+
+    def _move_lun(self, volume, moved_vol):
+        """Recreate the lun of a volume through an in-array copy.
+
+        Luns are named after their volume, so the copy goes through a
+        temporary lun: the volume is copied there, its old lun deleted,
+        and the temporary lun copied back under the volume's name.  The
+        old lun is only deleted once the copy to the temporary lun is
+        seen to complete and the temporary lun is named in the volume's
+        admin metadata, so its data can be found if the move dies.
+
+        :param volume:  cinder volume to move
+        :param moved_vol:  the volume as it is once moved, its host and
+                           volume type decide where the lun goes
+        """
+        temp_vol = dict(moved_vol, id=str(uuid.uuid4()))
+        ctxt = context.get_admin_context()
+
+        try:
+            self._create_lun_from_lun(volume, temp_vol, verify=True,
+                                      in_db=False)
+            # raises if the temporary lun is not there
+            self.vmem_mg.lun.get_lun_info(temp_vol['id'])
+            api.volume_admin_metadata_update(
+                ctxt, volume['id'],
+                {CONCERTO_MOVE_TEMP_LUN_KEY: temp_vol['id']}, False)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                self._delete_unused_lun(temp_vol)
+
+        self._delete_lun(volume)
+
+        try:
+            self._create_lun_from_lun(temp_vol, moved_vol, verify=True)
+        except Exception:
+            with excutils.save_and_reraise_exception():
+                LOG.error(_LE("Moving volume %(vol)s failed, its data "
+                              "is in lun %(lun)s."),
+                          {'vol': volume['id'], 'lun': temp_vol['id']})
+
+        self._delete_lun(temp_vol)
+
+        try:
+            api.volume_admin_metadata_delete(
+                ctxt, volume['id'], CONCERTO_MOVE_TEMP_LUN_KEY)
+        except Exception as e:
+            LOG.warning(_LW("Unable to remove %(key)s of volume %(vol)s: "
+                            "%(err)s"), {'key': CONCERTO_MOVE_TEMP_LUN_KEY,
+                                         'vol': volume['id'], 'err': e})
+
+    def _get_migration_blocker(self, ctxt, volume, retype=False):
+        """Return why a volume cannot be moved on the array, or None.
+
+        :param ctxt:  the context of the caller
+        :param volume:  cinder volume to migrate
+        :param retype:  True for a retype, the volume is then 'retyping'
+                        and its status before the retype is looked at
+        """
+        status = volume['status']
+        if retype:
+            status = volume.get('previous_status')
+        if (status != 'available' or
+                volume.get('attach_status') == 'attached'):
+            return _('it is attached')
+        if volume.get('consistencygroup_id'):
+            return _('it is in a consistency group')
+        if api.snapshot_get_all_for_volume(ctxt, volume['id']):
+            return _('it has snapshots')
+        return None
+
+    def _get_location_info(self, san_ip):
+        """Return the location_info naming the array behind a gateway.
+
+        :param san_ip: the IP address / hostname of the Violin gateway
+        """
+        return 'V7000:%s' % FQDN_CACHE.getfqdn(san_ip)
+
+    def _get_copy_pool_type(self, source_lun_info, spec_dict):
+        """Return the type of pool a copy of a lun is made in.
+
+        A thick copy of a thin or dedup lun would allocate the whole
+        lun, so such luns are copied into thin luns unless the volume
+        type of the copy asks for thin or dedup itself.
+
+        :param source_lun_info: array lun info of the copy source
+        :param spec_dict: extra specs of the copy, from
+                          _process_extra_specs()
+        """
+        if source_lun_info['subType'] == 'THICK' or not spec_dict['thick']:
+            return spec_dict['pool_type']
+        return 'thin'
+
+    def _get_lun_pool(self, volume_id, volume=None):
+        """Return the name of the storage pool a lun lives in.
+
+        :param volume_id: cinder volume ID of the lun
+        :param volume: optional cinder volume, whose host is looked at
+                       when the lun ledger does not know the lun
+        :returns: the pool name, or None if it is not known
+        """
+        if volume_id in self.lun_ledger:
+            return self.lun_ledger[volume_id][0]
+        if volume and volume.get('host'):
+            return volume_utils.extract_host(volume['host'], 'pool')
+        return None
+
     def _send_cmd(self, request_func, success_msgs, *args, **kwargs):
         """Run an XG request function, and retry as needed.
 
@@ -567,18 +1791,25 @@ class V7000Common(object):
 
         return resp
 
-    def _ensure_snapshot_resource_area(self, volume_id):
+    def _ensure_snapshot_resource_area(self, volume_id, volume=None):
         """Make sure concerto snapshot resource area exists on volume.
 
         :param volume_id:  Cinder volume ID corresponding to the backend LUN
+        :param volume:  optional cinder volume of the LUN, required for
+                        LUNs that are not in the cinder DB, such as
+                        cached image LUNs
 
         Exceptions:
             VolumeBackendAPIException: if cinder volume does not exist
                on backnd, or SRA could not be created.
         """
 
-        ctxt = context.get_admin_context()
-        volume = api.volume_get(ctxt, volume_id)
+        if volume_id in self.luns_with_sra:
+            return
+
+        if not volume:
+            ctxt = context.get_admin_context()
+            volume = api.volume_get(ctxt, volume_id)
         spec_dict = {}
 
         if not volume:
@@ -612,7 +1843,8 @@ class V7000Common(object):
                     volume,
                     snap_size_mb,
                     spec_dict['pool_type'],
-                    None)
+                    None,
+                    use_host_pool=False)
 
                 LOG.debug("Creating SRA of %(ssmb)sMB for lun of %(lsmb)sMB "
                           "on %(vol_id)s",
@@ -642,6 +1874,8 @@ class V7000Common(object):
                        {'vol': volume_id, 'res': res['msg']})
                 raise exception.VolumeBackendAPIException(data=msg)
 
+        self.luns_with_sra.add(volume_id)
+
     def _ensure_snapshot_policy(self, volume_id):
         """Ensure concerto snapshot policy exists on cinder volume.
 
@@ -653,6 +1887,9 @@ class V7000Common(object):
             VolumeBackendAPIException: when snapshot policy cannot be created.
         """
 
+        if volume_id in self.luns_with_snapshot_policy:
+            return
+
         if not self.vmem_mg.snapshot.lun_has_a_snapshot_policy(
                 lun=volume_id):
 
@@ -671,12 +1908,17 @@ class V7000Common(object):
                     {'vol': volume_id, 'res': res['msg']})
                 raise exception.VolumeBackendAPIException(data=msg)
 
+        self.luns_with_snapshot_policy.add(volume_id)
+
     def _delete_lun_snapshot_bookkeeping(self, volume_id):
         """Clear residual snapshot support resources from LUN.
 
         Exceptions:
             VolumeBackendAPIException: If snapshots still exist on the LUN.
         """
+        self.luns_with_sra.discard(volume_id)
+        self.luns_with_snapshot_policy.discard(volume_id)
+        self.timemark_oids.pop(volume_id, None)
 
         # Make absolutely sure there are no snapshots present
         try:
@@ -721,6 +1963,59 @@ class V7000Common(object):
                       "volume %s.", volume_id)
             pass
 
+    def _get_state_file(self, name):
+        """Path of a local state file for this array.
+
+        :param name:  short name of the kind of state kept in the file
+        :returns: path of the file under violin_state_path
+        """
+        return os.path.join(self.config.violin_state_path,
+                            '%s-%s.json' % (name, self.config.san_ip))
+
+    def _load_state(self, name):
+        """Read a local state file written by _save_state.
+
+        :param name:  short name of the kind of state kept in the file
+        :returns: the saved dict, or None if missing or unreadable
+        """
+        path = self._get_state_file(name)
+
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                LOG.warning(_LW("Unable to read state file %(path)s: "
+                                "%(err)s"), {'path': path, 'err': e})
+        except ValueError:
+            LOG.warning(_LW("Ignoring corrupt state file %s."), path)
+
+        return None
+
+    def _save_state(self, name, data):
+        """Atomically replace a local state file.
+
+        Failures are logged but not raised, the state is only a cache.
+
+        :param name:  short name of the kind of state kept in the file
+        :param data:  json-serializable dict to save
+        """
+        path = self._get_state_file(name)
+        tmp_path = path + '.tmp'
+
+        try:
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            LOG.warning(_LW("Unable to write state file %(path)s: "
+                            "%(err)s"), {'path': path, 'err': e})
+
     def _compress_snapshot_id(self, cinder_snap_id):
         """Compress cinder snapshot ID so it fits in backend.
 
@@ -728,66 +2023,164 @@ class V7000Common(object):
         """
         return ''.join(six.text_type(cinder_snap_id).split('-'))
 
+    def _remember_timemark_oid(self, name, comment, oid):
+        """Record the object ID of a TimeMark in the index.
+
+        :param name:  LUN or snapgroup name the TimeMark belongs to
+        :param comment:  compressed snapshot ID used as TimeMark comment
+        :param oid:  backend object ID of the TimeMark
+        """
+        self.timemark_oids.setdefault(name, {})[comment] = oid
+
+    def _forget_timemark_oid(self, name, comment):
+        """Remove a TimeMark from the index.
+
+        :param name:  LUN or snapgroup name the TimeMark belongs to
+        :param comment:  compressed snapshot ID used as TimeMark comment
+        """
+        self.timemark_oids.get(name, {}).pop(comment, None)
+
+    def _get_timemark_oid(self, lun, comment):
+        """Get the object ID of a LUN TimeMark from its comment.
+
+        The backend is only asked when the index does not know the
+        TimeMark yet, the answer is then kept for later lookups.
+
+        :param lun:  cinder volume ID corresponding to the backend LUN
+        :param comment:  compressed snapshot ID used as TimeMark comment
+        :returns: backend object ID of the TimeMark
+        """
+        oid = self.timemark_oids.get(lun, {}).get(comment)
+        if oid is None:
+            oid = self.vmem_mg.snapshot.snapshot_comment_to_object_id(
+                lun, comment)
+            if oid is not None:
+                self._remember_timemark_oid(lun, comment, oid)
+        return oid
+
+    def _get_snapgroup_timemark_oid(self, group, comment):
+        """Get the object ID of a snapgroup TimeMark from its comment.
+
+        :param group:  consistencygroup name as a string
+        :param comment:  compressed snapshot ID used as TimeMark comment
+        :returns: backend object ID of the TimeMark
+        """
+        oid = self.timemark_oids.get(group, {}).get(comment)
+        if oid is None:
+            snap = self.vmem_mg.snapshot
+            oid = snap.snapgroup_snapshot_comment_to_object_id(
+                group, comment)
+            if oid is not None:
+                self._remember_timemark_oid(group, comment, oid)
+        return oid
+
+    def _forget_snapgroup_timemarks(self, group, comment, members):
+        """Remove a snapgroup TimeMark and its member TimeMarks.
+
+        :param group:  consistencygroup name as a string
+        :param comment:  compressed snapshot ID used as TimeMark comment
+        :param members:  cinder volume IDs of the snapgroup's LUNs
+        """
+        for name in [group] + list(members):
+            self._forget_timemark_oid(name, comment)
+
     def _wait_for_lun_or_snap_copy(self, src_vol_id, dest_vdev_id=None,
-                                   dest_obj_id=None):
+                                   dest_obj_id=None, dest_vol_id=None,
+                                   strict=False):
         """Poll to see when a lun or snap copy to a lun is complete.
 
         :param src_vol_id:  cinder volume ID of source volume
         :param dest_vdev_id:  virtual device ID of destination, for snap copy
         :param dest_obj_id:  lun object ID of destination, for lun copy
+        :param dest_vol_id:  cinder volume ID of destination, to publish
+                             the copy progress in its admin metadata
+        :param strict:  True to only succeed once the destination itself
+                        is reported complete, see CopyPoller.watch()
         :returns: True if successful, False otherwise
         """
-        wait_id = None
-        wait_func = None
-
         if dest_vdev_id:
-            wait_id = dest_vdev_id
-            wait_func = self.vmem_mg.snapshot.get_snapshot_copy_status
+            kind, wait_id = 'snapshot', dest_vdev_id
         elif dest_obj_id:
-            wait_id = dest_obj_id
-            wait_func = self.vmem_mg.lun.get_lun_copy_status
+            kind, wait_id = 'lun', dest_obj_id
         else:
             return False
 
-        def _loop_func():
-            LOG.debug("Entering _wait_for_lun_or_snap_copy loop: "
-                      "vdev=%s, objid=%s", dest_vdev_id, dest_obj_id)
-
-            target_id, mb_copied, percent = wait_func(src_vol_id)
-
-            if target_id is None:
-                # pre-copy transient result
-                LOG.debug("lun or snap copy prepping.")
-                pass
-            elif target_id != wait_id:
-                # the copy is complete, another lun is being copied
-                LOG.debug("lun or snap copy complete.")
-                raise loopingcall.LoopingCallDone(retvalue=True)
-            elif mb_copied is not None:
-                # copy is in progress
-                LOG.debug("MB copied:%d, percent done: %d.",
-                          mb_copied, percent)
-                pass
-            elif percent == 0:
-                # copy has just started
-                LOG.debug("lun or snap copy started.")
-                pass
-            elif percent == 100:
-                # copy is complete
-                LOG.debug("lun or snap copy complete.")
-                raise loopingcall.LoopingCallDone(retvalue=True)
-            else:
-                # unexpected case
-                LOG.debug("unexpected case (%{id}s, %{bytes}s, %{percent}s)",
-                          {'id': six.text_type(target_id),
-                           'bytes': six.text_type(mb_copied),
-                           'percent': six.text_type(percent)})
-                raise loopingcall.LoopingCallDone(retvalue=False)
+        LOG.debug("Waiting for %(kind)s copy of %(src)s to %(dest)s.",
+                  {'kind': kind, 'src': src_vol_id, 'dest': wait_id})
 
-        timer = loopingcall.FixedIntervalLoopingCall(_loop_func)
-        success = timer.start(interval=1).wait()
+        # Status requests are shared with the other copies in flight
+        try:
+            return self.copy_poller.watch(
+                kind, src_vol_id, wait_id, dest_vol_id, strict).wait()
+        finally:
+            if dest_vol_id:
+                self._clear_copy_progress(dest_vol_id)
+
+    def _report_copy_progress(self, volume_id, mb_copied, percent, eta):
+        """Publish the progress of a copy in the volume's admin metadata.
+
+        Updates are throttled to one every CONCERTO_COPY_PROGRESS_INTERVAL
+        seconds per volume.
+
+        :param volume_id:  cinder volume ID of the copy destination
+        :param mb_copied:  MB copied so far
+        :param percent:  percent of the copy done
+        :param eta:  estimated completion time in seconds since the
+                     epoch, or None
+        """
+        now = time.time()
+        last = self.copy_progress.get(volume_id)
+        if last and now - last[0] < CONCERTO_COPY_PROGRESS_INTERVAL:
+            return
+
+        metadata = {'violin_copy_percent': six.text_type(percent)}
+        if last and now > last[0]:
+            metadata['violin_copy_mbps'] = six.text_type(
+                round((mb_copied - last[1]) / (now - last[0]), 1))
+        if eta:
+            metadata['violin_copy_eta'] = (
+                datetime.datetime.utcfromtimestamp(eta).isoformat())
+
+        try:
+            api.volume_admin_metadata_update(
+                context.get_admin_context(), volume_id, metadata, False)
+        except Exception as e:
+            LOG.warning(_LW("Unable to publish copy progress of volume "
+                            "%(vol)s: %(err)s"), {'vol': volume_id, 'err': e})
 
-        return success
+        self.copy_progress[volume_id] = (now, mb_copied)
+
+    def _clear_copy_progress(self, volume_id):
+        """Remove the copy progress published for a volume.
+
+        :param volume_id:  cinder volume ID of the copy destination
+        """
+        if self.copy_progress.pop(volume_id, None) is None:
+            return
+
+        ctxt = context.get_admin_context()
+        for key in CONCERTO_COPY_PROGRESS_KEYS:
+            try:
+                api.volume_admin_metadata_delete(ctxt, volume_id, key)
+            except Exception:
+                LOG.debug("No %(key)s to remove from volume %(vol)s.",
+                          {'key': key, 'vol': volume_id})
+
+    def _new_poll_schedule(self):
+        """Create the schedule for polling a task running on the array."""
+        return PollSchedule(self.config.violin_max_poll_interval)
+
+    def _get_copy_status(self, kind, src_vol_id):
+        """Ask the array how the copy out of a volume is going.
+
+        :param kind:  'lun' or 'snapshot', the kind of copy
+        :param src_vol_id:  cinder volume ID of source volume
+        :returns: (target id, MB copied, percent) tuple
+        """
+        if kind == 'snapshot':
+            return self.vmem_mg.snapshot.get_snapshot_copy_status(src_vol_id)
+        else:
+            return self.vmem_mg.lun.get_lun_copy_status(src_vol_id)
 
     def _is_supported_vmos_version(self, version_string):
         """Check a version string for compatibility with OpenStack.
@@ -889,8 +2282,11 @@ class V7000Common(object):
                         break
         return spec_value
 
-    def _get_storage_pool(self, volume, size_in_mb, pool_type, usage):
-        # User-specified pool takes precedence over others
+    def _get_storage_pool(self, volume, size_in_mb, pool_type, usage,
+                          use_host_pool=True):
+        # User-specified pool takes precedence over others.  Luns then go
+        # to the pool in their host string; other resources, such as
+        # SRAs, pass use_host_pool=False and let the backend pick one.
 
         pool = None
         typeid = volume['volume_type_id']
@@ -898,16 +2294,31 @@ class V7000Common(object):
             # Extract the storage_pool name if one is specified
             pool = self._get_violin_extra_spec(volume, "storage_pool")
 
+        # Then the pool the scheduler placed the volume in
+        host_pool = None
+        if not pool and use_host_pool and volume.get('host'):
+            host_pool = volume_utils.extract_host(volume['host'], 'pool')
+
         # Select a storage pool
         selected_pool = self.vmem_mg.pool.select_storage_pool(
             size_in_mb,
             pool_type,
-            pool,
+            pool or host_pool,
             self.config.violin_dedup_only_pools,
             self.config.violin_dedup_capable_pools,
             self.config.violin_pool_allocation_method,
             usage)
 
+        if selected_pool is None and host_pool:
+            # The stats the scheduler used were stale.  Creating the lun
+            # in another pool would leave the volume's host naming the
+            # wrong pool, so fail and have the volume rescheduled.
+            msg = (_("Storage pool %(pool)s cannot hold a %(type)s lun of "
+                     "%(size)s MB.") %
+                   {'pool': host_pool, 'type': pool_type,
+                    'size': size_in_mb})
+            raise exception.ViolinBackendErrNotFound(message=msg)
+
         if selected_pool is None:
             # Backend has not provided a suitable storage pool
             msg = _("Backend does not have a suitable storage pool.")
@@ -966,30 +2377,254 @@ class V7000Common(object):
 
         return spec_dict
 
+    def _start_stats_collector(self, san_ip):
+        """Start gathering the array stats in the background.
+
+        Once started, _get_volume_stats() answers from the latest
+        collected stats instead of querying the array.
+
+        :param san_ip: the IP address / hostname of the Violin gateway
+        """
+        if (self.config.violin_stats_refresh_interval <= 0 or
+                self.stats_collector):
+            return
+
+        self.stats_collector = loopingcall.DynamicLoopingCall(
+            self._refresh_volume_stats, san_ip)
+        self.stats_collector.start()
+
+    def _refresh_volume_stats(self, san_ip):
+        """Collect the array stats on behalf of the stats collector.
+
+        :param san_ip: the IP address / hostname of the Violin gateway
+        :returns: seconds to wait before the next collection
+        """
+        try:
+            data = self._collect_volume_stats(san_ip)
+        except Exception:
+            LOG.exception(_LE("Failed to refresh array stats, keeping "
+                              "the previous ones."))
+        else:
+            self.stats_snapshot = (data, time.time())
+
+        return self._get_stats_refresh_delay()
+
+    def _get_stats_refresh_delay(self):
+        """Jittered delay between two background stats collections.
+
+        The jitter keeps several backends on the same gateway from
+        querying it in lockstep.
+        """
+        interval = self.config.violin_stats_refresh_interval
+        return interval * random.uniform(1 - CONCERTO_STATS_REFRESH_JITTER,
+                                         1 + CONCERTO_STATS_REFRESH_JITTER)
+
     def _get_volume_stats(self, san_ip):
+        """Return the array stats, along with the time they were gathered.
+
+        Uses the latest stats of the background collector when it is
+        running, and queries the array directly otherwise.
+
+        :param san_ip: the IP address / hostname of the Violin gateway
+        """
+        if self.stats_collector and self.stats_snapshot:
+            data, timestamp = self.stats_snapshot
+        else:
+            data = self._collect_volume_stats(san_ip)
+            timestamp = time.time()
+
+        data = dict(data)
+        data['stats_timestamp'] = timestamp
+        data.update(self.copy_scheduler.get_stats())
+        data.update(self.deletion_service.get_stats())
+
+        return data
+
+    def _collect_volume_stats(self, san_ip):
         """Gathers array stats and converts them to GB values.
 
         :param san_ip: the IP address / hostname of the Violin gateway
         """
         free_gb = 0
         total_gb = 0
+        pool_stats = []
+        location_info = self._get_location_info(san_ip)
+
+        if self.host and (time.time() - self.lun_ledger_time >=
+                          self.config.violin_ledger_refresh_interval):
+            self._reconcile_lun_ledger()
+
+        provisioned_mb = {}
+        for pool_name, prov_mb, alloc_mb in self.lun_ledger.values():
+            provisioned_mb[pool_name] = (
+                provisioned_mb.get(pool_name, 0) + prov_mb)
+
+        for pool_name, pool_free_mb, pool_total_mb in self._get_pool_usage(
+                san_ip):
+            free_gb += pool_free_mb // 1024
+            total_gb += pool_total_mb // 1024
 
-        owner = socket.getfqdn(san_ip)
-        # Store DNS lookups to prevent asking the same question repeatedly
-        owner_lookup = {san_ip: owner}
+            pool = {
+                'pool_name': pool_name,
+                'free_capacity_gb': pool_free_mb // 1024,
+                'total_capacity_gb': pool_total_mb // 1024,
+                'provisioned_capacity_gb':
+                    provisioned_mb.get(pool_name, 0) // 1024,
+                'max_over_subscription_ratio':
+                    self.config.max_over_subscription_ratio,
+                'reserved_percentage': 0,
+                'QoS_support': False,
+                'consistencygroup_support': True,
+                'location_info': location_info,
+            }
+            pool.update(self._get_pool_capabilities(pool_name))
+            pool_stats.append(pool)
+
+        data = {
+            'vendor_name': 'Violin Memory, Inc.',
+            'reserved_percentage': 0,
+            'QoS_support': False,
+            'free_capacity_gb': free_gb,
+            'total_capacity_gb': total_gb,
+            'consistencygroup_support': True,
+            'location_info': location_info,
+            'pools': pool_stats,
+        }
+
+        return data
+
+    @staticmethod
+    def _get_allocated_mb(pool_type, size_mb):
+        """MB a new lun allocates up front, see _process_extra_specs().
+
+        Only thick luns are fully allocated, others start at 10%.
+
+        :param pool_type: 'thick', 'thin' or 'dedup'
+        :param size_mb: provisioned size of the lun in MB
+        """
+        if pool_type == 'thick':
+            return size_mb
+        return size_mb // 10
+
+    def _ledger_add_lun(self, volume_id, pool_name, provisioned_mb,
+                        allocated_mb):
+        """Record a new lun in the provisioned capacity ledger.
+
+        :param volume_id: cinder volume ID of the lun
+        :param pool_name: storage pool the lun was created in
+        :param provisioned_mb: size the lun can grow to
+        :param allocated_mb: space allocated to the lun when created
+        """
+        self.lun_ledger[volume_id] = (pool_name, provisioned_mb,
+                                      allocated_mb)
+
+    def _ledger_extend_lun(self, volume_id, delta_mb):
+        """Account for an extended lun in the provisioned capacity ledger.
+
+        :param volume_id: cinder volume ID of the lun
+        :param delta_mb: number of MB the lun grew by
+        """
+        entry = self.lun_ledger.get(volume_id)
+        if entry:
+            pool_name, prov_mb, alloc_mb = entry
+            if alloc_mb == prov_mb:
+                # Thick luns are fully allocated
+                alloc_mb += delta_mb
+            self.lun_ledger[volume_id] = (pool_name, prov_mb + delta_mb,
+                                          alloc_mb)
+
+    def _reconcile_lun_ledger(self):
+        """Rebuild the provisioned capacity ledger from the cinder DB.
+
+        Picks up luns created before the driver was restarted, and drops
+        ones whose create or delete never made it to the ledger.  Known
+        luns keep the pool and allocation they were created with, others
+        are placed in the pool of their host string.  Cached image luns
+        are not in the cinder DB and are taken from the image cache.
+        """
+        ctxt = context.get_admin_context()
+        try:
+            volumes = api.volume_get_all_by_host(ctxt, self.host)
+        except Exception:
+            LOG.exception(_LE("Unable to reconcile the provisioned "
+                              "capacity ledger."))
+            return
+
+        ledger = {}
+        pool_types = {}
+        for volume in volumes:
+            if volume['status'] in ('deleting', 'error_deleting', 'error'):
+                continue
+
+            size_mb = volume['size'] * units.Ki
+            entry = self.lun_ledger.get(volume['id'])
+            if entry:
+                pool_name, prov_mb, alloc_mb = entry
+                ledger[volume['id']] = (pool_name, size_mb,
+                                        min(alloc_mb, size_mb))
+                continue
+
+            typeid = volume['volume_type_id']
+            if typeid not in pool_types:
+                pool_types[typeid] = (
+                    self._process_extra_specs(volume)['pool_type'])
+            alloc_mb = self._get_allocated_mb(pool_types[typeid], size_mb)
+
+            pool_name = volume_utils.extract_host(volume['host'], 'pool')
+            ledger[volume['id']] = (pool_name, size_mb, alloc_mb)
+
+        # Cached image luns are not in the cinder DB
+        for pool_name, entries in self._get_image_cache().items():
+            for entry in entries.values():
+                size_mb = entry['size'] * units.Ki
+                ledger[entry['lun']] = self.lun_ledger.get(
+                    entry['lun'], (pool_name, size_mb, size_mb))
+
+        self.lun_ledger = ledger
+        self.lun_ledger_time = time.time()
+
+    def _get_pool_usage(self, san_ip):
+        """Free and total MB of the gateway's devices in each storage pool.
+
+        The short pool summaries are compared with the ones behind the
+        previous answer first.  The much larger per-device details are
+        only downloaded again when a summary changed, or when they are
+        older than violin_stats_full_refresh_interval.
+
+        :param san_ip: the IP address / hostname of the Violin gateway
+        :returns: list of (pool name, free MB, total MB) tuples
+        """
+        full_interval = self.config.violin_stats_full_refresh_interval
+
+        if (self.pool_usage is not None and full_interval > 0 and
+                time.time() - self.pool_usage_time < full_interval):
+            summaries = self.vmem_mg.pool.get_storage_pools(
+                verify=True,
+                include_full_info=False,
+            )
+            if self._get_pool_signature(summaries) == self.pool_signature:
+                LOG.debug("Storage pools unchanged, reusing device totals.")
+                return self.pool_usage
+
+        # DNS answers are cached across calls, see FQDNCache
+        owner = FQDN_CACHE.getfqdn(san_ip)
         pools = self.vmem_mg.pool.get_storage_pools(
             verify=True,
             include_full_info=True,
         )
 
+        # vmemclient answers with every pool's device details at once,
+        # and has no call for a single pool's details, so the peak
+        # memory is that of the whole answer.  Only the per-pool totals
+        # are kept past this pass.
+        usage = []
+        summaries = []
         for short_info, full_info in pools:
             mod = ''
             pool_free_mb = 0
             pool_total_mb = 0
             for dev in full_info.get('physicaldevices', []):
-                if dev['owner'] not in owner_lookup:
-                    owner_lookup[dev['owner']] = socket.getfqdn(dev['owner'])
-                if owner_lookup[dev['owner']] == owner:
+                if FQDN_CACHE.getfqdn(dev['owner']) == owner:
                     pool_free_mb += dev['availsize_mb']
                     pool_total_mb += dev['size_mb']
                 elif not mod:
@@ -997,19 +2632,47 @@ class V7000Common(object):
             LOG.debug('pool %(pool)s: %(avail)s / %(total)s MB free%(mod)s',
                       {'pool': short_info['name'], 'avail': pool_free_mb,
                        'total': pool_total_mb, 'mod': mod})
-            free_gb += pool_free_mb // 1024
-            total_gb += pool_total_mb // 1024
+            usage.append((short_info['name'], pool_free_mb, pool_total_mb))
+            summaries.append(short_info)
 
-        data = {
-            'vendor_name': 'Violin Memory, Inc.',
-            'reserved_percentage': 0,
-            'QoS_support': False,
-            'free_capacity_gb': free_gb,
-            'total_capacity_gb': total_gb,
-            'consistencygroup_support': True,
-        }
+        self.pool_usage = usage
+        self.pool_signature = self._get_pool_signature(summaries)
+        self.pool_usage_time = time.time()
 
-        return data
+        return usage
+
+    def _get_pool_signature(self, summaries):
+        """Reduce short pool summaries to the numbers that show a change.
+
+        :param summaries: short info dicts of the storage pools
+        :returns: dict of pool name to (size, avail, used) MB
+        """
+        return dict((p['name'], (p.get('size_mb'), p.get('availsize_mb'),
+                                 p.get('usedsize_mb')))
+                    for p in summaries)
+
+    def _get_pool_capabilities(self, pool_name):
+        """Kinds of luns the backend will place in a storage pool.
+
+        Mirrors the way select_storage_pool() uses the configured
+        dedup pools, so the scheduler only offers a pool to volume
+        types the backend would accept there.
+
+        :param pool_name: name of the storage pool
+        :returns: dict of thin, thick and dedup capabilities
+        """
+        if pool_name in self.config.violin_dedup_only_pools:
+            return {'thin_provisioning_support': True,
+                    'thick_provisioning_support': False,
+                    'dedup': True}
+        elif pool_name in self.config.violin_dedup_capable_pools:
+            return {'thin_provisioning_support': True,
+                    'thick_provisioning_support': True,
+                    'dedup': True}
+        else:
+            return {'thin_provisioning_support': True,
+                    'thick_provisioning_support': True,
+                    'dedup': False}
 
     def _wait_run_delete_lun_snapshot(self, snapshot):
         """Run and wait for LUN snapshot to complete.
@@ -1020,39 +2683,29 @@ class V7000Common(object):
         cinder_snapshot_id = snapshot['id']
 
         comment = self._compress_snapshot_id(cinder_snapshot_id)
-        oid = self.vmem_mg.snapshot.snapshot_comment_to_object_id(
-            cinder_volume_id, comment)
+        oid = self._get_timemark_oid(cinder_volume_id, comment)
 
-        def _loop_func():
-            LOG.debug("Entering _wait_run_delete_lun_snapshot loop: "
-                      "vol=%(vol)s, snap_id=%(snap_id)s, oid=%(oid)s" %
-                      {'vol': cinder_volume_id,
-                       'oid': oid,
-                       'snap_id': cinder_snapshot_id})
+        LOG.debug("Deleting snapshot: vol=%(vol)s, snap_id=%(snap_id)s, "
+                  "oid=%(oid)s", {'vol': cinder_volume_id,
+                                  'oid': oid,
+                                  'snap_id': cinder_snapshot_id})
 
-            ans = self.vmem_mg.snapshot.delete_lun_snapshot(
+        def _delete():
+            return self.vmem_mg.snapshot.delete_lun_snapshot(
                 snapshot_object_id=oid)
 
-            if ans['success']:
-                LOG.debug("Delete snapshot %(snap_id)s for %(vol)s: "
-                          "success" % {'vol': cinder_volume_id,
-                                       'snap_id': cinder_snapshot_id})
-                raise loopingcall.LoopingCallDone(retvalue=True)
-            else:
-                LOG.warn(_("Delete snapshot %(snap)s of %(vol)s "
-                           "encountered temporary error: %(msg)s") %
-                         {'snap': cinder_snapshot_id,
-                          'vol': cinder_volume_id,
-                          'msg': ans['msg']})
-
-        timer = loopingcall.FixedIntervalLoopingCall(_loop_func)
-        success = timer.start(interval=1).wait()
+        success = self.deletion_service.run(
+            _("snapshot %(snap)s of %(vol)s") %
+            {'snap': cinder_snapshot_id, 'vol': cinder_volume_id},
+            _delete, self.config.violin_request_timeout)
 
         if not success:
             raise exception.ViolinBackendErr(
                 _("Failed to delete snapshot %(snap)s of volume %(vol)s") %
                 {'snap': cinder_snapshot_id, 'vol': cinder_volume_id})
 
+        self._forget_timemark_oid(cinder_volume_id, comment)
+
     def _create_consistencygroup(self, context, group):
         """Creates a consistency group.
 
@@ -1233,6 +2886,10 @@ class V7000Common(object):
                    {'id': snapshot_id, 'name': group_name, 'msg': ans['msg']})
             raise exception.ViolinBackendErr(message=msg)
 
+        if ans.get('object_id'):
+            self._remember_timemark_oid(
+                group_name, comment, ans['object_id'])
+
         snapshots = db.snapshot_get_all_for_cgsnapshot(
             context, snapshot_id)
 
@@ -1250,43 +2907,34 @@ class V7000Common(object):
         :param comment: the cgsnapshot comment
         :param snapshots: list of snapshot dictionaries
         """
-        oid_list = {}
-        last_values = {}
-        times_consistent = 0
-        update_location = 'totalUsedBlocks'
+        def _get_oid(snapshot):
+            return (snapshot['volume_id'],
+                    self._get_timemark_oid(snapshot['volume_id'], comment))
 
-        for snapshot in snapshots:
-            oid = self.vmem_mg.snapshot.snapshot_comment_to_object_id(
-                snapshot['volume_id'], comment)
-            oid_list[snapshot['volume_id']] = oid
-            last_values[snapshot['volume_id']] = None
+        def _get_used_blocks(oid):
+            ans = self.vmem_mg.snapshot.get_snapshot_info(
+                snapshot_object_id=oid)
+            return ans['totalUsedBlocks']
 
-        def _loop_func():
-            global times_consistent
-            was_consistent = True
+        pool = greenpool.GreenPool(CONCERTO_CG_WAIT_CONCURRENCY)
+        oids = dict(pool.imap(_get_oid, snapshots))
+        stabilizer = CGSnapshotStabilizer(_get_used_blocks, oids)
+        schedule = self._new_poll_schedule()
 
+        def _loop_func():
             LOG.debug(_("Entering wait for consisgroup snapshot _loop_func: " +
                         "group=%(group)s, comment=%(comment)s") %
                       {'group': group,
                        'comment': comment})
 
-            # For now, we have to check that each individual snapshot finished
-            for snapshot in snapshots:
-                ans = self.vmem_mg.snapshot.get_snapshot_info(
-                    snapshot_object_id=oid_list[snapshot['volume_id']])
-                if ans[update_location] != last_values[snapshot['volume_id']]:
-                    was_consistent = False
-                    last_values[snapshot['volume_id']] = ans[update_location]
-
-            if was_consistent:
-                times_consistent += 1
-                if times_consistent >= 3:
-                    raise loopingcall.LoopingCallDone(retvalue=True)
-            else:
-                times_consistent = 0
+            # Check that each individual snapshot finished
+            if stabilizer.check():
+                raise loopingcall.LoopingCallDone(retvalue=True)
+
+            return schedule.next_interval()
 
-        timer = loopingcall.FixedIntervalLoopingCall(_loop_func)
-        success = timer.start(interval=1).wait()
+        timer = loopingcall.DynamicLoopingCall(_loop_func)
+        success = timer.start().wait()
 
         if not success:
             raise exception.ViolinBackendErr(
@@ -1310,34 +2958,22 @@ class V7000Common(object):
         comment = self._compress_snapshot_id(snapshot_id)
         model_update = {'status': cgsnapshot['status']}
 
-        oid = self.vmem_mg.snapshot.snapgroup_snapshot_comment_to_object_id(
-            group_name, comment)
+        oid = self._get_snapgroup_timemark_oid(group_name, comment)
 
-        def _loop_func():
-            LOG.debug(_("Entering delete cgsnapshot's _loop_func loop: " +
-                        "group=%(group)s, snap_id=%(snap_id)s, oid=%(oid)s") %
-                      {'group': group_name,
-                       'snap_id': snapshot_id,
-                       'oid': oid})
+        LOG.debug(_("Deleting cgsnapshot: " +
+                    "group=%(group)s, snap_id=%(snap_id)s, oid=%(oid)s") %
+                  {'group': group_name,
+                   'snap_id': snapshot_id,
+                   'oid': oid})
 
-            ans = self.vmem_mg.snapshot.delete_snapgroup_snapshot(
+        def _delete():
+            return self.vmem_mg.snapshot.delete_snapgroup_snapshot(
                 snapshot_object_id=oid)
 
-            if ans['success']:
-                LOG.debug(_("Delete cgsnapshot %(snap_id)s for " +
-                            "%(group)s: success") %
-                          {'group': group_name,
-                           'snap_id': snapshot_id})
-                raise loopingcall.LoopingCallDone(retvalue=True)
-            else:
-                LOG.warn(_("Delete snapshot %(snap)s of %(group)s "
-                           "encountered temporary error: %(msg)s") %
-                         {'snap': snapshot_id,
-                          'group': group_name,
-                          'msg': ans['msg']})
-
-        timer = loopingcall.FixedIntervalLoopingCall(_loop_func)
-        success = timer.start(interval=1).wait()
+        success = self.deletion_service.run(
+            _("cgsnapshot %(snap)s of %(group)s") %
+            {'snap': snapshot_id, 'group': group_name},
+            _delete, self.config.violin_request_timeout)
 
         if not success:
             raise exception.ViolinBackendErr(
@@ -1347,6 +2983,9 @@ class V7000Common(object):
         snapshots = db.snapshot_get_all_for_cgsnapshot(
             context, snapshot_id)
 
+        self._forget_snapgroup_timemarks(
+            group_name, comment, [x['volume_id'] for x in snapshots])
+
         for snapshot in snapshots:
             snapshot['status'] = 'deleted'
 
@@ -1416,17 +3055,71 @@ class V7000Common(object):
         # Create the consistencygroup
         self._create_consistencygroup(context, group)
 
-        # Perform the copy
-        for snapshot, volume in zip(snapshots, volumes):
+        def _copy(pair):
+            snapshot, volume = pair
             # Each snapshot in a consistency group has the same comment, which
             # is created based on cgsnapshot['id'].  So we need to modify the
             # snapshot's "id" to be the consistency group's "id".
             modified_snapshot = dict((a, b) for a, b in snapshot.items())
             modified_snapshot['id'] = cgsnapshot['id']
-            self._create_volume_from_snapshot(modified_snapshot, volume)
+            try:
+                self._create_volume_from_snapshot(modified_snapshot, volume)
+            except Exception as e:
+                LOG.exception(_LE("Copy of snapshot %(snap)s to volume "
+                                  "%(vol)s failed."),
+                              {'snap': snapshot['id'], 'vol': volume['id']})
+                return volume, e
+            return volume, None
+
+        # Perform the copies side by side, the copy scheduler keeps them
+        # within the per-pool limits
+        pool = greenpool.GreenPool(CONCERTO_CG_COPY_CONCURRENCY)
+        results = list(pool.imap(_copy, zip(snapshots, volumes)))
+
+        errors = [e for volume, e in results if e]
+        if errors:
+            self._rollback_consistencygroup_members(
+                group['id'], [volume for volume, e in results if not e],
+                volumes)
+            raise errors[0]
 
         return None, None
 
+    def _rollback_consistencygroup_members(self, group, created, volumes):
+        """Delete a consistency group that failed to be made.
+
+        The snapgroup is deleted along with the luns of the group.
+        Failures are logged but not raised, the luns may be partly or
+        not at all created.
+
+        :param group: consistencygroup name as a string
+        :param created: the volumes that were fully created
+        :param volumes: all the volumes of the group
+        """
+        if created:
+            try:
+                self._remove_from_consistencygroup(
+                    group, [volume['id'] for volume in created])
+            except Exception:
+                LOG.exception(_LE("Failed to remove the volumes of "
+                                  "consistencygroup %s."), group)
+
+        try:
+            ans = self.vmem_mg.snapshot.delete_snapgroup(group)
+            if not ans['success']:
+                LOG.error(_LE("Failed to delete consistencygroup %(name)s: "
+                              "%(msg)s"), {'name': group, 'msg': ans['msg']})
+        except Exception:
+            LOG.exception(_LE("Failed to delete consistencygroup %s."),
+                          group)
+
+        for volume in volumes:
+            try:
+                self._delete_lun(volume)
+            except Exception:
+                LOG.exception(_LE("Failed to delete volume %s."),
+                              volume['id'])
+
     def _create_consistencygroup_from_consistencygroup(self, context,
                                                        group, volumes,
                                                        source_cg, source_vols):
@@ -1470,44 +3163,64 @@ class V7000Common(object):
                     'msg': ans['msg']})
             raise exception.ViolinBackendErr(message=msg)
 
-        self._wait_for_cgsnapshot(source_cg['id'], comment, snapshots)
+        if ans.get('object_id'):
+            self._remember_timemark_oid(
+                source_cg['id'], comment, ans['object_id'])
 
-        # Next, create the consistencygroup from that cgsnapshot
-        self._create_consistencygroup_from_cgsnapshot(
-            context, group, volumes, cgsnapshot, snapshots)
+        try:
+            self._wait_for_cgsnapshot(source_cg['id'], comment, snapshots)
 
-        # Finally, delete the temporary snapshot
-        oid = self.vmem_mg.snapshot.snapgroup_snapshot_comment_to_object_id(
-            source_cg['id'], comment)
+            # Next, create the consistencygroup from that cgsnapshot
+            self._create_consistencygroup_from_cgsnapshot(
+                context, group, volumes, cgsnapshot, snapshots)
+        finally:
+            # Finally, delete the temporary snapshot, even when the copy
+            # failed and the new group was rolled back
+            self._delete_temp_cgsnapshot(source_cg['id'], snapshot_id,
+                                         comment,
+                                         [x['id'] for x in source_vols])
 
-        def _loop_func():
-            LOG.debug(_("Entering _loop_func to delete temp cgsnapshot: " +
-                        "group=%(group)s, snapshot=%(snap)s, oid=%(oid)s") %
-                      {'group': source_cg['id'],
-                       'snap': snapshot_id,
-                       'oid': oid})
+        # Done
+        return None, None
 
-            ans = self.vmem_mg.snapshot.delete_snapgroup_snapshot(
-                snapshot_object_id=oid)
+    def _delete_temp_cgsnapshot(self, group_id, snapshot_id, comment,
+                                volume_ids):
+        """Delete a temporary cgsnapshot, logging failures.
 
-            if ans['success']:
-                LOG.debug(_("Deleted temp cgsnapshot %(snap)s ok") %
-                          {'snap': snapshot_id})
-                raise loopingcall.LoopingCallDone(retvalue=True)
-            else:
-                LOG.warn(_("Delete temp cgsnapshot %(snap)s of %(group)s " +
-                           "encountered temporary error: %(msg)s") %
-                         {'snap': snapshot_id,
-                          'group': source_cg['id'],
-                          'msg': ans['msg']})
+        :param group_id: ID of the consistency group of the cgsnapshot
+        :param snapshot_id: ID the cgsnapshot was created with
+        :param comment: compressed snapshot ID used as TimeMark comment
+        :param volume_ids: IDs of the volumes in the group
+        """
+        try:
+            oid = self._get_snapgroup_timemark_oid(group_id, comment)
+        except Exception:
+            LOG.exception(_LE("Failed to find temp cgsnapshot %(snap)s of "
+                              "group %(group)s."),
+                          {'snap': snapshot_id, 'group': group_id})
+            return
+
+        LOG.debug(_("Deleting temp cgsnapshot: " +
+                    "group=%(group)s, snapshot=%(snap)s, oid=%(oid)s") %
+                  {'group': group_id,
+                   'snap': snapshot_id,
+                   'oid': oid})
+
+        def _delete():
+            return self.vmem_mg.snapshot.delete_snapgroup_snapshot(
+                snapshot_object_id=oid)
 
-        timer = loopingcall.FixedIntervalLoopingCall(_loop_func)
-        success = timer.start(interval=1).wait()
+        success = self.deletion_service.run(
+            _("temp cgsnapshot %(snap)s of %(group)s") %
+            {'snap': snapshot_id, 'group': group_id},
+            _delete, self.config.violin_request_timeout)
 
         if not success:
-            raise exception.ViolinBackendErr(
-                _("Failed to delete snapshot %(snap)s of group %(group)s") %
-                {'snap': snapshot_id, 'group': source_cg['id']})
-
-        # Done
-        return None, None
+            # The new group is complete, the leftover TimeMark is counted
+            # in the dead letters of the deletion service
+            LOG.error(_LE("Failed to delete temp cgsnapshot %(snap)s of "
+                          "group %(group)s."),
+                      {'snap': snapshot_id, 'group': group_id})
+            return
+
+        self._forget_snapgroup_timemarks(group_id, comment, volume_ids)
@@ -35,10 +35,13 @@ properly in an active-active HA configuration.  See OpenStack Cinder
 driver documentation for more information.
 """
 
+import time
+
 from oslo_log import log as logging
+from oslo_service import loopingcall
 
 from cinder import exception
-from cinder.i18n import _, _LE, _LI
+from cinder.i18n import _, _LE, _LI, _LW
 from cinder import utils
 from cinder.volume import driver
 from cinder.volume.drivers.san import san
@@ -61,10 +64,14 @@ class V7000FCPDriver(driver.FibreChannelDriver):
     def __init__(self, *args, **kwargs):
         super(V7000FCPDriver, self).__init__(*args, **kwargs)
         self.gateway_fc_wwns = []
+        self.lun_id_map = {}
+        self.initiator_target_maps = {}
+        self.fc_target_refresher = None
         self.stats = {}
         self.configuration.append_config_values(v7000_common.violin_opts)
         self.configuration.append_config_values(san.san_opts)
-        self.common = v7000_common.V7000Common(self.configuration)
+        self.common = v7000_common.V7000Common(self.configuration,
+                                               host=self.host)
         self.lookup_service = fczm_utils.create_lookup_service()
 
         LOG.info(_LI("Initialized driver %(name)s version: %(vers)s"),
@@ -75,7 +82,17 @@ class V7000FCPDriver(driver.FibreChannelDriver):
         super(V7000FCPDriver, self).do_setup(context)
 
         self.common.do_setup(context)
+        self.common._start_stats_collector(self.configuration.san_ip)
         self.gateway_fc_wwns = self._get_active_fc_targets()
+        self._invalidate_initiator_target_maps()
+
+        # Ports going down or coming back are picked up in the background
+        interval = self.configuration.violin_fc_target_refresh_interval
+        if interval > 0 and not self.fc_target_refresher:
+            self.fc_target_refresher = loopingcall.FixedIntervalLoopingCall(
+                self._refresh_active_fc_targets)
+            self.fc_target_refresher.start(interval=interval,
+                                           initial_delay=interval)
 
         # Register the client with the storage array
         fc_version = self.VERSION + "-FCP"
@@ -101,6 +118,26 @@ class V7000FCPDriver(driver.FibreChannelDriver):
         """Creates a clone of the specified volume."""
         self.common._create_lun_from_lun(src_vref, volume)
 
+    def clone_image(self, context, volume, image_location, image_meta,
+                    image_service):
+        """Creates a volume from an image lun cached on the array."""
+        return self.common._clone_image(volume, image_meta)
+
+    def copy_image_to_volume(self, context, volume, image_service, image_id):
+        """Fetches the image into the volume, then caches it."""
+        super(V7000FCPDriver, self).copy_image_to_volume(
+            context, volume, image_service, image_id)
+        self.common._cache_image_volume(context, volume, image_service,
+                                        image_id)
+
+    def migrate_volume(self, ctxt, volume, host):
+        """Migrates a volume to another pool of the same array."""
+        return self.common._migrate_volume(ctxt, volume, host)
+
+    def retype(self, ctxt, volume, new_type, diff, host):
+        """Changes the volume type of a volume on the array."""
+        return self.common._retype(ctxt, volume, new_type, diff, host)
+
     def delete_volume(self, volume):
         """Deletes a volume."""
         self.common._delete_lun(volume)
@@ -252,6 +289,8 @@ class V7000FCPDriver(driver.FibreChannelDriver):
             LOG.exception(_LE("LUN unexport failed!"))
             raise
 
+        self.lun_id_map.get(connector['host'], {}).pop(volume['id'], None)
+
     def _update_volume_stats(self):
         """Gathers array stats and converts them to GB values."""
         data = self.common._get_volume_stats(self.configuration.san_ip)
@@ -282,6 +321,42 @@ class V7000FCPDriver(driver.FibreChannelDriver):
 
         return self._convert_wwns_vmem_to_openstack(active_gw_fcp_wwns)
 
+    def _refresh_active_fc_targets(self):
+        """Re-read the active gateway WWNs and swap in any changes.
+
+        Runs periodically so that attaches stop advertising ports that
+        went down, and start using ports that came back, without a
+        restart of the volume service.
+        """
+        try:
+            new_wwns = self._get_active_fc_targets()
+        except Exception:
+            LOG.exception(_LE("Failed to refresh the FC target list."))
+            return
+
+        old_set = set(self.gateway_fc_wwns)
+        new_set = set(new_wwns)
+
+        if old_set == new_set:
+            return
+
+        if not new_set:
+            LOG.warning(_LW("No active FC targets found, keeping the "
+                            "previous list %s."), self.gateway_fc_wwns)
+            return
+
+        added = sorted(new_set - old_set)
+        removed = sorted(old_set - new_set)
+        if added:
+            LOG.info(_LI("FC target ports now active: %s."), added)
+        if removed:
+            LOG.warning(_LW("FC target ports no longer active: %s."),
+                        removed)
+
+        # Rebinding the attribute swaps the list in one step for readers
+        self.gateway_fc_wwns = new_wwns
+        self._invalidate_initiator_target_maps()
+
     def _convert_wwns_openstack_to_vmem(self, wwns):
         """Convert a list of Openstack WWNs to VMEM compatible WWN strings.
 
@@ -317,27 +392,45 @@ class V7000FCPDriver(driver.FibreChannelDriver):
             output.append(''.join(w[0:].split('-')))
         return output
 
+    def _update_lun_id_map(self, client_name):
+        """Refresh the volume name to lun ID map of a client.
+
+        The whole map is rebuilt from a single client info fetch, so
+        that lookups of individual volumes do not need to scan the
+        client's device list.
+
+        :param client_name:  name of client to refresh
+        :returns: dict of volume name to integer lun ID
+        """
+        v = self.common.vmem_mg
+
+        client_info = v.client.get_client_info(client_name)
+
+        lun_ids = {}
+        for x in client_info['FibreChannelDevices']:
+            lun_ids[x['name']] = int(x['lun'])
+
+        self.lun_id_map[client_name] = lun_ids
+        return lun_ids
+
     def _get_lun_id(self, volume_name, client_name):
         """Get the lun ID for an exported volume.
 
         If the lun is successfully assigned (exported) to a client, the
-        client info has the lun_id.
+        client info has the lun_id.  The cached map of the client is
+        used when it already knows the volume, otherwise it is
+        refreshed from the backend first.
 
         :param volume_name:  name of volume to query for lun ID
         :param client_name:  name of client associated with the volume
         :returns: integer value of lun ID
         """
-        v = self.common.vmem_mg
-        lun_id = -1
+        lun_ids = self.lun_id_map.get(client_name, {})
 
-        client_info = v.client.get_client_info(client_name)
+        if volume_name not in lun_ids:
+            lun_ids = self._update_lun_id_map(client_name)
 
-        for x in client_info['FibreChannelDevices']:
-            if volume_name == x['name']:
-                lun_id = x['lun']
-                break
-
-        return int(lun_id)
+        return lun_ids.get(volume_name, -1)
 
     def _is_lun_id_ready(self, volume_name, client_name):
         """Get the lun ID for an exported volume.
@@ -349,34 +442,37 @@ class V7000FCPDriver(driver.FibreChannelDriver):
         :param client_name:  name of client associated with the volume
         :returns: Returns True if lun is ready, False otherwise
         """
-
-        lun_id = -1
-        lun_id = self._get_lun_id(volume_name, client_name)
-        if lun_id != -1:
-            return True
-        else:
-            return False
+        lun_ids = self._update_lun_id_map(client_name)
+        return volume_name in lun_ids
 
     def _build_initiator_target_map(self, connector):
-        """Build the target_wwns and the initiator target map."""
+        """Build the target_wwns and the initiator target map.
+
+        Fabric lookups are cached per set of initiator WWPNs for
+        violin_fc_lookup_cache_ttl seconds, so the FC switches are only
+        queried once per host rather than once per attach.
+        """
         target_wwns = []
         init_targ_map = {}
 
         if self.lookup_service:
-            dev_map = self.lookup_service.get_device_mapping_from_network(
-                connector['wwpns'], self.gateway_fc_wwns)
-
-            for fabric_name in dev_map:
-                fabric = dev_map[fabric_name]
-                target_wwns += fabric['target_port_wwn_list']
-                for initiator in fabric['initiator_port_wwn_list']:
-                    if initiator not in init_targ_map:
-                        init_targ_map[initiator] = []
-                    init_targ_map[initiator] += fabric['target_port_wwn_list']
-                    init_targ_map[initiator] = list(
-                        set(init_targ_map[initiator]))
-
-            target_wwns = list(set(target_wwns))
+            key = frozenset(connector['wwpns'])
+            cached = self.initiator_target_maps.get(key)
+
+            if cached and cached[0] > time.time():
+                target_wwns, init_targ_map = cached[1], cached[2]
+            else:
+                target_wwns, init_targ_map = self._lookup_initiator_targets(
+                    connector)
+                ttl = self.configuration.violin_fc_lookup_cache_ttl
+                if ttl > 0:
+                    self.initiator_target_maps[key] = (
+                        time.time() + ttl, target_wwns, init_targ_map)
+
+            # hand out copies so callers cannot modify the cached entry
+            target_wwns = list(target_wwns)
+            init_targ_map = dict(
+                (i, list(t)) for i, t in init_targ_map.items())
 
         else:
             initiator_wwns = connector['wwpns']
@@ -386,15 +482,37 @@ class V7000FCPDriver(driver.FibreChannelDriver):
 
         return target_wwns, init_targ_map
 
-    def _is_initiator_connected_to_array(self, connector):
-        """Check if any initiator wwns still have active sessions."""
-        v = self.common.vmem_mg
+    def _lookup_initiator_targets(self, connector):
+        """Query the fabric for the targets visible to each initiator.
+
+        :param connector:  connector object provided by the Manager
+        :returns: tuple of target WWN list and initiator target map
+        """
+        target_wwns = set()
+        init_targ_map = {}
+
+        dev_map = self.lookup_service.get_device_mapping_from_network(
+            connector['wwpns'], self.gateway_fc_wwns)
+
+        for fabric in dev_map.values():
+            fabric_targets = fabric['target_port_wwn_list']
+            target_wwns.update(fabric_targets)
+            for initiator in fabric['initiator_port_wwn_list']:
+                init_targ_map.setdefault(initiator, set()).update(
+                    fabric_targets)
 
-        client = v.client.get_client_info(connector['host'])
+        return (list(target_wwns),
+                dict((i, list(t)) for i, t in init_targ_map.items()))
 
-        if len(client['FibreChannelDevices']):
-            # each entry in the FibreChannelDevices array is a dict
-            # describing an active lun assignment
+    def _invalidate_initiator_target_maps(self):
+        """Forget cached fabric lookups, e.g. after targets changed."""
+        self.initiator_target_maps = {}
+
+    def _is_initiator_connected_to_array(self, connector):
+        """Check if any initiator wwns still have active sessions."""
+        # each entry in the FibreChannelDevices array describes an
+        # active lun assignment, so an empty map means no sessions
+        if len(self._update_lun_id_map(connector['host'])):
             return True
         return False
 
@@ -30,8 +30,10 @@ volume_driver=cinder.volume.drivers.violin.v7000_fcp.V7000ISCSIDriver
 """
 
 import random
+import time
 import uuid
 
+from eventlet import greenthread
 from oslo_log import log as logging
 
 from cinder import exception
@@ -43,6 +45,8 @@ from cinder.volume.drivers.violin import v7000_common
 
 LOG = logging.getLogger(__name__)
 
+ISCSI_INTERFACES_STATE = 'iscsi-interfaces'
+
 
 class V7000ISCSIDriver(driver.ISCSIDriver):
     """Executes commands relating to iscsi based Violin Memory arrays.
@@ -59,9 +63,11 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
         super(V7000ISCSIDriver, self).__init__(*args, **kwargs)
         self.stats = {}
         self.gateway_iscsi_ip_addresses = []
+        self.lun_id_map = {}
         self.configuration.append_config_values(v7000_common.violin_opts)
         self.configuration.append_config_values(san.san_opts)
-        self.common = v7000_common.V7000Common(self.configuration)
+        self.common = v7000_common.V7000Common(self.configuration,
+                                               host=self.host)
 
         LOG.info(_LI("Initialized driver %(name)s version: %(vers)s"),
                  {'name': self.__class__.__name__, 'vers': self.VERSION})
@@ -71,6 +77,7 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
         super(V7000ISCSIDriver, self).do_setup(context)
 
         self.common.do_setup(context)
+        self.common._start_stats_collector(self.configuration.san_ip)
 
         # Register the client with the storage array
         iscsi_version = self.VERSION + "-ISCSI"
@@ -78,14 +85,20 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
             iscsi_version, protocol="iSCSI")
 
         # Getting iscsi IPs from the array is incredibly expensive,
-        # so only do it once.
+        # so only do it once, and reuse the answer of the previous run
+        # while it is verified again in the background.
         if self.configuration.violin_iscsi_target_ips:
             self.gateway_iscsi_ip_addresses = (
                 self.configuration.violin_iscsi_target_ips)
         else:
             LOG.warning(_LW("iSCSI target ip addresses not configured "))
-            self.gateway_iscsi_ip_addresses = (
-                self.common.vmem_mg.utility.get_iscsi_interfaces())
+            cached_ips = self._load_iscsi_interfaces()
+            if cached_ips:
+                self.gateway_iscsi_ip_addresses = cached_ips
+                greenthread.spawn_n(self._revalidate_iscsi_interfaces)
+            else:
+                self.gateway_iscsi_ip_addresses = (
+                    self._discover_iscsi_interfaces())
 
     def check_for_setup_error(self):
         """Returns an error if prerequisites aren't met."""
@@ -106,6 +119,26 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
         """Creates a clone of the specified volume."""
         self.common._create_lun_from_lun(src_vref, volume)
 
+    def clone_image(self, context, volume, image_location, image_meta,
+                    image_service):
+        """Creates a volume from an image lun cached on the array."""
+        return self.common._clone_image(volume, image_meta)
+
+    def copy_image_to_volume(self, context, volume, image_service, image_id):
+        """Fetches the image into the volume, then caches it."""
+        super(V7000ISCSIDriver, self).copy_image_to_volume(
+            context, volume, image_service, image_id)
+        self.common._cache_image_volume(context, volume, image_service,
+                                        image_id)
+
+    def migrate_volume(self, ctxt, volume, host):
+        """Migrates a volume to another pool of the same array."""
+        return self.common._migrate_volume(ctxt, volume, host)
+
+    def retype(self, ctxt, volume, new_type, diff, host):
+        """Changes the volume type of a volume on the array."""
+        return self.common._retype(ctxt, volume, new_type, diff, host)
+
     def delete_volume(self, volume):
         """Deletes a volume."""
         self.common._delete_lun(volume)
@@ -266,6 +299,8 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
             LOG.exception(_LE("LUN unexport failed!"))
             raise
 
+        self.lun_id_map.get(connector['host'], {}).pop(volume['id'], None)
+
     def _update_volume_stats(self):
         """Gathers array stats and converts them to GB values."""
         data = self.common._get_volume_stats(self.configuration.san_ip)
@@ -280,34 +315,55 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
 
         self.stats = data
 
-    def _get_lun_id(self, volume_name, client_name):
-        """Get the lun ID for an exported volume.
+    def _update_lun_id_map(self, client_name):
+        """Refresh the volume name to lun ID map of a client.
 
-        If the lun is successfully assigned (exported) to a client, the
-        client info has the lun_id.
+        The whole map is rebuilt from a single client info fetch, so
+        that lookups of individual volumes do not need to scan the
+        client's device list.
 
         Note: The structure returned for iscsi is different from the
         one returned for FC. Therefore this funtion is here instead of
         common.
 
         Arguments:
-            volume_name -- name of volume to query for lun ID
-            client_name -- name of client associated with the volume
+            client_name -- name of client to refresh
 
         Returns:
-            lun_id -- integer value of lun ID
+            lun_ids -- dict of volume name to integer lun ID
         """
         v = self.common.vmem_mg
-        lun_id = -1
 
         client_info = v.client.get_client_info(client_name)
 
+        lun_ids = {}
         for x in client_info['ISCSIDevices']:
-            if volume_name == x['name']:
-                lun_id = x['lun']
-                break
+            lun_ids[x['name']] = int(x['lun'])
 
-        return int(lun_id)
+        self.lun_id_map[client_name] = lun_ids
+        return lun_ids
+
+    def _get_lun_id(self, volume_name, client_name):
+        """Get the lun ID for an exported volume.
+
+        If the lun is successfully assigned (exported) to a client, the
+        client info has the lun_id.  The cached map of the client is
+        used when it already knows the volume, otherwise it is
+        refreshed from the backend first.
+
+        Arguments:
+            volume_name -- name of volume to query for lun ID
+            client_name -- name of client associated with the volume
+
+        Returns:
+            lun_id -- integer value of lun ID
+        """
+        lun_ids = self.lun_id_map.get(client_name, {})
+
+        if volume_name not in lun_ids:
+            lun_ids = self._update_lun_id_map(client_name)
+
+        return lun_ids.get(volume_name, -1)
 
     def _is_lun_id_ready(self, volume_name, client_name):
         """Get the lun ID for an exported volume.
@@ -315,10 +371,6 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
         If the lun is successfully assigned (exported) to a client, the
         client info has the lun_id.
 
-        Note: The structure returned for iscsi is different from the
-        one returned for FC. Therefore this funtion is here instead of
-        common.
-
         Arguments:
             volume_name -- name of volume to query for lun ID
             client_name -- name of client associated with the volume
@@ -326,13 +378,72 @@ class V7000ISCSIDriver(driver.ISCSIDriver):
         Returns:
             lun_id -- Returns True or False
         """
+        lun_ids = self._update_lun_id_map(client_name)
+        return volume_name in lun_ids
 
-        lun_id = -1
-        lun_id = self._get_lun_id(volume_name, client_name)
-        if lun_id != -1:
-            return True
-        else:
-            return False
+    def _discover_iscsi_interfaces(self):
+        """Ask the array for its iSCSI interfaces and save the answer.
+
+        Returns:
+            ips -- list of iSCSI target IP addresses
+        """
+        v = self.common.vmem_mg
+
+        ips = v.utility.get_iscsi_interfaces()
+
+        self.common._save_state(ISCSI_INTERFACES_STATE, {
+            'san_ip': self.configuration.san_ip,
+            'version': v.version,
+            'timestamp': time.time(),
+            'interfaces': ips,
+        })
+
+        return ips
+
+    def _load_iscsi_interfaces(self):
+        """Load the iSCSI interfaces saved by a previous run.
+
+        The saved list is only used if it was taken from the same
+        gateway running the same array software version.
+
+        Returns:
+            ips -- list of iSCSI target IP addresses, or None
+        """
+        state = self.common._load_state(ISCSI_INTERFACES_STATE)
+
+        if not state or not state.get('interfaces'):
+            return None
+
+        if (state.get('san_ip') != self.configuration.san_ip or
+                state.get('version') != self.common.vmem_mg.version):
+            LOG.info(_LI("Saved iSCSI interfaces are from a different "
+                         "array or version, rediscovering."))
+            return None
+
+        LOG.info(_LI("Using iSCSI interfaces saved %(age)d seconds "
+                     "ago: %(ips)s"),
+                 {'age': time.time() - state.get('timestamp', 0),
+                  'ips': state['interfaces']})
+
+        return state['interfaces']
+
+    def _revalidate_iscsi_interfaces(self):
+        """Rediscover the iSCSI interfaces and swap in any changes."""
+        try:
+            ips = self._discover_iscsi_interfaces()
+        except Exception:
+            LOG.exception(_LE("Failed to revalidate iSCSI interfaces, "
+                              "keeping %s."), self.gateway_iscsi_ip_addresses)
+            return
+
+        if not ips:
+            LOG.warning(_LW("Array reported no iSCSI interfaces, keeping "
+                            "%s."), self.gateway_iscsi_ip_addresses)
+        elif set(ips) != set(self.gateway_iscsi_ip_addresses):
+            LOG.info(_LI("iSCSI interfaces changed from %(old)s to "
+                         "%(new)s."),
+                     {'old': self.gateway_iscsi_ip_addresses, 'new': ips})
+            self.gateway_iscsi_ip_addresses = ips
 
     def _get_iqn(self, connector):
         # The vmemclient connection properties list hostname field may